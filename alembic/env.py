@@ -2,6 +2,7 @@ from logging.config import fileConfig
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 from alembic import context
+from app.config import get_settings
 from app.models import Base
 
 config = context.config
@@ -9,13 +10,24 @@ config = context.config
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
+# Адрес базы берется из настроек приложения (DATABASE_URL), как и у самого приложения
+config.set_main_option("sqlalchemy.url", get_settings().database_url.replace("%", "%%"))
+
 target_metadata = Base.metadata
 
+# Виртуальные таблицы SQLite (R*Tree, FTS5) и их служебные таблицы создаются
+# миграциями вручную, автогенерация их не сравнивает
+VIRTUAL_TABLE_PREFIXES = ("buildings_rtree", "organizations_fts")
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (type_ == "table" and name.startswith(VIRTUAL_TABLE_PREFIXES))
+
 def run_migrations_offline() -> None:
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -32,7 +44,11 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object,
+            # SQLite не умеет ALTER для большинства изменений - пересоздаем таблицы
+            render_as_batch=connection.dialect.name == "sqlite"
         )
 
         with context.begin_transaction():
@@ -0,0 +1,62 @@
+"""change sequence
+
+Revision ID: 3f6b2d8c9a41
+Revises: e4a9c6f2d817
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3f6b2d8c9a41'
+down_revision = 'e4a9c6f2d817'
+branch_labels = None
+depends_on = None
+
+# Таблицы с номерами изменений в порядке нумерации существующих записей
+CHANGE_TABLES = ['buildings', 'activities', 'organizations']
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    # Базы, созданные через create_all по текущим моделям, уже со счетчиком и столбцами
+    if not inspector.has_table('change_sequence'):
+        op.create_table(
+            'change_sequence',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('value', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.execute('INSERT INTO change_sequence (id, value) VALUES (1, 0)')
+    for table in CHANGE_TABLES:
+        if 'change_seq' not in {column['name'] for column in inspector.get_columns(table)}:
+            op.add_column(table, sa.Column('change_seq', sa.Integer(), nullable=True))
+        op.create_index(f'ix_{table}_change_seq', table, ['change_seq'], if_not_exists=True)
+
+    # Существующие записи нумеруются подряд: здания, виды деятельности, организации
+    seq = bind.scalar(sa.text('SELECT value FROM change_sequence WHERE id = 1'))
+    for table in CHANGE_TABLES:
+        records = sa.table(table, sa.column('id', sa.Integer), sa.column('change_seq', sa.Integer))
+        updates = []
+        for record_id in bind.scalars(
+            sa.select(records.c.id).where(records.c.change_seq.is_(None)).order_by(records.c.id)
+        ):
+            seq += 1
+            updates.append({'record_id': record_id, 'seq': seq})
+        if updates:
+            bind.execute(
+                records.update().where(records.c.id == sa.bindparam('record_id'))
+                .values(change_seq=sa.bindparam('seq')),
+                updates
+            )
+    bind.execute(sa.text('UPDATE change_sequence SET value = :seq WHERE id = 1'), {'seq': seq})
+
+
+def downgrade() -> None:
+    for table in reversed(CHANGE_TABLES):
+        op.drop_index(f'ix_{table}_change_seq', table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('change_seq')
+    op.drop_table('change_sequence')
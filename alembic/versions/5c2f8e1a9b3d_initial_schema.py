@@ -0,0 +1,201 @@
+"""initial schema
+
+Revision ID: 5c2f8e1a9b3d
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5c2f8e1a9b3d'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# DDL скопирован из app.models на момент этой ревизии: миграция не должна
+# меняться вместе с моделями
+
+# Заполняем таблицу замыкания для видов деятельности, созданных до ее появления
+ACTIVITY_CLOSURE_BACKFILL_DDL = """
+    WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS (
+        SELECT id, id, 0 FROM activities
+        UNION ALL
+        SELECT tree.ancestor_id, activities.id, tree.depth + 1
+        FROM tree JOIN activities ON activities.parent_id = tree.descendant_id
+    )
+    INSERT INTO activity_closure (ancestor_id, descendant_id, depth)
+    SELECT ancestor_id, descendant_id, depth FROM tree
+    WHERE descendant_id NOT IN (SELECT descendant_id FROM activity_closure)
+"""
+
+# Пространственный индекс по координатам зданий (R*Tree) и триггеры синхронизации
+SQLITE_SPATIAL_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS buildings_rtree
+    USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS buildings_rtree_insert AFTER INSERT ON buildings
+    WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL
+    BEGIN
+        INSERT INTO buildings_rtree (id, min_lat, max_lat, min_lon, max_lon)
+        VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS buildings_rtree_update AFTER UPDATE OF latitude, longitude ON buildings
+    BEGIN
+        DELETE FROM buildings_rtree WHERE id = old.id;
+        INSERT INTO buildings_rtree (id, min_lat, max_lat, min_lon, max_lon)
+        SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+        WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS buildings_rtree_delete AFTER DELETE ON buildings
+    BEGIN
+        DELETE FROM buildings_rtree WHERE id = old.id;
+    END
+    """,
+    # Досоздаем записи индекса для зданий, добавленных до его появления
+    """
+    INSERT INTO buildings_rtree (id, min_lat, max_lat, min_lon, max_lon)
+    SELECT id, latitude, latitude, longitude, longitude FROM buildings
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+      AND id NOT IN (SELECT id FROM buildings_rtree)
+    """
+]
+
+# Полнотекстовый индекс по названиям организаций (FTS5 с триграммами)
+SQLITE_FULL_TEXT_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS organizations_fts
+    USING fts5(name, tokenize='trigram')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS organizations_fts_insert AFTER INSERT ON organizations
+    BEGIN
+        INSERT INTO organizations_fts (rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS organizations_fts_update AFTER UPDATE OF name ON organizations
+    BEGIN
+        UPDATE organizations_fts SET name = new.name WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS organizations_fts_delete AFTER DELETE ON organizations
+    BEGIN
+        DELETE FROM organizations_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    INSERT INTO organizations_fts (rowid, name)
+    SELECT id, name FROM organizations
+    WHERE id NOT IN (SELECT rowid FROM organizations_fts)
+    """
+]
+
+
+def _create_table(name, *columns, indexes=()):
+    # Базы, созданные раньше через create_all, уже содержат таблицы:
+    # создаем только недостающие, чтобы миграция подхватывала и их
+    if sa.inspect(op.get_bind()).has_table(name):
+        return
+    op.create_table(name, *columns)
+    for column, unique in indexes:
+        op.create_index(f'ix_{name}_{column}', name, [column], unique=unique)
+
+
+def upgrade() -> None:
+    _create_table(
+        'activities',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('parent_id', sa.Integer(), nullable=True),
+        sa.Column('level', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['parent_id'], ['activities.id']),
+        sa.PrimaryKeyConstraint('id'),
+        indexes=[('id', False), ('name', False)]
+    )
+    _create_table(
+        'buildings',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('address', sa.String(), nullable=True),
+        sa.Column('latitude', sa.Float(), nullable=True),
+        sa.Column('longitude', sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        indexes=[('id', False), ('address', False)]
+    )
+    _create_table(
+        'organizations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('building_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['building_id'], ['buildings.id']),
+        sa.PrimaryKeyConstraint('id'),
+        indexes=[('id', False), ('name', False)]
+    )
+    _create_table(
+        'phones',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('number', sa.String(), nullable=True),
+        sa.Column('organization_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['organization_id'], ['organizations.id']),
+        sa.PrimaryKeyConstraint('id'),
+        indexes=[('id', False), ('number', False)]
+    )
+    _create_table(
+        'organization_phones',
+        sa.Column('organization_id', sa.Integer(), nullable=True),
+        sa.Column('phone_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['organization_id'], ['organizations.id']),
+        sa.ForeignKeyConstraint(['phone_id'], ['phones.id'])
+    )
+    _create_table(
+        'organization_activity',
+        sa.Column('organization_id', sa.Integer(), nullable=True),
+        sa.Column('activity_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['activity_id'], ['activities.id']),
+        sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'])
+    )
+    _create_table(
+        'activity_closure',
+        sa.Column('ancestor_id', sa.Integer(), nullable=False),
+        sa.Column('descendant_id', sa.Integer(), nullable=False),
+        sa.Column('depth', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['ancestor_id'], ['activities.id']),
+        sa.ForeignKeyConstraint(['descendant_id'], ['activities.id']),
+        sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id'),
+        indexes=[('descendant_id', False)]
+    )
+    _create_table(
+        'organization_documents',
+        sa.Column('organization_id', sa.Integer(), nullable=False),
+        sa.Column('document', sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(['organization_id'], ['organizations.id']),
+        sa.PrimaryKeyConstraint('organization_id')
+    )
+
+    op.execute(ACTIVITY_CLOSURE_BACKFILL_DDL)
+    # R*Tree и FTS5 есть только в SQLite; остальные базы ищут без них
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in SQLITE_SPATIAL_INDEX_DDL + SQLITE_FULL_TEXT_INDEX_DDL:
+            op.execute(statement)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS organizations_fts')
+        op.execute('DROP TABLE IF EXISTS buildings_rtree')
+    op.drop_table('organization_documents')
+    op.drop_table('activity_closure')
+    op.drop_table('organization_activity')
+    op.drop_table('organization_phones')
+    op.drop_table('phones')
+    op.drop_table('organizations')
+    op.drop_table('buildings')
+    op.drop_table('activities')
@@ -0,0 +1,73 @@
+"""association keys and foreign key indexes
+
+Revision ID: 8d4b6a2e7f10
+Revises: 5c2f8e1a9b3d
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8d4b6a2e7f10'
+down_revision = '5c2f8e1a9b3d'
+branch_labels = None
+depends_on = None
+
+# Таблица связи, связываемая таблица и столбец второй стороны связи
+ASSOCIATION_TABLES = [
+    ('organization_phones', 'phones', 'phone_id'),
+    ('organization_activity', 'activities', 'activity_id'),
+]
+
+
+def _has_primary_key(table: str) -> bool:
+    return bool(sa.inspect(op.get_bind()).get_pk_constraint(table)['constrained_columns'])
+
+
+def _rebuild_association(table: str, target: str, column: str, primary_key: bool):
+    """
+    Пересоздает таблицу связи (SQLite не добавляет первичный ключ через ALTER)
+    и переносит строки; с первичным ключом повторные и неполные связи отбрасываются
+    """
+    rebuilt = f'{table}_rebuilt'
+    columns = [
+        sa.Column('organization_id', sa.Integer(), nullable=not primary_key),
+        sa.Column(column, sa.Integer(), nullable=not primary_key),
+        sa.ForeignKeyConstraint(['organization_id'], ['organizations.id']),
+        sa.ForeignKeyConstraint([column], [f'{target}.id']),
+    ]
+    if primary_key:
+        columns.append(sa.PrimaryKeyConstraint('organization_id', column))
+    op.create_table(rebuilt, *columns)
+    if primary_key:
+        op.execute(
+            f'INSERT INTO {rebuilt} (organization_id, {column}) '
+            f'SELECT DISTINCT organization_id, {column} FROM {table} '
+            f'WHERE organization_id IS NOT NULL AND {column} IS NOT NULL'
+        )
+    else:
+        op.execute(f'INSERT INTO {rebuilt} (organization_id, {column}) SELECT organization_id, {column} FROM {table}')
+    op.drop_table(table)
+    op.rename_table(rebuilt, table)
+
+
+def upgrade() -> None:
+    for table, target, column in ASSOCIATION_TABLES:
+        # Базы, созданные через create_all по текущим моделям, уже с ключами
+        if not _has_primary_key(table):
+            _rebuild_association(table, target, column, primary_key=True)
+        op.create_index(f'ix_{table}_{column}', table, [column, 'organization_id'], if_not_exists=True)
+
+    op.create_index('ix_phones_organization_id', 'phones', ['organization_id'], if_not_exists=True)
+    op.create_index('ix_organizations_building_id', 'organizations', ['building_id'], if_not_exists=True)
+    op.create_index('ix_activities_parent_id', 'activities', ['parent_id'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_activities_parent_id', table_name='activities')
+    op.drop_index('ix_organizations_building_id', table_name='organizations')
+    op.drop_index('ix_phones_organization_id', table_name='phones')
+    for table, target, column in ASSOCIATION_TABLES:
+        op.drop_index(f'ix_{table}_{column}', table_name=table)
+        _rebuild_association(table, target, column, primary_key=False)
@@ -0,0 +1,88 @@
+"""phone national numbers
+
+Revision ID: 9a1c5e7b3d62
+Revises: 3f6b2d8c9a41
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '9a1c5e7b3d62'
+down_revision = '3f6b2d8c9a41'
+branch_labels = None
+depends_on = None
+
+phones = sa.table('phones', sa.column('id', sa.Integer), sa.column('number', sa.String),
+                  sa.column('normalized_number', sa.String))
+
+
+def normalize_phone_number(number):
+    # app.crud.normalize_phone_number на момент этой ревизии: любой
+    # десятизначный номер - национальный и получает код страны
+    digits = re.sub(r'[^0-9]', '', number)
+    if not digits:
+        return None
+    if len(digits) == 11 and digits[0] == '8':
+        return '7' + digits[1:]
+    if len(digits) == 10:
+        return '7' + digits
+    return digits
+
+
+def previous_normalize_phone_number(number):
+    # Нормализация предыдущей ревизии (e4a9c6f2d817), нужна для отката
+    digits = re.sub(r'[^0-9]', '', number)
+    if not digits:
+        return None
+    if len(digits) == 11 and digits[0] == '8':
+        return '7' + digits[1:]
+    if len(digits) == 10 and digits[0] == '9':
+        return '7' + digits
+    return digits
+
+
+def _renormalize(bind, normalize, condition):
+    """
+    Пересчитывает нормализованные номера строк, подходящих под condition.
+    Номер, уже записанный другой организацией, остается без нормализованного
+    значения, как повторы при первом заполнении столбца
+    """
+    seen = set(bind.scalars(
+        sa.select(phones.c.normalized_number).where(phones.c.normalized_number.is_not(None))
+    ))
+    updates = []
+    for phone_id, number, normalized in bind.execute(
+        sa.select(phones.c.id, phones.c.number, phones.c.normalized_number)
+        .where(condition).order_by(phones.c.id)
+    ):
+        renormalized = normalize(number or '')
+        if renormalized == normalized:
+            continue
+        seen.discard(normalized)
+        updates.append({
+            'phone_id': phone_id,
+            'normalized_number': renormalized if renormalized not in seen else None
+        })
+        seen.add(renormalized)
+    if updates:
+        bind.execute(
+            phones.update().where(phones.c.id == sa.bindparam('phone_id'))
+            .values(normalized_number=sa.bindparam('normalized_number')),
+            updates
+        )
+
+
+def upgrade() -> None:
+    # Десятизначные номера без префикса раньше получали код страны, только если
+    # начинались с 9; городские («(495) 123-45-67») сохранялись без него
+    _renormalize(op.get_bind(), normalize_phone_number, sa.func.length(phones.c.normalized_number) == 10)
+
+
+def downgrade() -> None:
+    # Городские номера, получившие код страны, снова хранятся десятью цифрами
+    # (номера с кодом страны во вводе не меняются и пропускаются)
+    _renormalize(op.get_bind(), previous_normalize_phone_number, sa.func.length(phones.c.normalized_number) == 11)
@@ -0,0 +1,120 @@
+"""organization clusters
+
+Revision ID: b7e3d91c4a25
+Revises: 8d4b6a2e7f10
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import math
+from collections import defaultdict
+
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3d91c4a25'
+down_revision = '8d4b6a2e7f10'
+branch_labels = None
+depends_on = None
+
+# Сетка кластеров на момент этой ревизии (см. app/clusters.py); скопирована
+# в миграцию, чтобы заполнение не менялось вместе с приложением
+MAX_CLUSTER_LEVEL = 16
+MAX_MERCATOR_LATITUDE = 85.05112878
+INSERT_CHUNK_SIZE = 5000
+
+
+def _cell_at(latitude, longitude, level):
+    cells = 1 << level
+    latitude = max(-MAX_MERCATOR_LATITUDE, min(MAX_MERCATOR_LATITUDE, latitude))
+    x = (longitude + 180) / 360 * cells
+    y = (1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * cells
+    return min(cells - 1, max(0, int(x))), min(cells - 1, max(0, int(y)))
+
+
+def _insert(bind, table, rows):
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        bind.execute(table.insert(), rows[start:start + INSERT_CHUNK_SIZE])
+
+
+def _backfill(bind):
+    # Агрегаты для уже существующих организаций: ячейка самого мелкого уровня
+    # считается один раз, крупные уровни получаются сдвигом ее номера
+    clusters = defaultdict(lambda: [0, 0.0, 0.0])
+    finest_cells = {}
+    for organization_id, latitude, longitude in bind.execute(sa.text(
+        'SELECT organizations.id, buildings.latitude, buildings.longitude '
+        'FROM organizations JOIN buildings ON buildings.id = organizations.building_id '
+        'WHERE buildings.latitude IS NOT NULL AND buildings.longitude IS NOT NULL'
+    )):
+        x, y = _cell_at(latitude, longitude, MAX_CLUSTER_LEVEL)
+        finest_cells[organization_id] = (x, y)
+        for level in range(MAX_CLUSTER_LEVEL + 1):
+            shift = MAX_CLUSTER_LEVEL - level
+            cluster = clusters[level, x >> shift, y >> shift]
+            cluster[0] += 1
+            cluster[1] += latitude
+            cluster[2] += longitude
+
+    activities = defaultdict(int)
+    for organization_id, activity_id in bind.execute(sa.text(
+        'SELECT organization_id, activity_id FROM organization_activity'
+    )):
+        if organization_id not in finest_cells:
+            continue
+        x, y = finest_cells[organization_id]
+        for level in range(MAX_CLUSTER_LEVEL + 1):
+            shift = MAX_CLUSTER_LEVEL - level
+            activities[level, x >> shift, y >> shift, activity_id] += 1
+
+    cluster_table = sa.table(
+        'organization_clusters', sa.column('level'), sa.column('cell_x'), sa.column('cell_y'),
+        sa.column('organization_count'), sa.column('latitude_sum'), sa.column('longitude_sum')
+    )
+    _insert(bind, cluster_table, [
+        {
+            'level': level, 'cell_x': x, 'cell_y': y,
+            'organization_count': count, 'latitude_sum': latitude_sum, 'longitude_sum': longitude_sum
+        }
+        for (level, x, y), (count, latitude_sum, longitude_sum) in clusters.items()
+    ])
+    activity_table = sa.table(
+        'organization_cluster_activities', sa.column('level'), sa.column('cell_x'), sa.column('cell_y'),
+        sa.column('activity_id'), sa.column('organization_count')
+    )
+    _insert(bind, activity_table, [
+        {'level': level, 'cell_x': x, 'cell_y': y, 'activity_id': activity_id, 'organization_count': count}
+        for (level, x, y, activity_id), count in activities.items()
+    ])
+
+
+def upgrade() -> None:
+    # Базы, созданные через create_all по текущим моделям, уже содержат таблицы
+    if sa.inspect(op.get_bind()).has_table('organization_clusters'):
+        return
+    op.create_table(
+        'organization_clusters',
+        sa.Column('level', sa.Integer(), nullable=False),
+        sa.Column('cell_x', sa.Integer(), nullable=False),
+        sa.Column('cell_y', sa.Integer(), nullable=False),
+        sa.Column('organization_count', sa.Integer(), nullable=False),
+        sa.Column('latitude_sum', sa.Float(), nullable=False),
+        sa.Column('longitude_sum', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('level', 'cell_x', 'cell_y')
+    )
+    op.create_table(
+        'organization_cluster_activities',
+        sa.Column('level', sa.Integer(), nullable=False),
+        sa.Column('cell_x', sa.Integer(), nullable=False),
+        sa.Column('cell_y', sa.Integer(), nullable=False),
+        sa.Column('activity_id', sa.Integer(), nullable=False),
+        sa.Column('organization_count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['activity_id'], ['activities.id']),
+        sa.PrimaryKeyConstraint('level', 'cell_x', 'cell_y', 'activity_id')
+    )
+    _backfill(op.get_bind())
+
+
+def downgrade() -> None:
+    op.drop_table('organization_cluster_activities')
+    op.drop_table('organization_clusters')
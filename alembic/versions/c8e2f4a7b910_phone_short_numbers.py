@@ -0,0 +1,65 @@
+"""phone short numbers
+
+Revision ID: c8e2f4a7b910
+Revises: 9a1c5e7b3d62
+Create Date: 2026-10-20 10:00:00.000000
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c8e2f4a7b910'
+down_revision = '9a1c5e7b3d62'
+branch_labels = None
+depends_on = None
+
+phones = sa.table('phones', sa.column('id', sa.Integer), sa.column('number', sa.String),
+                  sa.column('normalized_number', sa.String))
+
+
+def previous_normalize_phone_number(number):
+    # Нормализация предыдущей ревизии (9a1c5e7b3d62), нужна для отката
+    digits = re.sub(r'[^0-9]', '', number)
+    if not digits:
+        return None
+    if len(digits) == 11 and digits[0] == '8':
+        return '7' + digits[1:]
+    if len(digits) == 10:
+        return '7' + digits
+    return digits
+
+
+def upgrade() -> None:
+    # Короткие номера без кода города одинаковы в разных городах: они больше
+    # не нормализуются и не участвуют в уникальном индексе
+    op.execute(
+        phones.update().where(sa.func.length(phones.c.normalized_number) < 11)
+        .values(normalized_number=None)
+    )
+
+
+def downgrade() -> None:
+    # Короткие номера снова получают нормализованное значение; совпадающий
+    # с уже записанным номер остается пустым, как повторы при первом заполнении
+    bind = op.get_bind()
+    seen = set(bind.scalars(
+        sa.select(phones.c.normalized_number).where(phones.c.normalized_number.is_not(None))
+    ))
+    updates = []
+    for phone_id, number in bind.execute(
+        sa.select(phones.c.id, phones.c.number)
+        .where(phones.c.normalized_number.is_(None)).order_by(phones.c.id)
+    ):
+        normalized = previous_normalize_phone_number(number or '')
+        if normalized is not None and normalized not in seen:
+            seen.add(normalized)
+            updates.append({'phone_id': phone_id, 'normalized_number': normalized})
+    if updates:
+        bind.execute(
+            phones.update().where(phones.c.id == sa.bindparam('phone_id'))
+            .values(normalized_number=sa.bindparam('normalized_number')),
+            updates
+        )
@@ -0,0 +1,62 @@
+"""phone normalized number
+
+Revision ID: e4a9c6f2d817
+Revises: b7e3d91c4a25
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e4a9c6f2d817'
+down_revision = 'b7e3d91c4a25'
+branch_labels = None
+depends_on = None
+
+
+def normalize_phone_number(number):
+    # app.crud.normalize_phone_number на момент этой ревизии: десятизначный
+    # номер получает код страны, только если начинается с 9
+    digits = re.sub(r'[^0-9]', '', number)
+    if not digits:
+        return None
+    if len(digits) == 11 and digits[0] == '8':
+        return '7' + digits[1:]
+    if len(digits) == 10 and digits[0] == '9':
+        return '7' + digits
+    return digits
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    # Базы, созданные через create_all по текущим моделям, уже со столбцом
+    if 'normalized_number' not in {column['name'] for column in sa.inspect(bind).get_columns('phones')}:
+        op.add_column('phones', sa.Column('normalized_number', sa.String(), nullable=True))
+
+    # Нормализованный номер получает только первый из совпадающих телефонов,
+    # у повторов он остается пустым, чтобы уникальный индекс создался
+    phones = sa.table('phones', sa.column('id', sa.Integer), sa.column('number', sa.String),
+                      sa.column('normalized_number', sa.String))
+    seen = set()
+    updates = []
+    for phone_id, number in bind.execute(sa.select(phones.c.id, phones.c.number).order_by(phones.c.id)):
+        normalized = normalize_phone_number(number or '')
+        if normalized is not None and normalized not in seen:
+            seen.add(normalized)
+            updates.append({'phone_id': phone_id, 'normalized_number': normalized})
+    if updates:
+        bind.execute(
+            phones.update().where(phones.c.id == sa.bindparam('phone_id'))
+            .values(normalized_number=sa.bindparam('normalized_number')),
+            updates
+        )
+    op.create_index('ix_phones_normalized_number', 'phones', ['normalized_number'], unique=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_phones_normalized_number', table_name='phones')
+    with op.batch_alter_table('phones') as batch_op:
+        batch_op.drop_column('normalized_number')
@@ -0,0 +1,304 @@
+"""
+Кэш ответов поисковых эндпоинтов.
+
+Ключ кэша строится из метода, пути, нормализованных параметров запроса
+и тела (для POST-поиска) и привязан к глобальной версии данных, которую
+меняет каждая запись в базу. Версия же входит в ETag, поэтому
+If-None-Match проверяется без обращения к базе и к самому кэшу.
+
+Когда база - файл SQLite, версией служит номер последнего изменения
+каталога (таблица change_sequence), общий для всех процессов: одинаковый
+ответ любого воркера uvicorn получает одинаковый ETag. Записи других
+процессов замечает DataVersionMonitor: перед каждым запросом он сверяет
+PRAGMA data_version и при изменении перечитывает номер из базы.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+# Номер последнего изменения каталога; его выдает crud.next_change_seqs
+CHANGE_SEQUENCE_SQL = "SELECT value FROM change_sequence WHERE id = 1"
+
+_data_version = 0
+_data_version_lock = threading.Lock()
+# Без монитора версия живет в памяти процесса и обнуляется при перезапуске,
+# поэтому в ETag она входит вместе с идентификатором запуска
+_instance_id = uuid.uuid4().hex
+
+def get_data_version() -> int:
+    return _data_version
+
+def is_shared_data_version() -> bool:
+    # Версия - общий номер изменения каталога, а не счетчик процесса
+    return _monitor is not None
+
+def bump_data_version() -> int:
+    # Вызывается после каждой успешной записи в базу
+    global _data_version
+    if _monitor is not None:
+        # Собственная запись уже выдала номер изменения - перечитываем его
+        _monitor.refresh()
+        return _data_version
+    with _data_version_lock:
+        _data_version += 1
+        return _data_version
+
+def _set_data_version(version: int):
+    global _data_version
+    with _data_version_lock:
+        # Номер изменения только растет; более старое значение из параллельного чтения не откатывает версию
+        _data_version = max(_data_version, version)
+
+class DataVersionMonitor:
+    """
+    Замечает коммиты других соединений и процессов в файл SQLite.
+    PRAGMA data_version на отдельном соединении меняется после каждого
+    чужого коммита; проверка стоит одного обращения к общей памяти WAL
+    без чтения данных. После изменения версией данных процесса становится
+    номер последнего изменения из базы, поэтому кэш ответов и снимок
+    каталога перестают отдаваться, а снимок догружает только изменения
+    """
+
+    def __init__(self, path: str):
+        # Соединение без транзакций нужно только для PRAGMA data_version и счетчика изменений
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._seen = None
+        self.refresh()
+
+    def _read(self) -> int:
+        return self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def check(self) -> bool:
+        with self._lock:
+            changed = self._read() != self._seen
+        if changed:
+            self.refresh()
+        return changed
+
+    def refresh(self):
+        with self._lock:
+            # data_version запоминается до чтения номера: коммит между ними
+            # заметит следующая проверка
+            self._seen = self._read()
+            try:
+                row = self._connection.execute(CHANGE_SEQUENCE_SQL).fetchone()
+            except sqlite3.OperationalError:
+                # Схема еще не создана миграциями
+                row = None
+        _set_data_version(row[0] if row else 0)
+
+    def close(self):
+        self._connection.close()
+
+_monitor: Optional[DataVersionMonitor] = None
+
+def watch_database(path: str) -> DataVersionMonitor:
+    # Делает версией данных общий номер изменения и включает учет записей других процессов
+    global _monitor
+    _monitor = DataVersionMonitor(path)
+    return _monitor
+
+class DataVersionMiddleware:
+    """
+    ASGI-middleware: перед каждым HTTP-запросом проверяет, не писали ли
+    в базу другие процессы. Должно стоять снаружи ResponseCacheMiddleware
+    """
+
+    def __init__(self, app, monitor: DataVersionMonitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.monitor.check()
+        await self.app(scope, receive, send)
+
+class CachedResponse:
+    __slots__ = ("status", "headers", "body", "expires_at")
+
+    def __init__(self, status: int, headers: List[Tuple[bytes, bytes]], body: bytes, expires_at: float):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.expires_at = expires_at
+
+class ResponseCache:
+    """
+    LRU-кэш с ограничением числа записей и временем жизни.
+    Ключи включают версию данных, поэтому после записи старые
+    ответы просто перестают запрашиваться и вытесняются
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, status: int, headers: List[Tuple[bytes, bytes]], body: bytes):
+        entry = CachedResponse(status, headers, body, time.monotonic() + self.ttl_seconds)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class ResponseCacheMiddleware:
+    """
+    ASGI-middleware: отдает из кэша успешные ответы GET-запросов с префиксом
+    path_prefix и POST-запросов к путям cacheable_posts, проставляет ETag
+    и отвечает 304 на совпадающий If-None-Match
+    """
+
+    def __init__(
+        self,
+        app,
+        cache: ResponseCache,
+        path_prefix: str,
+        cacheable_posts: Tuple[str, ...] = (),
+        excluded_paths: Tuple[str, ...] = (),
+        max_body_size: int = 1024 * 1024
+    ):
+        self.app = app
+        self.cache = cache
+        self.path_prefix = path_prefix
+        self.cacheable_posts = set(cacheable_posts)
+        self.excluded_paths = set(excluded_paths)
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if not self._is_cacheable(scope):
+            await self.app(scope, receive, send)
+            return
+
+        body = b""
+        if scope["method"] == "POST":
+            body, receive = await self._read_body(receive)
+        key = self._make_key(scope, body)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+
+        version = get_data_version()
+        etag = self._make_etag(key, version)
+        request_headers = dict(scope["headers"])
+        if_none_match = request_headers.get(b"if-none-match", b"").decode("latin-1")
+        if etag in (tag.strip() for tag in if_none_match.split(",")):
+            await send({
+                "type": "http.response.start",
+                "status": 304,
+                "headers": [(b"etag", etag.encode())]
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        cached = self.cache.get((key, version))
+        if cached is not None:
+            await send({
+                "type": "http.response.start",
+                "status": cached.status,
+                "headers": cached.headers + [(b"x-cache", b"HIT")]
+            })
+            await send({"type": "http.response.body", "body": cached.body})
+            return
+
+        start_message = None
+        chunks = []
+        size = 0
+
+        async def send_and_capture(message):
+            nonlocal start_message, size
+            if message["type"] == "http.response.start":
+                if message["status"] == 200:
+                    message = dict(message)
+                    message["headers"] = list(message.get("headers", [])) + [(b"etag", etag.encode())]
+                start_message = message
+                await send(message)
+                return
+            if message["type"] == "http.response.body" and start_message["status"] == 200 and size <= self.max_body_size:
+                chunks.append(message.get("body", b""))
+                size += len(chunks[-1])
+                if not message.get("more_body", False) and size <= self.max_body_size:
+                    # Ответ, посчитанный по устаревшей версии, не кэшируем
+                    if get_data_version() == version:
+                        self.cache.set((key, version), 200, start_message["headers"], b"".join(chunks))
+            await send(message)
+
+        await self.app(scope, receive, send_and_capture)
+
+    def _is_cacheable(self, scope) -> bool:
+        if scope["type"] != "http":
+            return False
+        path = scope["path"]
+        if not path.startswith(self.path_prefix) or path in self.excluded_paths:
+            return False
+        return scope["method"] == "GET" or (scope["method"] == "POST" and path in self.cacheable_posts)
+
+    async def _read_body(self, receive):
+        # Читаем тело целиком и подменяем receive, чтобы приложение получило его заново
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return body, replay
+
+    @staticmethod
+    def _make_key(scope, body: bytes) -> Optional[str]:
+        query = sorted(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))
+        normalized_body = None
+        if body:
+            try:
+                normalized_body = json.loads(body)
+            except ValueError:
+                # Некорректное тело пусть разбирает само приложение
+                return None
+        return json.dumps(
+            [scope["method"], scope["path"], query, normalized_body],
+            sort_keys=True, ensure_ascii=False, separators=(",", ":")
+        )
+
+    @staticmethod
+    def _make_etag(key: str, version: int) -> str:
+        # Общий номер изменения одинаков во всех процессах, локальная версия - нет
+        scope = "shared" if is_shared_data_version() else _instance_id
+        digest = hashlib.sha1(f"{scope}:{version}:{key}".encode()).hexdigest()
+        return f'"{digest}"'
@@ -0,0 +1,244 @@
+"""
+Кластеры организаций для карты.
+
+Карта делится на сетку тайлов Web Mercator: на уровне level мир состоит
+из 2^level x 2^level ячеек. Для каждого уровня от 0 до MAX_CLUSTER_LEVEL
+в таблицах organization_clusters и organization_cluster_activities хранятся
+число организаций ячейки, суммы координат (для центроида) и число
+организаций по видам деятельности. При добавлении организаций агрегаты
+увеличиваются на их вклад, поэтому запрос кластеров для области карты
+читает только ячейки этой области.
+
+Полный пересчет агрегатов: python -m app.clusters
+"""
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import and_, delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+
+MAX_CLUSTER_LEVEL = 16  # Самые мелкие ячейки - около 600 м на экваторе
+CELLS_PER_TILE_LOG2 = 2  # Тайл карты делится на 4x4 ячейки кластеров
+MAX_VIEWPORT_CELLS = 1024  # Больше ячеек в области - берем уровень крупнее
+TOP_ACTIVITIES = 3
+MAX_MERCATOR_LATITUDE = 85.05112878  # Web Mercator не покрывает полюса
+REBUILD_CHUNK_SIZE = 5000
+
+def cell_at(latitude: float, longitude: float, level: int) -> Tuple[int, int]:
+    """
+    Номер ячейки (x, y) уровня level, в которую попадает точка;
+    y растет с севера на юг, как в нумерации тайлов карт
+    """
+    cells = 1 << level
+    latitude = max(-MAX_MERCATOR_LATITUDE, min(MAX_MERCATOR_LATITUDE, latitude))
+    x = (longitude + 180) / 360 * cells
+    y = (1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * cells
+    return min(cells - 1, max(0, int(x))), min(cells - 1, max(0, int(y)))
+
+def cell_bounds(level: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    # Границы ячейки: (min_lat, max_lat, min_lon, max_lon)
+    cells = 1 << level
+
+    def latitude(tile_y: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / cells))))
+
+    return latitude(y + 1), latitude(y), x / cells * 360 - 180, (x + 1) / cells * 360 - 180
+
+def _upsert(db: Session, table):
+    # INSERT ... ON CONFLICT есть и в SQLite, и в PostgreSQL с одинаковым API
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+def _cell_deltas(
+    locations: Iterable[Tuple[int, float, float]],
+    links: Iterable[Tuple[int, int]]
+):
+    """
+    Вклад организаций в ячейки всех уровней. Ячейка уровня level получается
+    сдвигом номера ячейки самого мелкого уровня, поэтому проекция считается
+    один раз на организацию
+    """
+    clusters: Dict[Tuple[int, int, int], list] = defaultdict(lambda: [0, 0.0, 0.0])
+    finest_cells = {}
+    for organization_id, latitude, longitude in locations:
+        if latitude is None or longitude is None:
+            continue
+        x, y = cell_at(latitude, longitude, MAX_CLUSTER_LEVEL)
+        finest_cells[organization_id] = (x, y)
+        for level in range(MAX_CLUSTER_LEVEL + 1):
+            shift = MAX_CLUSTER_LEVEL - level
+            cluster = clusters[level, x >> shift, y >> shift]
+            cluster[0] += 1
+            cluster[1] += latitude
+            cluster[2] += longitude
+
+    activities: Dict[Tuple[int, int, int, int], int] = defaultdict(int)
+    for organization_id, activity_id in links:
+        if organization_id not in finest_cells:
+            continue
+        x, y = finest_cells[organization_id]
+        for level in range(MAX_CLUSTER_LEVEL + 1):
+            shift = MAX_CLUSTER_LEVEL - level
+            activities[level, x >> shift, y >> shift, activity_id] += 1
+    return clusters, activities
+
+def _apply_deltas(db: Session, clusters: dict, activities: dict):
+    cluster_table = models.OrganizationCluster.__table__
+    if clusters:
+        statement = _upsert(db, cluster_table)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["level", "cell_x", "cell_y"],
+            set_={
+                "organization_count": cluster_table.c.organization_count + statement.excluded.organization_count,
+                "latitude_sum": cluster_table.c.latitude_sum + statement.excluded.latitude_sum,
+                "longitude_sum": cluster_table.c.longitude_sum + statement.excluded.longitude_sum,
+            }
+        ), [
+            {
+                "level": level, "cell_x": x, "cell_y": y,
+                "organization_count": count, "latitude_sum": latitude_sum, "longitude_sum": longitude_sum
+            }
+            for (level, x, y), (count, latitude_sum, longitude_sum) in clusters.items()
+        ])
+
+    activity_table = models.OrganizationClusterActivity.__table__
+    if activities:
+        statement = _upsert(db, activity_table)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["level", "cell_x", "cell_y", "activity_id"],
+            set_={"organization_count": activity_table.c.organization_count + statement.excluded.organization_count}
+        ), [
+            {"level": level, "cell_x": x, "cell_y": y, "activity_id": activity_id, "organization_count": count}
+            for (level, x, y, activity_id), count in activities.items()
+        ])
+
+def _locations_query():
+    return select(
+        models.Organization.id, models.Building.latitude, models.Building.longitude
+    ).join(models.Building, models.Building.id == models.Organization.building_id)
+
+def add_organizations(db: Session, organization_ids: List[int]):
+    """
+    Добавляет вклад новых организаций в агрегаты. Вызывается в той же
+    транзакции, что и вставка организаций и их связей с видами деятельности
+    """
+    if not organization_ids:
+        return
+    association = models.organization_activity
+    locations = db.execute(_locations_query().where(models.Organization.id.in_(organization_ids))).all()
+    links = db.execute(
+        select(association.c.organization_id, association.c.activity_id).where(
+            association.c.organization_id.in_(organization_ids)
+        )
+    ).all()
+    _apply_deltas(db, *_cell_deltas(locations, links))
+
+def rebuild(db: Session):
+    # Полный пересчет агрегатов (например, после изменения координат зданий)
+    db.execute(delete(models.OrganizationClusterActivity))
+    db.execute(delete(models.OrganizationCluster))
+    last_id = 0
+    while True:
+        organization_ids = db.scalars(
+            select(models.Organization.id).where(models.Organization.id > last_id)
+            .order_by(models.Organization.id).limit(REBUILD_CHUNK_SIZE)
+        ).all()
+        if not organization_ids:
+            break
+        add_organizations(db, organization_ids)
+        last_id = organization_ids[-1]
+
+def _viewport_cells(params: schemas.ClusterSearchParams) -> Tuple[int, int, int, int, int]:
+    """
+    Выбирает уровень сетки для масштаба карты и диапазон ячеек области.
+    Если область на этом уровне слишком велика, уровень укрупняется
+    """
+    level = min(params.zoom + CELLS_PER_TILE_LOG2, MAX_CLUSTER_LEVEL)
+    while True:
+        min_x, min_y = cell_at(params.max_lat, params.min_lon, level)
+        max_x, max_y = cell_at(params.min_lat, params.max_lon, level)
+        if level == 0 or (max_x - min_x + 1) * (max_y - min_y + 1) <= MAX_VIEWPORT_CELLS:
+            return level, min_x, max_x, min_y, max_y
+        level -= 1
+
+def _in_viewport(model, level: int, min_x: int, max_x: int, min_y: int, max_y: int):
+    return and_(
+        model.level == level,
+        model.cell_x.between(min_x, max_x),
+        model.cell_y.between(min_y, max_y)
+    )
+
+def get_clusters(db: Session, params: schemas.ClusterSearchParams) -> List[schemas.OrganizationCluster]:
+    viewport = _viewport_cells(params)
+    level = viewport[0]
+
+    cluster = models.OrganizationCluster
+    cells = db.execute(
+        select(cluster).where(_in_viewport(cluster, *viewport), cluster.organization_count > 0)
+    ).scalars().all()
+
+    # Топ видов деятельности каждой ячейки отбирается в базе оконной функцией
+    cluster_activity = models.OrganizationClusterActivity
+    ranked = select(
+        cluster_activity.cell_x,
+        cluster_activity.cell_y,
+        cluster_activity.activity_id,
+        cluster_activity.organization_count,
+        func.row_number().over(
+            partition_by=(cluster_activity.cell_x, cluster_activity.cell_y),
+            order_by=(cluster_activity.organization_count.desc(), cluster_activity.activity_id)
+        ).label("position")
+    ).where(_in_viewport(cluster_activity, *viewport)).subquery()
+    top = defaultdict(list)
+    for row in db.execute(
+        select(ranked, models.Activity.name)
+        .join(models.Activity, models.Activity.id == ranked.c.activity_id)
+        .where(ranked.c.position <= TOP_ACTIVITIES)
+        .order_by(ranked.c.cell_x, ranked.c.cell_y, ranked.c.position)
+    ):
+        top[row.cell_x, row.cell_y].append(schemas.ClusterActivity(
+            id=row.activity_id, name=row.name, organization_count=row.organization_count
+        ))
+
+    clusters = []
+    for cell in cells:
+        min_lat, max_lat, min_lon, max_lon = cell_bounds(level, cell.cell_x, cell.cell_y)
+        clusters.append(schemas.OrganizationCluster(
+            level=level,
+            x=cell.cell_x,
+            y=cell.cell_y,
+            organization_count=cell.organization_count,
+            center=schemas.GeoPoint(
+                latitude=cell.latitude_sum / cell.organization_count,
+                longitude=cell.longitude_sum / cell.organization_count
+            ),
+            bounds=schemas.GeoRectangle(
+                north_west=schemas.GeoPoint(latitude=max_lat, longitude=min_lon),
+                south_east=schemas.GeoPoint(latitude=min_lat, longitude=max_lon)
+            ),
+            top_activities=top[cell.cell_x, cell.cell_y]
+        ))
+    return clusters
+
+def main():
+    from .cache import bump_data_version
+    from .crud import next_change_seqs
+    from .database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        rebuild(db)
+        # Номер изменения в той же транзакции - общая версия данных, по которой
+        # запущенные процессы сбрасывают закэшированные ответы кластеров
+        next_change_seqs(db, 1)
+        db.commit()
+        bump_data_version()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+from functools import lru_cache
+from typing import Optional
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+class Settings(BaseSettings):
+    """
+    Настройки приложения. Значения читаются из переменных окружения
+    (имя переменной - имя поля в верхнем регистре) и файла .env
+    """
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    # Используем SQLite вместо PostgreSQL для простоты
+    database_url: str = "sqlite:///./organizations.db"
+    # Отдельный пул соединений только для чтения; без URL читаем ту же базу
+    database_read_url: Optional[str] = None
+    database_read_pool: bool = False
+
+    # По умолчанию пул совпадает с лимитом потоков, в которых FastAPI
+    # выполняет синхронные эндпоинты (40 в anyio)
+    db_pool_size: int = 40
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+
+    # Прагмы SQLite, выставляемые на каждом новом соединении
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_cache_size_kib: int = 64 * 1024
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+
+    # Кэш ответов эндпоинтов /api/organizations/*
+    response_cache_enabled: bool = True
+    response_cache_max_entries: int = 1024
+    response_cache_ttl_seconds: float = 60
+
+    # Метрики запросов: заголовок Server-Timing и эндпоинт /metrics
+    metrics_enabled: bool = True
+    # Запросы к базе дольше порога пишутся в лог app.sql.slow; пусто - лог выключен
+    slow_query_log_ms: Optional[float] = None
+
+    # Снимок каталога в памяти: поиск по ID, зданию, виду деятельности
+    # и геопоиск обслуживаются без обращения к базе
+    snapshot_enabled: bool = False
+
+    # Проверять перед каждым запросом, не писали ли в файл SQLite другие
+    # процессы (несколько воркеров uvicorn, python -m app.ingest)
+    watch_external_writes: bool = True
+
+@lru_cache
+def get_settings() -> Settings:
+    return Settings()
@@ -1,56 +1,334 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from . import models, schemas
-from typing import List, Optional
+from sqlalchemy.orm import Query, Session, joinedload, selectinload
+from sqlalchemy import bindparam, func, select, insert, delete, literal, literal_column, not_, or_, and_, union_all, update
+from . import clusters, models, schemas
+from .cache import bump_data_version
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import json
 import math
+import re
+import numpy as np
+
+EARTH_RADIUS_KM = 6371  # Радиус Земли в километрах
+KNN_INITIAL_RADIUS_KM = 1.0  # Стартовый радиус поиска ближайших
+KNN_RADIUS_GROWTH = 2  # Во сколько раз радиус растет на каждом шаге
+KNN_DIRECT_CANDIDATES = 5000  # До стольких организаций вида деятельности расстояния считаются до всех
+FTS_MIN_QUERY_LENGTH = 3  # Минимальная длина запроса для триграммного индекса
+SEARCH_ESTIMATE_CAP = 5000  # Предел подсчета кандидатов при оценке избирательности фильтра
+PHONE_COUNTRY_CODE = "7"  # Код страны для номеров, записанных без него
+PHONE_FULL_NUMBER_DIGITS = 11  # Короче - номер без кода города, он не нормализуется
+PHONE_LOOKUP_CHUNK_SIZE = 1000  # Номеров в одном IN-запросе при пакетном поиске
+
+# Типы записей ленты изменений и их модели
+CHANGE_FEED_ENTITIES = (
+    ("building", models.Building),
+    ("activity", models.Activity),
+    ("organization", models.Organization),
+)
+
+# Номера изменений
+def next_change_seqs(db: Session, count: int) -> range:
+    """
+    Выделяет count следующих номеров изменений. UPDATE счетчика держит
+    блокировку записи до конца транзакции, поэтому номера фиксируются
+    в порядке выделения и лента изменений их не пропускает
+    """
+    counter = models.ChangeSequence
+    last = db.execute(
+        update(counter).where(counter.id == 1).values(value=counter.value + count).returning(counter.value)
+    ).scalar_one()
+    return range(last - count + 1, last + 1)
+
+def mark_changed(db: Session, model, ids: List[int]):
+    # Новые номера изменений уже существующим записям (например, при пересборке документов)
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return
+    table = model.__table__
+    db.execute(
+        table.update().where(table.c.id == bindparam("changed_id")).values(change_seq=bindparam("changed_seq")),
+        [{"changed_id": record_id, "changed_seq": seq} for record_id, seq in zip(ids, next_change_seqs(db, len(ids)))]
+    )
+
+def get_changes(db: Session, after_seq: int = 0, limit: int = 500) -> List[Tuple[int, str, int]]:
+    """
+    Возвращает до limit изменений с номером больше after_seq в виде
+    (номер, тип записи, ID), упорядоченных по номеру: по одному запросу
+    к индексу change_seq каждой таблицы
+    """
+    changes = []
+    for entity, model in CHANGE_FEED_ENTITIES:
+        changes.extend(
+            (seq, entity, record_id)
+            for record_id, seq in db.execute(
+                select(model.id, model.change_seq).where(model.change_seq > after_seq)
+                .order_by(model.change_seq).limit(limit)
+            )
+        )
+    return sorted(changes)[:limit]
+
+def get_change_documents(db: Session, changes: List[Tuple[int, str, int]]) -> List[str]:
+    """
+    JSON-элементы ленты в формате schemas.Change для изменений из get_changes:
+    организации - готовыми документами, здания и виды деятельности - одним
+    IN-запросом на тип
+    """
+    ids = {entity: [record_id for _, change_entity, record_id in changes if change_entity == entity]
+           for entity, _ in CHANGE_FEED_ENTITIES}
+    documents = {
+        "organization": get_organization_documents_by_id(db, ids["organization"]),
+        "building": {
+            building.id: schemas.Building.model_validate(building).model_dump_json()
+            for building in db.query(models.Building).filter(models.Building.id.in_(ids["building"]))
+        } if ids["building"] else {},
+        "activity": {
+            activity.id: schemas.ActivitySummary.model_validate(activity).model_dump_json()
+            for activity in db.query(models.Activity).filter(models.Activity.id.in_(ids["activity"]))
+        } if ids["activity"] else {},
+    }
+    return [
+        f'{{"seq":{seq},"type":"{entity}","id":{record_id},"data":{documents[entity][record_id]}}}'
+        for seq, entity, record_id in changes
+        if record_id in documents[entity]
+    ]
 
 # CRUD для телефонов
+def normalize_phone_number(number: str) -> Optional[str]:
+    """
+    Приводит номер к виду E.164 без «+» (только цифры с кодом страны):
+    «+7 (999) 111-22-33» и «8-999-111-22-33» дают «79991112233»,
+    «(495) 123-45-67» и «8 (495) 123-45-67» - «74951234567».
+    None - номер не приводится к полному: короткий городской номер
+    без кода города («222-22-22») одинаков в разных городах, поэтому
+    не участвует в уникальном индексе и в поиске по номеру
+    """
+    digits = re.sub(r"[^0-9]", "", number)
+    if len(digits) == 11 and digits[0] == "8":
+        return PHONE_COUNTRY_CODE + digits[1:]
+    if len(digits) == 10:
+        # Десять цифр - национальный номер (код оператора или города) без кода страны
+        return PHONE_COUNTRY_CODE + digits
+    if len(digits) < PHONE_FULL_NUMBER_DIGITS:
+        return None
+    return digits
+
+class PhoneNumberTaken(ValueError):
+    # Номер уже принадлежит другой организации
+    def __init__(self, numbers: List[str]):
+        super().__init__(f"Phone numbers already registered: {', '.join(numbers)}")
+        self.numbers = numbers
+
+def _new_phones(db: Session, numbers: List[str]) -> List[models.Phone]:
+    # Номера, совпадающие после нормализации, сохраняются один раз
+    registered = get_registered_phone_numbers(db, numbers)
+    if registered:
+        raise PhoneNumberTaken(registered)
+    phones = {}
+    for number in numbers:
+        normalized = normalize_phone_number(number)
+        phones.setdefault(normalized or number, models.Phone(number=number, normalized_number=normalized))
+    return list(phones.values())
+
+def get_registered_phone_numbers(db: Session, numbers: List[str]) -> List[str]:
+    # Нормализованные номера из списка, которые уже принадлежат какой-либо организации
+    return sorted(get_organization_ids_by_phones(db, numbers).keys())
+
+def get_organization_id_by_phone(db: Session, number: str) -> Optional[int]:
+    normalized = normalize_phone_number(number)
+    if normalized is None:
+        return None
+    return db.scalar(
+        select(models.Phone.organization_id).where(models.Phone.normalized_number == normalized)
+    )
+
+def get_organization_ids_by_phones(db: Session, numbers: List[str]) -> Dict[str, Optional[int]]:
+    """
+    Возвращает словарь нормализованный номер -> ID организации для
+    найденных номеров; поиск по уникальному индексу пачками IN-запросов
+    """
+    normalized = list({value for value in map(normalize_phone_number, numbers) if value is not None})
+    found = {}
+    for start in range(0, len(normalized), PHONE_LOOKUP_CHUNK_SIZE):
+        found.update(db.execute(
+            select(models.Phone.normalized_number, models.Phone.organization_id).where(
+                models.Phone.normalized_number.in_(normalized[start:start + PHONE_LOOKUP_CHUNK_SIZE])
+            )
+        ).all())
+    return found
+
 def create_phone(db: Session, phone: schemas.PhoneCreate):
-    db_phone = models.Phone(number=phone.number)
+    db_phone = models.Phone(number=phone.number, normalized_number=normalize_phone_number(phone.number))
     db.add(db_phone)
     db.commit()
+    bump_data_version()
     db.refresh(db_phone)
     return db_phone
 
 # CRUD для видов деятельности
 def create_activity(db: Session, activity: schemas.ActivityCreate):
-    db_activity = models.Activity(**activity.dict())
+    db_activity = models.Activity(**activity.dict(), change_seq=next_change_seqs(db, 1)[0])
     db.add(db_activity)
+    db.flush()
+    link_activity_closure(db, db_activity)
+    if db_activity.parent_id is not None:
+        # В документах организаций родителя перечислены его дочерние виды
+        organization_ids = db.scalars(
+            select(models.organization_activity.c.organization_id).where(
+                models.organization_activity.c.activity_id == db_activity.parent_id
+            )
+        ).all()
+        refresh_organization_documents(db, organization_ids)
+        # Только организации непосредственного родителя: документ организации содержит
+        # один уровень дочерних видов, документы организаций более далеких предков не меняются
+        mark_changed(db, models.Organization, organization_ids)
     db.commit()
+    bump_data_version()
     db.refresh(db_activity)
     return db_activity
 
 def get_activity(db: Session, activity_id: int):
     return db.query(models.Activity).filter(models.Activity.id == activity_id).first()
 
-def get_activities(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Activity).offset(skip).limit(limit).all()
+def get_activities(db: Session, after_id: Optional[int] = None, limit: int = 100) -> List[schemas.Activity]:
+    # Страница ID по индексу, сами виды с поддеревьями берутся из леса в памяти,
+    # а не ленивой загрузкой children по запросу на каждый узел
+    activity_ids = [row.id for row in _keyset_page(db.query(models.Activity.id), models.Activity.id, after_id, limit)]
+    # Лес читается после страницы и содержит все ее виды
+    _, nodes = _current_activity_forest(db)
+    return [nodes[activity_id] for activity_id in activity_ids if activity_id in nodes]
+
+# Лес видов деятельности собирается из одного запроса и хранится, пока не изменится
+# наибольший номер изменения видов деятельности: create_activity любого процесса
+# выдает новый номер, а сравнение стоит одного поиска по индексу change_seq
+_activity_forest: Optional[Tuple[Optional[int], List[schemas.Activity], Dict[int, schemas.Activity]]] = None
+
+def build_activity_forest(db: Session) -> Tuple[List[schemas.Activity], Dict[int, schemas.Activity]]:
+    """
+    Читает все виды деятельности одним запросом и за один проход собирает
+    дерево: корни и словарь узлов по ID. Строки идут по возрастанию ID,
+    поэтому дочерние узлы в каждом списке упорядочены так же
+    """
+    rows = db.execute(
+        select(models.Activity.id, models.Activity.name, models.Activity.parent_id, models.Activity.level)
+        .order_by(models.Activity.id)
+    ).all()
+    nodes = {
+        row.id: schemas.Activity(id=row.id, name=row.name, parent_id=row.parent_id, level=row.level)
+        for row in rows
+    }
+    roots = []
+    for node in nodes.values():
+        parent = nodes.get(node.parent_id) if node.parent_id is not None else None
+        if parent is None:
+            roots.append(node)
+        else:
+            parent.children.append(node)
+    return roots, nodes
+
+def _current_activity_forest(db: Session) -> Tuple[List[schemas.Activity], Dict[int, schemas.Activity]]:
+    global _activity_forest
+    key = db.scalar(select(func.max(models.Activity.change_seq)))
+    forest = _activity_forest
+    if forest is None or forest[0] != key:
+        # Ключ читается до строк: запись между ними даст новый ключ, и лес пересоберется
+        forest = (key, *build_activity_forest(db))
+        _activity_forest = forest
+    return forest[1], forest[2]
+
+def get_activity_forest(db: Session, root_id: Optional[int] = None) -> Optional[List[schemas.Activity]]:
+    """
+    Все деревья видов деятельности или одно поддерево с корнем root_id
+    (None, если такого вида нет). Узлы общие для всех запросов, изменять их нельзя
+    """
+    roots, nodes = _current_activity_forest(db)
+    if root_id is None:
+        return roots
+    node = nodes.get(root_id)
+    return [node] if node is not None else None
+
+def link_activity_closure(db: Session, activity: models.Activity):
+    """
+    Добавляет в таблицу замыкания связи нового вида деятельности с самим собой
+    и со всеми предками родителя. Вызывается после flush, когда известен ID
+    """
+    closure = models.activity_closure
+    db.execute(insert(closure).values(
+        ancestor_id=activity.id, descendant_id=activity.id, depth=0
+    ))
+    if activity.parent_id is not None:
+        db.execute(insert(closure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(
+                closure.c.ancestor_id,
+                literal(activity.id),
+                closure.c.depth + 1
+            ).where(closure.c.descendant_id == activity.parent_id)
+        ))
+
+def get_activity_subtree_ids(activity_id: int, max_depth: Optional[int] = None):
+    """
+    Подзапрос ID вида деятельности и всех его потомков
+    (не глубже max_depth уровней, если он задан)
+    """
+    closure = models.activity_closure
+    query = select(closure.c.descendant_id).where(closure.c.ancestor_id == activity_id)
+    if max_depth is not None:
+        query = query.where(closure.c.depth <= max_depth)
+    return query
+
+def _keyset_page(query, id_column, after_id: Optional[int], limit: int):
+    # Постраничная выборка по первичному ключу: WHERE id > курсор вместо OFFSET
+    if after_id is not None:
+        query = query.filter(id_column > after_id)
+    return query.order_by(id_column).limit(limit).all()
+
+def _organization_id_page(query, after_id: Optional[int], limit: int) -> List[int]:
+    # Страница ID организаций; сами документы/объекты догружаются по этим ID
+    query = query.with_entities(models.Organization.id)
+    return [row.id for row in _keyset_page(query, models.Organization.id, after_id, limit)]
 
 # CRUD для зданий
 def create_building(db: Session, building: schemas.BuildingCreate):
-    db_building = models.Building(**building.dict())
+    db_building = models.Building(**building.dict(), change_seq=next_change_seqs(db, 1)[0])
     db.add(db_building)
     db.commit()
+    bump_data_version()
     db.refresh(db_building)
     return db_building
 
 def get_building(db: Session, building_id: int):
     return db.query(models.Building).filter(models.Building.id == building_id).first()
 
-def get_buildings(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Building).offset(skip).limit(limit).all()
+def get_buildings(db: Session, after_id: Optional[int] = None, limit: int = 100):
+    return _keyset_page(db.query(models.Building), models.Building.id, after_id, limit)
 
 # CRUD для организаций
+def _organization_collections_options():
+    # Коллекции подгружаем отдельными IN-запросами, дочерние виды
+    # деятельности - только на один уровень, как в schemas.OrganizationActivity
+    return [
+        selectinload(models.Organization.phones),
+        selectinload(models.Organization.activities).selectinload(models.Activity.children)
+    ]
+
+def _query_organizations(db: Session):
+    # Запрос организаций со всеми связями, нужными для сериализации,
+    # чтобы число запросов не зависело от размера выборки
+    return db.query(models.Organization).options(
+        joinedload(models.Organization.building),
+        *_organization_collections_options()
+    )
+
 def create_organization(db: Session, organization: schemas.OrganizationCreate):
     # Создаем телефоны
-    phones = [models.Phone(number=phone) for phone in organization.phones]
+    phones = _new_phones(db, organization.phones)
     db.add_all(phones)
     db.flush()
     
     # Создаем организацию
     db_organization = models.Organization(
         name=organization.name,
-        building_id=organization.building_id
+        building_id=organization.building_id,
+        change_seq=next_change_seqs(db, 1)[0]
     )
     db.add(db_organization)
     db.flush()
@@ -59,119 +337,633 @@ def create_organization(db: Session, organization: schemas.OrganizationCreate):
     db_organization.phones = phones
     db_organization.activities = [
         db.query(models.Activity).get(activity_id)
-        for activity_id in organization.activities
+        for activity_id in dict.fromkeys(organization.activities)
     ]
+    db.flush()
+    sync_new_organizations(db, [db_organization.id])
     
     db.commit()
+    bump_data_version()
     db.refresh(db_organization)
     return db_organization
 
 def get_organization(db: Session, organization_id: int):
-    return db.query(models.Organization).filter(models.Organization.id == organization_id).first()
-
-def get_organizations(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Organization).offset(skip).limit(limit).all()
-
-def get_organizations_by_building(db: Session, building_id: int):
-    return db.query(models.Organization).filter(models.Organization.building_id == building_id).all()
-
-def get_organizations_by_activity(db: Session, activity_id: int, include_children: bool = True):
-    if include_children:
-        # Получаем все дочерние виды деятельности
-        activity = db.query(models.Activity).filter(models.Activity.id == activity_id).first()
-        if not activity:
-            return []
-        
-        # Получаем все дочерние ID (до 3 уровня)
-        child_ids = get_child_activity_ids(db, activity_id, max_level=3)
-        activity_ids = [activity_id] + child_ids
-        
-        # Получаем организации с указанными видами деятельности
-        return db.query(models.Organization).join(
-            models.Organization.activities
-        ).filter(
-            models.Activity.id.in_(activity_ids)
-        ).all()
-    else:
-        return db.query(models.Organization).join(
-            models.Organization.activities
-        ).filter(
-            models.Activity.id == activity_id
-        ).all()
+    return _query_organizations(db).filter(models.Organization.id == organization_id).first()
 
-def get_child_activity_ids(db: Session, parent_id: int, max_level: int = 3, current_level: int = 1):
-    if current_level >= max_level:
-        return []
-    
-    children = db.query(models.Activity).filter(
-        models.Activity.parent_id == parent_id
+def get_organizations_by_ids(db: Session, organization_ids: List[int]):
+    # Возвращает найденные организации в порядке переданных ID
+    organizations = _query_organizations(db).filter(
+        models.Organization.id.in_(organization_ids)
     ).all()
-    
-    child_ids = [child.id for child in children]
-    for child in children:
-        child_ids.extend(get_child_activity_ids(db, child.id, max_level, current_level + 1))
-    
-    return child_ids
+    by_id = {org.id: org for org in organizations}
+    return [by_id[org_id] for org_id in organization_ids if org_id in by_id]
+
+def get_organization_ids(db: Session, after_id: Optional[int] = None, limit: int = 100):
+    return _organization_id_page(db.query(models.Organization), after_id, limit)
+
+def get_organizations(db: Session, after_id: Optional[int] = None, limit: int = 100):
+    return get_organizations_by_ids(db, get_organization_ids(db, after_id, limit))
+
+def sync_new_organizations(db: Session, organization_ids: List[int]):
+    """
+    Обновляет производные структуры для только что вставленных организаций:
+    готовые документы и агрегаты кластеров карты. Вызывается каждым путем
+    записи в той же транзакции, что и вставка организаций и их связей
+    """
+    refresh_organization_documents(db, organization_ids)
+    clusters.add_organizations(db, organization_ids)
+
+def refresh_organization_documents(db: Session, organization_ids: List[int]):
+    """
+    Пересобирает готовые JSON-документы организаций (денормализованная
+    модель чтения). Вызывается в той же транзакции, что и изменение
+    """
+    if not organization_ids:
+        return
+    documents = models.OrganizationDocument.__table__
+    db.execute(delete(documents).where(documents.c.organization_id.in_(organization_ids)))
+    # populate_existing перечитывает связи объектов, уже загруженных в сессию
+    organizations = _query_organizations(db).populate_existing().filter(
+        models.Organization.id.in_(organization_ids)
+    ).all()
+    db.execute(insert(documents), [
+        {"organization_id": organization.id, "document": _serialize_organization(organization)}
+        for organization in organizations
+    ])
+
+def get_organization_documents(db: Session, organization_ids: List[int]) -> List[str]:
+    """
+    Возвращает JSON-документы организаций в порядке переданных ID без
+    гидратации ORM; отсутствующие организации пропускаются
+    """
+    found = get_organization_documents_by_id(db, organization_ids)
+    return [found[org_id] for org_id in organization_ids if org_id in found]
+
+def get_organization_documents_by_id(db: Session, organization_ids: List[int]) -> Dict[int, str]:
+    """
+    Возвращает словарь ID -> JSON-документ организации одним IN-запросом.
+    Документы, которых еще нет в таблице (записи до ее появления),
+    собираются на лету; отсутствующих организаций в словаре нет
+    """
+    if not organization_ids:
+        return {}
+    documents = models.OrganizationDocument.__table__
+    found = dict(db.execute(
+        select(documents.c.organization_id, documents.c.document).where(
+            documents.c.organization_id.in_(set(organization_ids))
+        )
+    ).all())
+    missing = list(dict.fromkeys(org_id for org_id in organization_ids if org_id not in found))
+    if missing:
+        for organization in get_organizations_by_ids(db, missing):
+            found[organization.id] = _serialize_organization(organization)
+    return found
+
+def _serialize_organization(organization: models.Organization) -> str:
+    return schemas.Organization.model_validate(organization).model_dump_json()
+
+def iter_organization_batches(db: Session, batch_size: int = 500):
+    """
+    Обходит все организации по возрастанию id пачками по batch_size
+    через серверный курсор; связи каждой пачки подгружаются общими
+    IN-запросами. Сессия хранит объекты по слабым ссылкам, поэтому
+    обработанные пачки освобождаются, как только вызывающий их отпустит
+    """
+    query = select(models.Organization).options(
+        joinedload(models.Organization.building),
+        *_organization_collections_options()
+    ).order_by(models.Organization.id).execution_options(yield_per=batch_size)
+    yield from db.scalars(query).partitions()
+
+def get_organization_ids_by_building(
+    db: Session,
+    building_id: int,
+    after_id: Optional[int] = None,
+    limit: int = 100
+):
+    query = db.query(models.Organization).filter(models.Organization.building_id == building_id)
+    return _organization_id_page(query, after_id, limit)
+
+def get_organization_ids_by_activity(
+    db: Session,
+    activity_id: int,
+    include_children: bool = True,
+    max_depth: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = 100
+):
+    # Все организации поддерева одним запросом через таблицу замыкания
+    if not include_children:
+        max_depth = 0
+    query = db.query(models.Organization).filter(
+        models.Organization.id.in_(_organization_ids_with_activities(
+            get_activity_subtree_ids(activity_id, max_depth)
+        ))
+    )
+    return _organization_id_page(query, after_id, limit)
+
+def get_child_activity_ids(db: Session, parent_id: int, max_depth: Optional[int] = None):
+    closure = models.activity_closure
+    query = select(closure.c.descendant_id).where(
+        closure.c.ancestor_id == parent_id,
+        closure.c.depth > 0
+    )
+    if max_depth is not None:
+        query = query.where(closure.c.depth <= max_depth)
+    return list(db.scalars(query))
+
+def _organization_ids_with_activities(activity_ids):
+    association = models.organization_activity
+    return select(association.c.organization_id).where(
+        association.c.activity_id.in_(activity_ids)
+    )
 
-def get_organizations_by_geo(db: Session, params: schemas.GeoSearchParams):
+def get_organization_ids_by_geo(
+    db: Session,
+    params: schemas.GeoSearchParams,
+    after: Optional[list] = None,
+    limit: int = 100
+):
+    """
+    Возвращает пары (ID организации, ключ сортировки). Поиск по радиусу
+    упорядочен по (расстояние, id), по прямоугольнику - по id;
+    after - ключ последнего элемента предыдущей страницы
+    """
     if params.radius_km:
         # Поиск по радиусу
-        return get_organizations_by_radius(db, params.center, params.radius_km)
+        return [
+            (org_id, (distance, org_id))
+            for org_id, distance in get_organization_ids_by_radius(
+                db, params.center, params.radius_km,
+                after=tuple(after) if after else None, limit=limit
+            )
+        ]
     elif params.rectangle:
         # Поиск по прямоугольной области
-        return get_organizations_by_rectangle(db, params.rectangle)
+        return [
+            (org_id, (org_id,))
+            for org_id in get_organization_ids_by_rectangle(
+                db, params.rectangle, after_id=after[0] if after else None, limit=limit
+            )
+        ]
     return []
 
-def get_organizations_by_radius(db: Session, center: schemas.GeoPoint, radius_km: float):
-    # Используем формулу гаверсинусов для расчета расстояния
-    organizations = []
-    for org in db.query(models.Organization).all():
-        distance = calculate_distance(
-            center.latitude, center.longitude,
-            org.building.latitude, org.building.longitude
+def get_organization_ids_by_radius(
+    db: Session,
+    center: schemas.GeoPoint,
+    radius_km: float,
+    after: Optional[Tuple[float, int]] = None,
+    limit: int = 100
+):
+    """
+    Возвращает пары (ID организации, расстояние в км) внутри круга,
+    упорядоченные по расстоянию, начиная после ключа after
+    """
+    # Сначала отбираем кандидатов по описанному прямоугольнику через
+    # пространственный индекс, затем уточняем расстояние формулой гаверсинусов
+    ids, distances = _organization_distances(
+        db, _organization_locations(db), center, radius_km
+    )
+    within = distances <= radius_km
+    if after is not None:
+        after_distance, after_id = after
+        within &= (distances > after_distance) | ((distances == after_distance) & (ids > after_id))
+    ids, distances = ids[within], distances[within]
+    page = np.lexsort((ids, distances))[:limit]
+    return list(zip(ids[page].tolist(), distances[page].tolist()))
+
+def get_organization_ids_by_rectangle(
+    db: Session,
+    rectangle: schemas.GeoRectangle,
+    after_id: Optional[int] = None,
+    limit: int = 100
+):
+    query = _filter_by_box(
+        db,
+        db.query(models.Organization).join(models.Organization.building),
+        min_lat=rectangle.south_east.latitude,
+        max_lat=rectangle.north_west.latitude,
+        min_lon=rectangle.north_west.longitude,
+        max_lon=rectangle.south_east.longitude
+    )
+    return _organization_id_page(query, after_id, limit)
+
+def get_nearest_organization_ids(
+    db: Session,
+    center: schemas.GeoPoint,
+    limit: int = 20,
+    activity_id: Optional[int] = None,
+    include_children: bool = True,
+    max_radius_km: Optional[float] = None
+):
+    """
+    Возвращает до limit ближайших к точке организаций не дальше max_radius_km
+    (по умолчанию schemas.MAX_NEAREST_RADIUS_KM) в виде пар
+    (ID организации, расстояние в км), отсортированных по расстоянию
+    """
+    if max_radius_km is None:
+        max_radius_km = schemas.MAX_NEAREST_RADIUS_KM
+
+    query = _organization_locations(db)
+    if activity_id is not None:
+        organization_ids = _organization_ids_with_activities(
+            get_activity_subtree_ids(activity_id, None if include_children else 0)
         )
-        if distance <= radius_km:
-            organizations.append(org)
-    return organizations
-
-def get_organizations_by_rectangle(db: Session, rectangle: schemas.GeoRectangle):
-    return db.query(models.Organization).join(
-        models.Building
-    ).filter(
-        models.Building.latitude <= rectangle.north_west.latitude,
-        models.Building.latitude >= rectangle.south_east.latitude,
-        models.Building.longitude >= rectangle.north_west.longitude,
-        models.Building.longitude <= rectangle.south_east.longitude
-    ).all()
+        # Если организаций вида деятельности немного, расстояния считаются
+        # до всех сразу, без расширения радиуса по всему каталогу
+        candidate_ids = db.scalars(organization_ids.distinct().limit(KNN_DIRECT_CANDIDATES + 1)).all()
+        if len(candidate_ids) <= KNN_DIRECT_CANDIDATES:
+            if not candidate_ids:
+                return []
+            ids, distances = _location_distances(
+                center, query.filter(models.Organization.id.in_(candidate_ids)).all()
+            )
+            return nearest_within(ids, distances, max_radius_km, limit)
+        query = query.filter(models.Organization.id.in_(organization_ids))
+
+    # Расширяем радиус поиска, пока внутри круга не наберется limit
+    # организаций: k ближайших гарантированно лежат внутри такого круга.
+    # Каждый шаг читает только кольцо между новым и прежним прямоугольником
+    radius_km = min(KNN_INITIAL_RADIUS_KM, max_radius_km)
+    ids, distances = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    previous_box = None
+    while True:
+        box = get_bounding_box(center, radius_km)
+        ring = _filter_by_box(db, query, *box)
+        if previous_box is not None:
+            ring = ring.filter(not_(_inside_box(*previous_box)))
+        ring_ids, ring_distances = _location_distances(center, ring.all())
+        ids, distances = np.concatenate((ids, ring_ids)), np.concatenate((distances, ring_distances))
+        if np.count_nonzero(distances <= radius_km) >= limit or radius_km >= max_radius_km:
+            break
+        previous_box = box
+        radius_km = min(radius_km * KNN_RADIUS_GROWTH, max_radius_km)
+    return nearest_within(ids, distances, radius_km, limit)
+
+def nearest_within(ids: np.ndarray, distances: np.ndarray, radius_km: float, limit: int) -> List[Tuple[int, float]]:
+    # До limit пар (ID, расстояние) не дальше radius_km по возрастанию расстояния, при равенстве - ID
+    within = distances <= radius_km
+    ids, distances = ids[within], distances[within]
+    nearest = np.lexsort((ids, distances))[:limit]
+    return list(zip(ids[nearest].tolist(), distances[nearest].tolist()))
+
+def _organization_locations(db: Session):
+    return db.query(
+        models.Organization.id,
+        models.Building.latitude,
+        models.Building.longitude
+    ).join(models.Organization.building)
+
+def _organization_distances(db: Session, locations_query, center: schemas.GeoPoint, radius_km: float):
+    """
+    Выбирает кандидатов (id, широта, долгота) из описанного вокруг круга
+    прямоугольника и считает расстояния до них одним векторным вызовом
+    """
+    rows = _filter_by_box(db, locations_query, *get_bounding_box(center, radius_km)).all()
+    return _location_distances(center, rows)
 
-def search_organizations_by_name(db: Session, name: str):
-    return db.query(models.Organization).filter(
+def _location_distances(center: schemas.GeoPoint, rows) -> Tuple[np.ndarray, np.ndarray]:
+    # Строки (id, широта, долгота) -> массивы ID и расстояний до точки
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    distances = calculate_distances(
+        center.latitude, center.longitude,
+        np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows)),
+        np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+    )
+    return ids, distances
+
+def _inside_box(min_lat: float, max_lat: float, min_lon: float, max_lon: float):
+    # Здание внутри прямоугольника - то же точное сравнение, что и в _filter_by_box
+    return and_(
+        models.Building.latitude >= min_lat,
+        models.Building.latitude <= max_lat,
+        models.Building.longitude >= min_lon,
+        models.Building.longitude <= max_lon
+    )
+
+def _filter_by_box(db: Session, query, min_lat: float, max_lat: float, min_lon: float, max_lon: float):
+    # Запрос должен уже включать таблицу buildings
+    if db.get_bind().dialect.name == "sqlite":
+        # R*Tree хранит координаты с округлением наружу, поэтому индекс дает
+        # надмножество, а точное сравнение ниже отсекает лишнее
+        rtree = models.building_rtree
+        query = query.join(rtree, rtree.c.id == models.Building.id).filter(
+            rtree.c.max_lat >= min_lat,
+            rtree.c.min_lat <= max_lat,
+            rtree.c.max_lon >= min_lon,
+            rtree.c.min_lon <= max_lon
+        )
+    return query.filter(_inside_box(min_lat, max_lat, min_lon, max_lon))
+
+def search_organization_ids_by_name(
+    db: Session,
+    name: str,
+    after_id: Optional[int] = None,
+    limit: int = 100
+):
+    # Поиск подстроки через ILIKE: полный просмотр таблицы, без ранжирования
+    query = db.query(models.Organization).filter(
         models.Organization.name.ilike(f"%{name}%")
-    ).all()
+    )
+    return _organization_id_page(query, after_id, limit)
 
-def search_organizations_by_activity(db: Session, activity_name: str, include_children: bool = True):
-    # Находим все виды деятельности, содержащие указанное название
-    activities = db.query(models.Activity).filter(
-        models.Activity.name.ilike(f"%{activity_name}%")
-    ).all()
-    
-    if not activities:
-        return []
-    
-    # Получаем все организации для найденных видов деятельности
-    organizations = set()
-    for activity in activities:
-        orgs = get_organizations_by_activity(db, activity.id, include_children)
-        organizations.update(orgs)
-    
-    return list(organizations)
+def can_search_organizations_full_text(db: Session, name: str) -> bool:
+    # Триграммному индексу нужно хотя бы три символа запроса
+    return db.get_bind().dialect.name == "sqlite" and len(name.strip()) >= FTS_MIN_QUERY_LENGTH
+
+def _full_text_match(name: str):
+    # Запрос ищется как фраза, чтобы спецсимволы FTS5 не трактовались как синтаксис
+    phrase = '"' + name.strip().replace('"', '""') + '"'
+    return literal_column(models.organization_fts.name).op("MATCH")(phrase)
+
+def search_organization_ids_full_text(
+    db: Session,
+    name: str,
+    after: Optional[Tuple[float, int]] = None,
+    limit: int = 100
+):
+    """
+    Возвращает пары (ID организации, релевантность) по полнотекстовому индексу,
+    от более релевантных к менее (bm25: чем меньше значение, тем лучше)
+    """
+    fts = models.organization_fts
+    query = select(fts.c.rowid, fts.c.rank).where(_full_text_match(name))
+    if after is not None:
+        after_rank, after_id = after
+        query = query.where(or_(
+            fts.c.rank > after_rank,
+            and_(fts.c.rank == after_rank, fts.c.rowid > after_id)
+        ))
+    rows = db.execute(query.order_by(fts.c.rank, fts.c.rowid).limit(limit)).all()
+    return [(row.rowid, row.rank) for row in rows]
+
+def search_organization_ids_by_activity(
+    db: Session,
+    activity_name: str,
+    include_children: bool = True,
+    after_id: Optional[int] = None,
+    limit: int = 100
+):
+    # Подходящие виды деятельности и их потомки разворачиваются через таблицу
+    # замыкания внутри одного запроса, повторы организаций отсекает IN
+    query = db.query(models.Organization).filter(
+        models.Organization.id.in_(_organization_ids_with_activities(
+            _activity_ids_by_name(activity_name, include_children)
+        ))
+    )
+    return _organization_id_page(query, after_id, limit)
+
+def _activity_ids_by_name(activity_name: str, include_children: bool = True):
+    # Подстрочный поиск все равно просматривает activities, поэтому подходящие
+    # ID берутся оттуда, а потомки - поиском по ключу таблицы замыкания
+    closure = models.activity_closure
+    activity_ids = select(closure.c.descendant_id).where(
+        closure.c.ancestor_id.in_(
+            select(models.Activity.id).where(models.Activity.name.ilike(f"%{activity_name}%"))
+        )
+    )
+    if not include_children:
+        activity_ids = activity_ids.where(closure.c.depth == 0)
+    return activity_ids
+
+class SearchFilter(NamedTuple):
+    """
+    Фильтр комбинированного поиска. candidates - запрос ID подходящих
+    организаций по индексу (None, если индекса нет и фильтр годится только
+    для проверки), condition - проверка организации в запросе с buildings
+    """
+    name: str
+    candidates: Optional[Query]
+    condition: object
+
+class SearchPlanStep(NamedTuple):
+    name: str
+    # Число кандидатов, ограниченное SEARCH_ESTIMATE_CAP; None - фильтр без индекса
+    estimate: Optional[int]
+
+def _combined_search_filters(db: Session, params: schemas.CombinedSearchParams) -> List[SearchFilter]:
+    filters = []
+    if params.building_id is not None:
+        condition = models.Organization.building_id == params.building_id
+        filters.append(SearchFilter(
+            "building", db.query(models.Organization.id).filter(condition), condition
+        ))
+
+    # Организация с несколькими подходящими видами деятельности - один кандидат,
+    # иначе оценка завышена и фильтр проигрывает более избирательным
+    association = models.organization_activity
+    if params.activity_id is not None:
+        activity_ids = get_activity_subtree_ids(
+            params.activity_id, params.max_depth if params.include_children else 0
+        )
+        filters.append(SearchFilter(
+            "activity",
+            db.query(association.c.organization_id).filter(association.c.activity_id.in_(activity_ids)).distinct(),
+            models.Organization.id.in_(_organization_ids_with_activities(activity_ids))
+        ))
+
+    if params.activity_name is not None:
+        activity_ids = _activity_ids_by_name(params.activity_name, params.include_children)
+        filters.append(SearchFilter(
+            "activity_name",
+            db.query(association.c.organization_id).filter(association.c.activity_id.in_(activity_ids)).distinct(),
+            models.Organization.id.in_(_organization_ids_with_activities(activity_ids))
+        ))
+
+    box = None
+    if params.radius_km is not None:
+        box = get_bounding_box(params.center, params.radius_km)
+    elif params.rectangle is not None:
+        rectangle = params.rectangle
+        box = (
+            rectangle.south_east.latitude, rectangle.north_west.latitude,
+            rectangle.north_west.longitude, rectangle.south_east.longitude
+        )
+    if box is not None:
+        min_lat, max_lat, min_lon, max_lon = box
+        filters.append(SearchFilter(
+            "geo",
+            _filter_by_box(db, _organization_locations(db).with_entities(models.Organization.id), *box),
+            and_(
+                models.Building.latitude.between(min_lat, max_lat),
+                models.Building.longitude.between(min_lon, max_lon)
+            )
+        ))
+
+    if params.name is not None:
+        if params.name_mode == "fts" and can_search_organizations_full_text(db, params.name):
+            fts = models.organization_fts
+            match = _full_text_match(params.name)
+            filters.append(SearchFilter(
+                "name",
+                db.query(fts.c.rowid).filter(match),
+                models.Organization.id.in_(select(fts.c.rowid).where(match))
+            ))
+        else:
+            filters.append(SearchFilter("name", None, models.Organization.name.ilike(f"%{params.name}%")))
+    return filters
+
+def _estimate_candidates(db: Session, search_filter: SearchFilter) -> Optional[int]:
+    # Считаем кандидатов по индексу, но не дальше SEARCH_ESTIMATE_CAP строк:
+    # для избирательного фильтра это точное число, для остальных - «много»
+    if search_filter.candidates is None:
+        return None
+    return db.query(func.count()).select_from(
+        search_filter.candidates.limit(SEARCH_ESTIMATE_CAP).subquery()
+    ).scalar()
+
+def plan_combined_search(db: Session, filters: List[SearchFilter]) -> List[Tuple[SearchFilter, SearchPlanStep]]:
+    """
+    Упорядочивает фильтры по избирательности: сначала фильтры с индексом
+    от меньшего числа кандидатов к большему, затем фильтры без индекса
+    """
+    steps = [(search_filter, SearchPlanStep(search_filter.name, _estimate_candidates(db, search_filter)))
+             for search_filter in filters]
+    return sorted(steps, key=lambda step: (step[1].estimate is None, step[1].estimate or 0))
+
+def _combined_search_query(
+    db: Session,
+    params: schemas.CombinedSearchParams
+) -> Tuple[Optional[Query], List[SearchPlanStep]]:
+    """
+    Запрос (id, широта, долгота) организаций, подходящих под все фильтры
+    (радиус проверяется только описанным прямоугольником), и выбранный план.
+    Самый избирательный индексированный фильтр дает множество кандидатов,
+    остальные проверяются только на нем. None - кандидатов нет
+    """
+    plan = plan_combined_search(db, _combined_search_filters(db, params))
+    steps = [step for _, step in plan]
+    query = _organization_locations(db)
+    checks = plan
+    driver, driver_step = plan[0]
+    if driver_step.estimate is not None and driver_step.estimate < SEARCH_ESTIMATE_CAP:
+        if driver_step.estimate == 0:
+            return None, steps
+        candidate_ids = sorted({row[0] for row in driver.candidates})
+        query = query.filter(models.Organization.id.in_(candidate_ids))
+        checks = plan[1:]
+    # Если избирательных фильтров нет, все условия уходят в один запрос,
+    # и порядок доступа выбирает сама база
+    for search_filter, _ in checks:
+        query = query.filter(search_filter.condition)
+    return query, steps
+
+def search_organization_ids_combined(
+    db: Session,
+    params: schemas.CombinedSearchParams,
+    after_id: Optional[int] = None,
+    limit: int = 100
+) -> Tuple[List[int], List[SearchPlanStep]]:
+    """
+    Возвращает страницу ID организаций (по возрастанию id), подходящих под
+    все фильтры, и выбранный план
+    """
+    query, plan = _combined_search_query(db, params)
+    if query is None:
+        return [], plan
+    query = query.order_by(models.Organization.id)
+
+    if params.radius_km is None:
+        if after_id is not None:
+            query = query.filter(models.Organization.id > after_id)
+        return [row.id for row in query.limit(limit)], plan
+
+    # Прямоугольник вокруг круга дает надмножество: точное расстояние
+    # проверяем на выбранных строках и добираем страницу, пока она не заполнится
+    page = []
+    while len(page) < limit:
+        batch_query = query if after_id is None else query.filter(models.Organization.id > after_id)
+        rows = batch_query.limit(limit * 2).all()
+        if not rows:
+            break
+        distances = calculate_distances(
+            params.center.latitude, params.center.longitude,
+            np.array([row.latitude for row in rows], dtype=np.float64),
+            np.array([row.longitude for row in rows], dtype=np.float64)
+        )
+        page.extend(row.id for row, distance in zip(rows, distances) if distance <= params.radius_km)
+        after_id = rows[-1].id
+    return page[:limit], plan
+
+def get_search_facets(
+    db: Session,
+    params: schemas.CombinedSearchParams,
+    buildings_limit: int = 50
+) -> schemas.SearchFacets:
+    """
+    Счетчики для результатов комбинированного поиска: всего, по видам
+    деятельности (организация учитывается во всех предках своих видов)
+    и по зданиям (первые buildings_limit по числу организаций). Организации
+    не загружаются: все счетчики считает один запрос с группировкой по
+    подходящим ID, названия и иерархия видов берутся из дерева в памяти
+    """
+    query, _ = _combined_search_query(db, params)
+    if query is None:
+        return schemas.SearchFacets(total=0, activities=[], buildings=[])
+    if params.radius_km is None:
+        matched = query.with_entities(models.Organization.id).cte("matched")
+    else:
+        # Точное расстояние проверяется на кандидатах из прямоугольника,
+        # подходящие ID передаются в запрос одним JSON-массивом
+        rows = query.all()
+        distances = calculate_distances(
+            params.center.latitude, params.center.longitude,
+            np.array([row.latitude for row in rows], dtype=np.float64),
+            np.array([row.longitude for row in rows], dtype=np.float64)
+        )
+        ids = json.dumps([row.id for row, distance in zip(rows, distances) if distance <= params.radius_km])
+        matched = select(func.json_each(ids).table_valued("value").c.value.label("id")).cte("matched")
+
+    association, closure = models.organization_activity, models.activity_closure
+    matched_ids = select(matched.c.id)
+    counts = union_all(
+        select(
+            literal("total").label("facet"), literal_column("NULL").label("id"),
+            literal_column("NULL").label("name"), func.count().label("organization_count")
+        ).select_from(matched),
+        select(
+            literal("activity"), closure.c.ancestor_id, literal_column("NULL"),
+            func.count(func.distinct(association.c.organization_id))
+        ).select_from(association.join(closure, closure.c.descendant_id == association.c.activity_id))
+        .where(association.c.organization_id.in_(matched_ids))
+        .group_by(closure.c.ancestor_id),
+        select(literal("building"), models.Building.id, models.Building.address, func.count())
+        .select_from(models.Organization.__table__.join(models.Building.__table__))
+        .where(models.Organization.id.in_(matched_ids))
+        .group_by(models.Building.id)
+    )
+    total, activity_counts, buildings = 0, {}, []
+    for row in db.execute(counts):
+        if row.facet == "total":
+            total = row.organization_count
+        elif row.facet == "activity":
+            activity_counts[row.id] = row.organization_count
+        else:
+            buildings.append(schemas.BuildingFacet(
+                id=row.id, address=row.name, organization_count=row.organization_count
+            ))
+    buildings.sort(key=lambda facet: (-facet.organization_count, facet.id))
+
+    # Виды деятельности в порядке обхода дерева: родитель перед своими потомками
+    roots, _ = _current_activity_forest(db)
+    activities = []
+    stack = list(reversed(roots))
+    while stack:
+        node = stack.pop()
+        count = activity_counts.get(node.id)
+        if count:
+            activities.append(schemas.ActivityFacet(
+                id=node.id, name=node.name, parent_id=node.parent_id, level=node.level, organization_count=count
+            ))
+            stack.extend(reversed(node.children))
+    return schemas.SearchFacets(total=total, activities=activities, buildings=buildings[:buildings_limit])
 
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
     Рассчитывает расстояние между двумя точками на Земле в километрах
     используя формулу гаверсинусов
     """
-    R = 6371  # Радиус Земли в километрах
+    R = EARTH_RADIUS_KM
 
     lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
     dlat = lat2 - lat1
@@ -180,4 +972,49 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
     c = 2 * math.asin(math.sqrt(a))
     
-    return R * c 
\ No newline at end of file
+    return R * c
+
+def calculate_distances(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Векторизованный вариант calculate_distance: расстояния в километрах
+    от точки до каждой из точек массивов lats/lons
+    """
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def get_bounding_box(center: schemas.GeoPoint, radius_km: float):
+    """
+    Возвращает (min_lat, max_lat, min_lon, max_lon) прямоугольника,
+    гарантированно содержащего круг заданного радиуса вокруг точки
+    """
+    angular_radius = radius_km / EARTH_RADIUS_KM
+    lat = math.radians(center.latitude)
+    lon = math.radians(center.longitude)
+
+    min_lat = lat - angular_radius
+    max_lat = lat + angular_radius
+    if min_lat <= -math.pi / 2 or max_lat >= math.pi / 2:
+        # Круг захватывает полюс - подходят все долготы
+        return (
+            math.degrees(max(min_lat, -math.pi / 2)),
+            math.degrees(min(max_lat, math.pi / 2)),
+            -180.0,
+            180.0
+        )
+
+    delta_lon = math.asin(min(1.0, math.sin(angular_radius) / math.cos(lat)))
+    min_lon = lon - delta_lon
+    max_lon = lon + delta_lon
+    if min_lon < -math.pi or max_lon > math.pi:
+        # Пересечение 180-го меридиана упрощенно покрываем всей полосой широт
+        min_lon, max_lon = -math.pi, math.pi
+
+    return (
+        math.degrees(min_lat),
+        math.degrees(max_lat),
+        math.degrees(min_lon),
+        math.degrees(max_lon)
+    ) 
\ No newline at end of file
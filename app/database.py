@@ -1,15 +1,71 @@
-from sqlalchemy import create_engine
+from typing import Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from .config import get_settings
+from .metrics import instrument_engine
+
+settings = get_settings()
+
+def sqlite_file_path(url: str) -> Optional[str]:
+    # Путь к файлу базы SQLite; None для других СУБД и базы в памяти
+    database_url = make_url(url)
+    if database_url.get_backend_name() != "sqlite" or database_url.database in (None, "", ":memory:"):
+        return None
+    return database_url.database
+
+def create_db_engine(url: str, read_only: bool = False):
+    """
+    Создает движок с профилем настроек из конфигурации: размер пула
+    и, для SQLite, прагмы WAL/synchronous/mmap/cache/busy_timeout
+    """
+    is_sqlite = make_url(url).get_backend_name() == "sqlite"
+    in_memory = is_sqlite and sqlite_file_path(url) is None
+
+    options = {}
+    if is_sqlite:
+        options["connect_args"] = {"check_same_thread": False}
+    if not in_memory:
+        options.update(
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_pre_ping=not is_sqlite
+        )
+    engine = create_engine(url, **options)
+
+    if is_sqlite:
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            if not in_memory:
+                cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+                cursor.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_size:d}")
+            cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+            cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms:d}")
+            # Отрицательное значение cache_size задает размер в КиБ, а не в страницах
+            cursor.execute(f"PRAGMA cache_size=-{settings.sqlite_cache_size_kib:d}")
+            if read_only:
+                cursor.execute("PRAGMA query_only=ON")
+            cursor.close()
 
-# Используем SQLite вместо PostgreSQL для простоты
-SQLALCHEMY_DATABASE_URL = "sqlite:///./organizations.db"
+    # Учет запросов в метриках текущего HTTP-запроса и лог медленных запросов
+    if settings.metrics_enabled or settings.slow_query_log_ms is not None:
+        instrument_engine(engine, settings.slow_query_log_ms)
+    return engine
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = create_db_engine(settings.database_url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Чтения можно направить в отдельный пул соединений только для чтения
+if settings.database_read_pool or settings.database_read_url:
+    read_engine = create_db_engine(settings.database_read_url or settings.database_url, read_only=True)
+else:
+    read_engine = engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 Base = declarative_base()
 
 def get_db():
@@ -17,4 +73,11 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,256 @@
+"""
+Потоковая массовая загрузка организаций из NDJSON или CSV.
+
+Строки обрабатываются пачками: ссылки на здания и виды деятельности
+и занятость телефонных номеров проверяются одним запросом на пачку, организации, телефоны и связи
+вставляются пакетными INSERT, каждая пачка - в своей транзакции.
+Ошибочные строки попадают в отчет и не прерывают загрузку.
+
+Запуск из командной строки: python -m app.ingest organizations.ndjson
+"""
+import argparse
+import csv
+import json
+import sys
+from typing import Any, AsyncIterator, Dict, Iterable, List, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from . import crud, models, schemas
+from .cache import bump_data_version
+
+INGEST_CHUNK_SIZE = 1000  # Строк в одной транзакции
+MAX_REPORTED_ERRORS = 1000  # Остальные ошибки только подсчитываются
+
+CSV_FIELDS = ["name", "building_id", "phones", "activities"]
+CSV_LIST_SEPARATOR = ";"
+
+class RecordParser:
+    """
+    Разбирает строки входного потока в словари полей OrganizationCreate.
+    CSV - одна запись на строку, первая строка - заголовок, телефоны
+    и ID видов деятельности перечисляются через точку с запятой
+    """
+
+    def __init__(self, input_format: str):
+        if input_format not in ("ndjson", "csv"):
+            raise ValueError(f"Unsupported format: {input_format}")
+        self.format = input_format
+        self.csv_header = None
+
+    def parse(self, line: str) -> Dict[str, Any]:
+        if self.format == "ndjson":
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("Expected a JSON object")
+            return record
+
+        values = next(csv.reader([line]))
+        if len(values) != len(self.csv_header):
+            raise ValueError(f"Expected {len(self.csv_header)} columns, got {len(values)}")
+        record = dict(zip(self.csv_header, values))
+        for field in ("phones", "activities"):
+            record[field] = [
+                value.strip()
+                for value in record.get(field, "").split(CSV_LIST_SEPARATOR)
+                if value.strip()
+            ]
+        return record
+
+    def is_header(self, line: str) -> bool:
+        """
+        Для CSV первая непустая строка - заголовок. Некорректный заголовок
+        делает бессмысленной всю загрузку, поэтому ValueError пробрасывается
+        """
+        if self.format != "csv" or self.csv_header is not None:
+            return False
+        header = [column.strip() for column in next(csv.reader([line]))]
+        missing = set(CSV_FIELDS) - set(header)
+        if missing:
+            raise ValueError(f"CSV header is missing columns: {', '.join(sorted(missing))}")
+        self.csv_header = header
+        return True
+
+class OrganizationImporter:
+    """
+    Накопитель результата загрузки: принимает пачки пронумерованных строк
+    и вставляет корректные записи пакетно
+    """
+
+    def __init__(self, db: Session, parser: RecordParser):
+        self.db = db
+        self.parser = parser
+        self.result = schemas.BulkIngestResult()
+        # Ошибки текущего вызова import_lines: разбор и проверки пачки находят
+        # их не по порядку, в отчет они попадают отсортированными по строке
+        self._errors: List[schemas.BulkIngestError] = []
+
+    def import_lines(self, lines: Iterable[Tuple[int, bytes]]):
+        try:
+            self._import_lines(lines)
+        finally:
+            self._errors.sort(key=lambda error: error.line)
+            free = max(0, MAX_REPORTED_ERRORS - len(self.result.errors))
+            self.result.errors.extend(self._errors[:free])
+            self._errors = []
+
+    def _import_lines(self, lines: Iterable[Tuple[int, bytes]]):
+        records = []
+        for line_number, raw_line in lines:
+            # Строки декодируются по одной: байты не в UTF-8 - ошибка строки, а не всей загрузки
+            try:
+                line = raw_line.decode("utf-8")
+            except UnicodeDecodeError as e:
+                self._fail(line_number, f"Invalid UTF-8: {e}")
+                continue
+            if not line.strip() or self.parser.is_header(line):
+                continue
+            try:
+                records.append((line_number, schemas.OrganizationCreate(**self.parser.parse(line))))
+            except ValidationError as e:
+                self._fail(line_number, "; ".join(
+                    f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+                    for error in e.errors()
+                ))
+            except (ValueError, TypeError) as e:
+                self._fail(line_number, str(e))
+
+        for start in range(0, len(records), INGEST_CHUNK_SIZE):
+            self._import_chunk(records[start:start + INGEST_CHUNK_SIZE])
+
+    def _import_chunk(self, records: List[Tuple[int, schemas.OrganizationCreate]]):
+        db = self.db
+        building_ids = {record.building_id for _, record in records}
+        activity_ids = {activity_id for _, record in records for activity_id in record.activities}
+        known_buildings = set(db.scalars(
+            select(models.Building.id).where(models.Building.id.in_(building_ids))
+        ))
+        known_activities = set(db.scalars(
+            select(models.Activity.id).where(models.Activity.id.in_(activity_ids))
+        ))
+
+        # Занятые номера: уже зарегистрированные и встреченные выше в пачке
+        taken_numbers = set(crud.get_organization_ids_by_phones(
+            db, [number for _, record in records for number in record.phones]
+        ))
+
+        valid = []
+        for line_number, record in records:
+            # Телефоны записи без повторов: нормализованный номер -> исходный
+            phones = {}
+            for number in record.phones:
+                phones.setdefault(crud.normalize_phone_number(number) or number, number)
+            taken = sorted(taken_numbers.intersection(phones))
+            if record.building_id not in known_buildings:
+                self._fail(line_number, f"Building {record.building_id} not found")
+            elif not known_activities.issuperset(record.activities):
+                missing = sorted(set(record.activities) - known_activities)
+                self._fail(line_number, f"Activities not found: {', '.join(map(str, missing))}")
+            elif taken:
+                self._fail(line_number, str(crud.PhoneNumberTaken(taken)))
+            else:
+                taken_numbers.update(phones)
+                valid.append((line_number, record, phones))
+        if not valid:
+            return
+
+        try:
+            organization_ids = db.scalars(
+                insert(models.Organization).returning(
+                    models.Organization.id, sort_by_parameter_order=True
+                ),
+                [
+                    {"name": record.name, "building_id": record.building_id, "change_seq": seq}
+                    for (_, record, _), seq in zip(valid, crud.next_change_seqs(db, len(valid)))
+                ]
+            ).all()
+
+            phones = [
+                {
+                    "number": number,
+                    "normalized_number": crud.normalize_phone_number(number),
+                    "organization_id": organization_id
+                }
+                for organization_id, (_, _, record_phones) in zip(organization_ids, valid)
+                for number in record_phones.values()
+            ]
+            if phones:
+                db.execute(insert(models.Phone), phones)
+
+            links = [
+                {"organization_id": organization_id, "activity_id": activity_id}
+                for organization_id, (_, record, _) in zip(organization_ids, valid)
+                for activity_id in dict.fromkeys(record.activities)
+            ]
+            if links:
+                db.execute(insert(models.organization_activity), links)
+
+            crud.sync_new_organizations(db, organization_ids)
+            db.commit()
+            bump_data_version()
+        except Exception as e:
+            db.rollback()
+            for line_number, _, _ in valid:
+                self._fail(line_number, f"Database error: {e}")
+            return
+
+        self.result.processed += len(valid)
+        self.result.inserted += len(valid)
+
+    def _fail(self, line_number: int, error: str):
+        self.result.processed += 1
+        self.result.failed += 1
+        self._errors.append(schemas.BulkIngestError(line=line_number, error=error))
+
+async def iter_stream_lines(chunks: AsyncIterator[bytes]):
+    """
+    Превращает поток байтов в пронумерованные строки байтов,
+    не накапливая в памяти ничего, кроме незавершенной строки.
+    Декодирует строки OrganizationImporter, чтобы ошибка кодировки
+    относилась к одной строке
+    """
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            yield line_number, line.rstrip(b"\r")
+    if buffer:
+        yield line_number + 1, buffer
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовая загрузка организаций из NDJSON или CSV")
+    parser.add_argument("path", help="Путь к файлу, '-' - стандартный ввод")
+    parser.add_argument("--format", choices=["ndjson", "csv"], help="По умолчанию определяется по расширению")
+    args = parser.parse_args()
+
+    from .database import SessionLocal
+
+    input_format = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    source = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+    db = SessionLocal()
+    try:
+        importer = OrganizationImporter(db, RecordParser(input_format))
+        chunk = []
+        for line_number, line in enumerate(source, start=1):
+            chunk.append((line_number, line.rstrip(b"\r\n")))
+            if len(chunk) >= INGEST_CHUNK_SIZE:
+                importer.import_lines(chunk)
+                chunk = []
+        importer.import_lines(chunk)
+    except ValueError as e:
+        sys.exit(f"Ошибка загрузки: {e}")
+    finally:
+        db.close()
+        if source is not sys.stdin.buffer:
+            source.close()
+
+    print(importer.result.model_dump_json(indent=2))
+    sys.exit(1 if importer.result.failed else 0)
+
+if __name__ == "__main__":
+    main()
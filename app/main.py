@@ -1,17 +1,24 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, Form
+from fastapi import FastAPI, Depends, HTTPException, Request, Form, Query
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse, RedirectResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from . import crud, models, schemas
-from .database import engine, get_db
-from .seed import seed_database
+from typing import List, Literal, Optional
+from . import clusters, crud, ingest, models, schemas, snapshot
+from .database import get_db, get_read_db, ReadSessionLocal, settings, sqlite_file_path
+from .cache import (
+    DataVersionMiddleware, ResponseCache, ResponseCacheMiddleware, bump_data_version, watch_database
+)
+from .metrics import InstrumentedRoute, MetricsMiddleware, MetricsRegistry
+from .pagination import (
+    cursor_query, decode_cursor, decode_id_cursor, next_cursor_headers, page_size_query, set_next_cursor
+)
+import json
 import os
 
-# Создаем таблицы и заполняем базу данных при запуске
-models.Base.metadata.create_all(bind=engine)
-seed_database()
+# Схема создается миграциями (alembic upgrade head), пример данных - командой
+# python -m app.seed; при импорте приложение только открывает движок
 
 app = FastAPI(
     title="Organizations Directory API",
@@ -30,11 +37,79 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+# Кэш ответов поисковых эндпоинтов, сбрасываемый любой записью в базу
+if settings.response_cache_enabled:
+    app.add_middleware(
+        ResponseCacheMiddleware,
+        cache=ResponseCache(settings.response_cache_max_entries, settings.response_cache_ttl_seconds),
+        path_prefix="/api/organizations/",
+        cacheable_posts=(
+            "/api/organizations/batch", "/api/organizations/search",
+            "/api/organizations/geo", "/api/organizations/geo/nearest",
+            "/api/organizations/search/phone", "/api/organizations/search/facets"
+        ),
+        excluded_paths=("/api/organizations/export",)
+    )
+
+# Записи других процессов (воркеров uvicorn, консольной загрузки) сбрасывают
+# кэш ответов и снимок каталога этого процесса; проверка стоит снаружи кэша
+database_path = sqlite_file_path(settings.database_url)
+if settings.watch_external_writes and database_path is not None:
+    app.add_middleware(DataVersionMiddleware, monitor=watch_database(database_path))
+
+# Метрики добавляются последними, чтобы учитывать и ответы из кэша
+metrics_registry = MetricsRegistry()
+if settings.metrics_enabled:
+    app.router.route_class = InstrumentedRoute
+    app.add_middleware(MetricsMiddleware, registry=metrics_registry, routes=app.router.routes)
+
+# Снимок каталога в памяти; пока он собирается или устарел, отвечает база
+snapshot_manager = snapshot.SnapshotManager(ReadSessionLocal) if settings.snapshot_enabled else None
+
+@app.on_event("startup")
+def load_snapshot():
+    if snapshot_manager is not None:
+        snapshot_manager.refresh()
+
+def current_snapshot() -> Optional[snapshot.CatalogueSnapshot]:
+    return snapshot_manager.get() if snapshot_manager is not None else None
+
 # Настройка статических файлов и шаблонов
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
+def _documents_response(documents: List[str], headers: Optional[dict] = None) -> Response:
+    # Готовые JSON-документы организаций вклеиваются в ответ без гидратации ORM и валидации
+    return Response("[" + ",".join(documents) + "]", media_type="application/json", headers=headers)
+
+def _organizations_page(
+    db: Session, organization_ids: List[int], limit: int, *last_key,
+    catalogue: Optional[snapshot.CatalogueSnapshot] = None
+) -> Response:
+    # По умолчанию курсор страницы - ID последней организации
+    headers = next_cursor_headers(
+        len(organization_ids), limit, *(last_key or organization_ids[-1:])
+    )
+    # Документы берутся из снимка каталога, если по нему выполнен поиск
+    if catalogue is not None:
+        return _documents_response(catalogue.get_organization_documents(organization_ids), headers)
+    return _documents_response(crud.get_organization_documents(db, organization_ids), headers)
+
+def _id_page(response: Response, items: list, limit: int):
+    # Страница выборки, упорядоченной по id: курсор - id последнего элемента
+    if items:
+        set_next_cursor(response, len(items), limit, items[-1].id)
+    return items
+
+# Метрики в текстовом формате Prometheus
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    text = metrics_registry.render()
+    if snapshot_manager is not None:
+        text += snapshot_manager.render_metrics()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
 # Главная страница
 @app.get("/")
 async def index(request: Request):
@@ -42,7 +117,7 @@ async def index(request: Request):
 
 # Страница со списком организаций
 @app.get("/organizations")
-async def organizations(request: Request, db: Session = Depends(get_db)):
+async def organizations(request: Request, db: Session = Depends(get_read_db)):
     organizations = crud.get_organizations(db)
     return templates.TemplateResponse(
         "organizations.html",
@@ -55,7 +130,7 @@ async def organizations(request: Request, db: Session = Depends(get_db)):
 
 # Страница добавления организации
 @app.get("/organizations/new")
-async def new_organization_form(request: Request, db: Session = Depends(get_db)):
+async def new_organization_form(request: Request, db: Session = Depends(get_read_db)):
     buildings = crud.get_buildings(db)
     activities = crud.get_activities(db)
     return templates.TemplateResponse(
@@ -79,11 +154,13 @@ async def create_organization(
     db: Session = Depends(get_db)
 ):
     try:
+        building_seq, organization_seq = crud.next_change_seqs(db, 2)
         # Создаем новое здание
         building = models.Building(
             address=address,
             latitude=0.0,  # Временные координаты
-            longitude=0.0  # Временные координаты
+            longitude=0.0,  # Временные координаты
+            change_seq=building_seq
         )
         db.add(building)
         db.flush()
@@ -91,28 +168,40 @@ async def create_organization(
         # Создаем организацию
         organization = models.Organization(
             name=name,
-            building_id=building.id
+            building_id=building.id,
+            change_seq=organization_seq
         )
         db.add(organization)
         db.flush()
         
         # Добавляем телефоны
         if phones:
+            registered = crud.get_registered_phone_numbers(db, phones)
+            if registered:
+                raise crud.PhoneNumberTaken(registered)
             for phone_number in phones:
                 if phone_number.strip():  # Проверяем, что номер не пустой
-                    phone = models.Phone(number=phone_number)
+                    normalized_number = crud.normalize_phone_number(phone_number)
+                    if normalized_number is not None and any(
+                        phone.normalized_number == normalized_number for phone in organization.phones
+                    ):
+                        continue
+                    phone = models.Phone(number=phone_number, normalized_number=normalized_number)
                     db.add(phone)
                     db.flush()
                     organization.phones.append(phone)
         
         # Добавляем виды деятельности
         if activities:
-            for activity_id in activities:
+            for activity_id in dict.fromkeys(activities):
                 activity = db.query(models.Activity).get(activity_id)
                 if activity:
                     organization.activities.append(activity)
+        db.flush()
+        crud.sync_new_organizations(db, [organization.id])
         
         db.commit()
+        bump_data_version()
         return RedirectResponse(url="/organizations", status_code=303)
     except Exception as e:
         db.rollback()
@@ -129,10 +218,68 @@ async def create_organization(
     response_model=schemas.Organization,
     tags=["Организации"],
     summary="Создать новую организацию",
-    description="Создает новую организацию с указанными параметрами"
+    description="""Создает новую организацию с указанными параметрами.
+    Телефон, который после нормализации совпадает с уже зарегистрированным, дает 409"""
 )
 def create_organization_api(organization: schemas.OrganizationCreate, db: Session = Depends(get_db)):
-    return crud.create_organization(db=db, organization=organization)
+    try:
+        return crud.create_organization(db=db, organization=organization)
+    except crud.PhoneNumberTaken as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/api/organizations/bulk", 
+    response_model=schemas.BulkIngestResult,
+    tags=["Организации"],
+    summary="Массовая загрузка организаций",
+    description="""Загружает организации из потока NDJSON (по одному объекту OrganizationCreate в строке)
+    или CSV с колонками name, building_id, phones, activities (списки через точку с запятой).
+    Формат определяется параметром format или заголовком Content-Type.
+    Ошибочные строки перечисляются в отчете и не прерывают загрузку""",
+    openapi_extra={"requestBody": {"content": {
+        "application/x-ndjson": {"schema": {"type": "string"}},
+        "text/csv": {"schema": {"type": "string"}}
+    }}}
+)
+async def bulk_create_organizations_api(
+    request: Request,
+    format: Optional[Literal["ndjson", "csv"]] = None,
+    db: Session = Depends(get_db)
+):
+    if format is None:
+        format = "csv" if request.headers.get("content-type", "").startswith("text/csv") else "ndjson"
+    importer = ingest.OrganizationImporter(db, ingest.RecordParser(format))
+    chunk = []
+    try:
+        async for line in ingest.iter_stream_lines(request.stream()):
+            chunk.append(line)
+            if len(chunk) >= ingest.INGEST_CHUNK_SIZE:
+                await run_in_threadpool(importer.import_lines, chunk)
+                chunk = []
+        await run_in_threadpool(importer.import_lines, chunk)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return importer.result
+
+@app.post("/api/organizations/batch", 
+    response_model=schemas.OrganizationBatch,
+    tags=["Организации"],
+    summary="Получить организации по списку ID",
+    description=f"""Возвращает до {schemas.MAX_BATCH_LOOKUP_SIZE} организаций одним запросом к базе.
+    Элементы items идут в порядке переданных ID, на месте ненайденных - null;
+    ненайденные ID дополнительно перечислены в missing"""
+)
+def read_organizations_batch_api(request: schemas.OrganizationBatchRequest, db: Session = Depends(get_read_db)):
+    catalogue = current_snapshot()
+    if catalogue is not None:
+        found = catalogue.get_organization_documents_by_id(request.ids)
+    else:
+        found = crud.get_organization_documents_by_id(db, request.ids)
+    items = ",".join(found.get(organization_id, "null") for organization_id in request.ids)
+    missing = list(dict.fromkeys(organization_id for organization_id in request.ids if organization_id not in found))
+    return Response(
+        f'{{"items":[{items}],"missing":{json.dumps(missing)}}}', media_type="application/json"
+    )
 
 @app.get("/api/organizations/", 
     response_model=List[schemas.Organization],
@@ -140,9 +287,61 @@ def create_organization_api(organization: schemas.OrganizationCreate, db: Sessio
     summary="Получить список организаций",
     description="Возвращает список всех организаций с возможностью пагинации"
 )
-def read_organizations_api(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    organizations = crud.get_organizations(db, skip=skip, limit=limit)
-    return organizations
+def read_organizations_api(
+    cursor: Optional[str] = cursor_query(),
+    limit: int = page_size_query(),
+    db: Session = Depends(get_read_db)
+):
+    after_id = decode_id_cursor(cursor)
+    catalogue = current_snapshot()
+    if catalogue is not None:
+        organization_ids = catalogue.get_organization_ids(after_id=after_id, limit=limit)
+    else:
+        organization_ids = crud.get_organization_ids(db, after_id=after_id, limit=limit)
+    return _organizations_page(db, organization_ids, limit, catalogue=catalogue)
+
+@app.get("/api/organizations/export", 
+    tags=["Организации"],
+    summary="Выгрузить все организации",
+    description="Потоково выгружает все организации со зданием, телефонами и видами деятельности в формате NDJSON",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}}
+)
+def export_organizations_api():
+    def generate():
+        db = ReadSessionLocal()
+        try:
+            for batch in crud.iter_organization_batches(db):
+                yield "".join(
+                    schemas.Organization.model_validate(organization).model_dump_json() + "\n"
+                    for organization in batch
+                )
+        finally:
+            db.close()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@app.get("/api/organizations/clusters", 
+    response_model=List[schemas.OrganizationCluster],
+    tags=["Поиск"],
+    summary="Кластеры организаций для карты",
+    description="""Возвращает ячейки сетки карты внутри области с числом организаций, центроидом
+    и самыми частыми видами деятельности. Каждый тайл масштаба zoom делится на 4x4 ячейки;
+    для слишком большой области выбирается более крупная сетка"""
+)
+def get_organization_clusters_api(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    zoom: int = Query(..., ge=0, le=22, description="Масштаб карты"),
+    db: Session = Depends(get_read_db)
+):
+    if min_lat > max_lat or min_lon > max_lon:
+        raise HTTPException(status_code=400, detail="Invalid bounding box")
+    return clusters.get_clusters(db, schemas.ClusterSearchParams(
+        min_lat=min_lat, min_lon=min_lon, max_lat=max_lat, max_lon=max_lon, zoom=zoom
+    ))
 
 @app.get("/api/organizations/{organization_id}", 
     response_model=schemas.Organization,
@@ -150,11 +349,15 @@ def read_organizations_api(skip: int = 0, limit: int = 100, db: Session = Depend
     summary="Получить информацию об организации",
     description="Возвращает подробную информацию об организации по её ID"
 )
-def read_organization_api(organization_id: int, db: Session = Depends(get_db)):
-    db_organization = crud.get_organization(db, organization_id=organization_id)
-    if db_organization is None:
+def read_organization_api(organization_id: int, db: Session = Depends(get_read_db)):
+    catalogue = current_snapshot()
+    if catalogue is not None:
+        documents = catalogue.get_organization_documents([organization_id])
+    else:
+        documents = crud.get_organization_documents(db, [organization_id])
+    if not documents:
         raise HTTPException(status_code=404, detail="Organization not found")
-    return db_organization
+    return Response(documents[0], media_type="application/json")
 
 @app.post("/api/buildings/", 
     response_model=schemas.Building,
@@ -171,9 +374,19 @@ def create_building_api(building: schemas.BuildingCreate, db: Session = Depends(
     summary="Получить список зданий",
     description="Возвращает список всех зданий с возможностью пагинации"
 )
-def read_buildings_api(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    buildings = crud.get_buildings(db, skip=skip, limit=limit)
-    return buildings
+def read_buildings_api(
+    response: Response,
+    cursor: Optional[str] = cursor_query(),
+    limit: int = page_size_query(),
+    db: Session = Depends(get_read_db)
+):
+    after_id = decode_id_cursor(cursor)
+    catalogue = current_snapshot()
+    if catalogue is not None:
+        buildings = catalogue.get_buildings(after_id=after_id, limit=limit)
+    else:
+        buildings = crud.get_buildings(db, after_id=after_id, limit=limit)
+    return _id_page(response, buildings, limit)
 
 @app.post("/api/activities/", 
     response_model=schemas.Activity,
@@ -190,15 +403,41 @@ def create_activity_api(activity: schemas.ActivityCreate, db: Session = Depends(
     summary="Получить список видов деятельности",
     description="Возвращает список всех видов деятельности с возможностью пагинации"
 )
-def read_activities_api(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    activities = crud.get_activities(db, skip=skip, limit=limit)
-    return activities
+def read_activities_api(
+    response: Response,
+    cursor: Optional[str] = cursor_query(),
+    limit: int = page_size_query(),
+    db: Session = Depends(get_read_db)
+):
+    after_id = decode_id_cursor(cursor)
+    catalogue = current_snapshot()
+    if catalogue is not None:
+        activities = catalogue.get_activities(after_id=after_id, limit=limit)
+    else:
+        activities = crud.get_activities(db, after_id=after_id, limit=limit)
+    return _id_page(response, activities, limit)
+
+@app.get("/api/activities/tree",
+    response_model=List[schemas.Activity],
+    tags=["Виды деятельности"],
+    summary="Получить дерево видов деятельности",
+    description="Возвращает все деревья видов деятельности или поддерево с корнем root_id. "
+                "Дерево собирается из одного запроса и хранится в памяти до создания нового вида деятельности"
+)
+def read_activity_tree_api(
+    root_id: Optional[int] = Query(None, description="ID корня поддерева"),
+    db: Session = Depends(get_read_db)
+):
+    forest = crud.get_activity_forest(db, root_id)
+    if forest is None:
+        raise HTTPException(status_code=404, detail="Activity not found")
+    return forest
 
 @app.get("/organizations/{organization_id}")
 async def organization_details(
     request: Request,
     organization_id: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     organization = crud.get_organization(db, organization_id)
     if not organization:
@@ -219,9 +458,32 @@ async def organization_details(
         }
     )
 
+# Лента изменений для синхронизации внешних копий каталога
+@app.get("/api/changes", 
+    response_model=schemas.ChangeFeed,
+    tags=["Синхронизация"],
+    summary="Лента изменений каталога",
+    description=f"""Возвращает организации, здания и виды деятельности, созданные или измененные
+    после изменения с номером since, в порядке номеров изменений, не больше limit
+    (до {schemas.MAX_CHANGE_FEED_SIZE}) за запрос. Каждая запись приходит в текущем состоянии.
+    Следующий запрос передает в since значение next_since; has_more означает, что изменения еще есть"""
+)
+def read_changes_api(
+    since: int = Query(0, ge=0, description="Номер последнего полученного изменения"),
+    limit: int = Query(500, ge=1, le=schemas.MAX_CHANGE_FEED_SIZE),
+    db: Session = Depends(get_read_db)
+):
+    changes = crud.get_changes(db, after_seq=since, limit=limit)
+    items = ",".join(crud.get_change_documents(db, changes))
+    next_since = changes[-1][0] if changes else since
+    return Response(
+        f'{{"changes":[{items}],"next_since":{next_since},"has_more":{json.dumps(len(changes) == limit)}}}',
+        media_type="application/json"
+    )
+
 # Страница со списком адресов
 @app.get("/buildings")
-async def buildings(request: Request, db: Session = Depends(get_db)):
+async def buildings(request: Request, db: Session = Depends(get_read_db)):
     buildings = crud.get_buildings(db)
     return templates.TemplateResponse(
         "buildings.html",
@@ -239,9 +501,19 @@ async def buildings(request: Request, db: Session = Depends(get_db)):
     summary="Поиск организаций по зданию",
     description="Возвращает список организаций, расположенных в указанном здании"
 )
-def get_organizations_by_building_api(building_id: int, db: Session = Depends(get_db)):
-    organizations = crud.get_organizations_by_building(db, building_id)
-    return organizations
+def get_organizations_by_building_api(
+    building_id: int,
+    cursor: Optional[str] = cursor_query(),
+    limit: int = page_size_query(),
+    db: Session = Depends(get_read_db)
+):
+    after_id = decode_id_cursor(cursor)
+    catalogue = current_snapshot()
+    if catalogue is not None:
+        organization_ids = catalogue.get_organization_ids_by_building(building_id, after_id=after_id, limit=limit)
+    else:
+        organization_ids = crud.get_organization_ids_by_building(db, building_id, after_id=after_id, limit=limit)
+    return _organizations_page(db, organization_ids, limit, catalogue=catalogue)
 
 @app.get("/api/organizations/activity/{activity_id}", 
     response_model=List[schemas.Organization],
@@ -252,10 +524,22 @@ def get_organizations_by_building_api(building_id: int, db: Session = Depends(ge
 def get_organizations_by_activity_api(
     activity_id: int,
     include_children: bool = True,
-    db: Session = Depends(get_db)
+    max_depth: Optional[int] = Query(None, ge=0, description="Максимальная глубина вложенности дочерних видов деятельности"),
+    cursor: Optional[str] = cursor_query(),
+    limit: int = page_size_query(),
+    db: Session = Depends(get_read_db)
 ):
-    organizations = crud.get_organizations_by_activity(db, activity_id, include_children)
-    return organizations
+    after_id = decode_id_cursor(cursor)
+    catalogue = current_snapshot()
+    if catalogue is not None:
+        organization_ids = catalogue.get_organization_ids_by_activity(
+            activity_id, include_children, max_depth, after_id=after_id, limit=limit
+        )
+    else:
+        organization_ids = crud.get_organization_ids_by_activity(
+            db, activity_id, include_children, max_depth, after_id=after_id, limit=limit
+        )
+    return _organizations_page(db, organization_ids, limit, catalogue=catalogue)
 
 @app.post("/api/organizations/geo", 
     response_model=List[schemas.Organization],
@@ -265,23 +549,167 @@ def get_organizations_by_activity_api(
 )
 def get_organizations_by_geo_api(
     params: schemas.GeoSearchParams,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = cursor_query(),
+    limit: int = page_size_query(),
+    db: Session = Depends(get_read_db)
 ):
-    organizations = crud.get_organizations_by_geo(db, params)
-    return organizations
+    after = decode_cursor(cursor)
+    # Ключ страницы радиуса - (расстояние, id), прямоугольника - (id,)
+    if after is not None and (
+        len(after) != (2 if params.radius_km else 1) or not isinstance(after[-1], int)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    catalogue = current_snapshot()
+    if catalogue is not None:
+        page = catalogue.get_organization_ids_by_geo(params, after=after, limit=limit)
+    else:
+        page = crud.get_organization_ids_by_geo(db, params, after=after, limit=limit)
+    return _organizations_page(
+        db, [org_id for org_id, _ in page], limit, *(page[-1][1] if page else ()), catalogue=catalogue
+    )
+
+@app.post("/api/organizations/geo/nearest", 
+    response_model=List[schemas.OrganizationWithDistance],
+    tags=["Поиск"],
+    summary="Поиск ближайших организаций",
+    description="Возвращает ближайшие к точке организации, отсортированные по расстоянию"
+)
+def get_nearest_organizations_api(
+    params: schemas.NearestSearchParams,
+    db: Session = Depends(get_read_db)
+):
+    options = dict(
+        limit=params.limit,
+        activity_id=params.activity_id,
+        include_children=params.include_children,
+        max_radius_km=params.max_radius_km
+    )
+    catalogue = current_snapshot()
+    if catalogue is not None:
+        nearest = catalogue.get_nearest_organization_ids(params.center, **options)
+        documents = catalogue.get_organization_documents_by_id([org_id for org_id, _ in nearest])
+    else:
+        nearest = crud.get_nearest_organization_ids(db, params.center, **options)
+        documents = crud.get_organization_documents_by_id(db, [org_id for org_id, _ in nearest])
+    # Документ каждой организации дополняется ее расстоянием; организации
+    # без документа (удаленные между запросами) пропускаются
+    return _documents_response([
+        json.dumps(
+            {**json.loads(documents[org_id]), "distance_km": distance},
+            ensure_ascii=False, separators=(",", ":")
+        )
+        for org_id, distance in nearest
+        if org_id in documents
+    ])
+
+@app.post("/api/organizations/search", 
+    response_model=List[schemas.Organization],
+    tags=["Поиск"],
+    summary="Комбинированный поиск организаций",
+    description="""Возвращает организации, удовлетворяющие всем переданным фильтрам: зданию,
+    виду деятельности (с поддеревом), подстроке названия вида деятельности (activity_name),
+    названию (name_mode как у /search/name), радиусу или прямоугольнику. Первым применяется
+    фильтр с наименьшим числом кандидатов по индексу, остальные проверяются только на них.
+    Выбранный порядок фильтров и оценки кандидатов возвращаются в заголовке X-Search-Plan"""
+)
+def search_organizations_combined_api(
+    params: schemas.CombinedSearchParams,
+    cursor: Optional[str] = cursor_query(),
+    limit: int = page_size_query(),
+    db: Session = Depends(get_read_db)
+):
+    organization_ids, plan = crud.search_organization_ids_combined(
+        db, params, after_id=decode_id_cursor(cursor), limit=limit
+    )
+    response = _organizations_page(db, organization_ids, limit)
+    response.headers["X-Search-Plan"] = ", ".join(
+        f"{step.name}={'scan' if step.estimate is None else step.estimate}"
+        f"{'+' if step.estimate == crud.SEARCH_ESTIMATE_CAP else ''}"
+        for step in plan
+    )
+    return response
+
+@app.post("/api/organizations/search/facets",
+    response_model=schemas.SearchFacets,
+    tags=["Поиск"],
+    summary="Счетчики результатов комбинированного поиска",
+    description="""Принимает те же фильтры, что и комбинированный поиск, и возвращает общее число
+    подходящих организаций, число по каждому виду деятельности с учетом поддерева (вид учитывает
+    организации всех своих потомков) и по зданиям. Фильтры повторяют списковые поиски: building_id и
+    activity_id - поиск по зданию и виду деятельности, activity_name - /search/activity, name с name_mode -
+    /search/name, center с radius_km или rectangle - /geo. Счетчики считаются одним запросом
+    с группировкой, организации не загружаются"""
+)
+def search_facets_api(
+    params: schemas.CombinedSearchParams,
+    buildings_limit: int = Query(50, ge=1, le=schemas.MAX_BUILDING_FACETS, description="Сколько зданий с наибольшим числом организаций вернуть"),
+    db: Session = Depends(get_read_db)
+):
+    return crud.get_search_facets(db, params, buildings_limit=buildings_limit)
 
 @app.get("/api/organizations/search/name", 
     response_model=List[schemas.Organization],
     tags=["Поиск"],
     summary="Поиск организаций по названию",
-    description="Возвращает список организаций, чьи названия содержат указанную строку"
+    description="""Возвращает список организаций, чьи названия содержат указанную строку.
+    В режиме fts используется полнотекстовый индекс и результаты упорядочены по релевантности;
+    запросы короче трех символов и режим substring выполняют поиск подстроки по всей таблице"""
 )
 def search_organizations_by_name_api(
     name: str,
-    db: Session = Depends(get_db)
+    mode: Literal["fts", "substring"] = "fts",
+    cursor: Optional[str] = cursor_query(),
+    limit: int = page_size_query(),
+    db: Session = Depends(get_read_db)
 ):
-    organizations = crud.search_organizations_by_name(db, name)
-    return organizations
+    if mode == "fts" and crud.can_search_organizations_full_text(db, name):
+        after = decode_cursor(cursor)
+        if after is not None and len(after) != 2:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        page = crud.search_organization_ids_full_text(db, name, after=after, limit=limit)
+        return _organizations_page(
+            db, [org_id for org_id, _ in page], limit,
+            *((page[-1][1], page[-1][0]) if page else ())
+        )
+
+    organization_ids = crud.search_organization_ids_by_name(
+        db, name, after_id=decode_id_cursor(cursor), limit=limit
+    )
+    return _organizations_page(db, organization_ids, limit)
+
+@app.get("/api/organizations/search/phone", 
+    response_model=schemas.Organization,
+    tags=["Поиск"],
+    summary="Найти организацию по номеру телефона",
+    description="""Возвращает организацию, которой принадлежит номер. Номер сравнивается после
+    нормализации, поэтому «+7 (999) 111-22-33» и «8 999 111 22 33» считаются одним номером"""
+)
+def search_organization_by_phone_api(number: str, db: Session = Depends(get_read_db)):
+    organization_id = crud.get_organization_id_by_phone(db, number)
+    documents = crud.get_organization_documents(db, [organization_id]) if organization_id is not None else []
+    if not documents:
+        raise HTTPException(status_code=404, detail="Organization not found")
+    return Response(documents[0], media_type="application/json")
+
+@app.post("/api/organizations/search/phone", 
+    response_model=List[schemas.PhoneMatch],
+    tags=["Поиск"],
+    summary="Сопоставить список номеров с организациями",
+    description=f"""Сопоставляет до {schemas.MAX_PHONE_LOOKUP_SIZE} номеров (например, журнал входящих звонков)
+    с организациями по уникальному индексу нормализованных номеров. Элементы ответа идут в порядке
+    переданных номеров; для незарегистрированных номеров organization_id равен null"""
+)
+def match_organizations_by_phones_api(request: schemas.PhoneLookupRequest, db: Session = Depends(get_read_db)):
+    found = crud.get_organization_ids_by_phones(db, request.numbers)
+    matches = []
+    for number in request.numbers:
+        normalized_number = crud.normalize_phone_number(number)
+        matches.append(schemas.PhoneMatch(
+            number=number,
+            normalized_number=normalized_number,
+            organization_id=found.get(normalized_number)
+        ))
+    return matches
 
 @app.get("/api/organizations/search/activity", 
     response_model=List[schemas.Organization],
@@ -292,7 +720,12 @@ def search_organizations_by_name_api(
 def search_organizations_by_activity_api(
     activity_name: str,
     include_children: bool = True,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = cursor_query(),
+    limit: int = page_size_query(),
+    db: Session = Depends(get_read_db)
 ):
-    organizations = crud.search_organizations_by_activity(db, activity_name, include_children)
-    return organizations 
\ No newline at end of file
+    organization_ids = crud.search_organization_ids_by_activity(
+        db, activity_name, include_children,
+        after_id=decode_id_cursor(cursor), limit=limit
+    )
+    return _organizations_page(db, organization_ids, limit) 
\ No newline at end of file
@@ -0,0 +1,280 @@
+"""
+Метрики запросов: число SQL-запросов, время в базе, самый медленный
+запрос, время сериализации и общая задержка.
+
+Счетчики текущего запроса живут в contextvar, который заполняет
+MetricsMiddleware; хуки движка SQLAlchemy (instrument_engine) дописывают
+в него время каждого запроса к базе. По завершении запроса значения
+уходят в заголовок Server-Timing и в гистограммы эндпоинта /metrics.
+"""
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence, Tuple
+
+from fastapi.routing import APIRoute
+from starlette.routing import BaseRoute, Match
+from sqlalchemy import event
+
+slow_query_logger = logging.getLogger("app.sql.slow")
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+MAX_STATEMENT_LENGTH = 500  # Длина SQL в логе медленных запросов
+
+class RequestStats:
+    __slots__ = (
+        "started", "queries", "db_time", "slowest_time", "slowest_statement",
+        "handler_time", "endpoint_time"
+    )
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+        self.handler_time = 0.0
+        self.endpoint_time = 0.0
+
+    @property
+    def serialization_time(self) -> float:
+        # Все, что обработчик маршрута делает помимо самой функции эндпоинта:
+        # разбор параметров, валидация и сериализация ответа
+        return max(0.0, self.handler_time - self.endpoint_time)
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+def get_request_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+def instrument_engine(engine, slow_query_ms: Optional[float] = None):
+    """
+    Подключает к движку хуки, учитывающие каждый запрос в статистике
+    текущего HTTP-запроса и пишущие в лог запросы дольше slow_query_ms
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+            if elapsed > stats.slowest_time:
+                stats.slowest_time = elapsed
+                stats.slowest_statement = statement
+        if slow_query_ms is not None and elapsed * 1000 >= slow_query_ms:
+            slow_query_logger.warning(
+                "%.1f ms: %s", elapsed * 1000, " ".join(statement.split())[:MAX_STATEMENT_LENGTH]
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        # Упавший запрос не доходит до after_cursor_execute - снимаем его отметку
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
+
+def _timed_endpoint(endpoint):
+    # Обертка сохраняет сигнатуру (через __wrapped__), поэтому FastAPI
+    # разбирает параметры и выбирает пул потоков как для исходной функции
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _record_endpoint_time(time.perf_counter() - started)
+    else:
+        @functools.wraps(endpoint)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _record_endpoint_time(time.perf_counter() - started)
+    return timed
+
+def _record_endpoint_time(elapsed: float):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.endpoint_time += elapsed
+
+class InstrumentedRoute(APIRoute):
+    """
+    Маршрут, отдельно замеряющий функцию эндпоинта и весь обработчик,
+    чтобы выделить из общего времени сериализацию ответа
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            started = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                stats = _request_stats.get()
+                if stats is not None:
+                    stats.handler_time += time.perf_counter() - started
+
+        return timed_handler
+
+class Histogram:
+    def __init__(self, name: str, description: str, buckets: Sequence[float]):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        # Метки -> [счетчики по корзинам, сумма, количество]
+        self._series: Dict[Tuple[Tuple[str, str], ...], list] = {}
+
+    def observe(self, labels: Tuple[Tuple[str, str], ...], value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', _format_number(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines)
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._series: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, labels: Tuple[Tuple[str, str], ...], value: float = 1):
+        self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_number(value)}")
+        return "\n".join(lines)
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    ) + "}"
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class MetricsRegistry:
+    """
+    Агрегаты по маршрутам для эндпоинта /metrics. Метки - метод и шаблон
+    пути маршрута, поэтому число серий не растет вместе с числом ID
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter("http_requests_total", "HTTP requests by route and status")
+        self.latency = Histogram("http_request_duration_seconds", "Total request latency", SECONDS_BUCKETS)
+        self.db_time = Histogram("http_request_db_seconds", "Time spent in database queries per request", SECONDS_BUCKETS)
+        self.queries = Histogram("http_request_db_queries", "Database queries per request", QUERY_COUNT_BUCKETS)
+        self.serialization = Histogram(
+            "http_request_serialization_seconds", "Request parsing and response serialization time", SECONDS_BUCKETS
+        )
+        self.slowest_query = Histogram(
+            "http_request_db_slowest_query_seconds", "Slowest database query per request", SECONDS_BUCKETS
+        )
+
+    def observe(self, method: str, route: str, status: int, stats: RequestStats, total: float):
+        labels = (("method", method), ("route", route))
+        with self._lock:
+            self.requests.inc(labels + (("status", str(status)),))
+            self.latency.observe(labels, total)
+            self.db_time.observe(labels, stats.db_time)
+            self.queries.observe(labels, stats.queries)
+            self.serialization.observe(labels, stats.serialization_time)
+            self.slowest_query.observe(labels, stats.slowest_time)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = (self.requests, self.latency, self.db_time, self.queries, self.serialization, self.slowest_query)
+            return "\n".join(metric.render() for metric in metrics) + "\n"
+
+def server_timing(stats: RequestStats, total: float) -> str:
+    return ", ".join((
+        f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries"',
+        f"db-slowest;dur={stats.slowest_time * 1000:.2f}",
+        f"serialize;dur={stats.serialization_time * 1000:.2f}",
+        f"total;dur={total * 1000:.2f}",
+    ))
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: заводит статистику на каждый HTTP-запрос, добавляет
+    заголовок Server-Timing и по завершении ответа пишет значения в реестр.
+    Ответы, отданные до маршрутизации (кэш, 304), относятся к маршруту
+    по routes - списку маршрутов приложения
+    """
+
+    def __init__(self, app, registry: MetricsRegistry, routes: Sequence[BaseRoute] = ()):
+        self.app = app
+        self.registry = registry
+        self.routes = routes
+
+    def _match_route(self, scope) -> Optional[BaseRoute]:
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = dict(message)
+                timing = server_timing(stats, time.perf_counter() - stats.started)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stats.reset(token)
+            # Шаблон пути известен после маршрутизации; ответ из кэша маршрутизацию
+            # не проходит, и маршрут ищется заново; без маршрута - одна общая серия
+            route = scope.get("route") or self._match_route(scope)
+            route_path = getattr(route, "path_format", None) or getattr(route, "path", None) or "<unmatched>"
+            self.registry.observe(scope["method"], route_path, status, stats, time.perf_counter() - stats.started)
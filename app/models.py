@@ -1,23 +1,37 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, Index, Table, MetaData, DDL, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
 # Таблица связи между организациями и телефонами
+# Составной первичный ключ исключает повторные связи и покрывает поиск
+# по организации, отдельный индекс - обратный поиск
 organization_phones = Table(
     'organization_phones',
     Base.metadata,
-    Column('organization_id', Integer, ForeignKey('organizations.id')),
-    Column('phone_id', Integer, ForeignKey('phones.id'))
+    Column('organization_id', Integer, ForeignKey('organizations.id'), primary_key=True),
+    Column('phone_id', Integer, ForeignKey('phones.id'), primary_key=True),
+    Index('ix_organization_phones_phone_id', 'phone_id', 'organization_id')
 )
 
 # Таблица связи между организациями и видами деятельности
 organization_activity = Table(
     'organization_activity',
     Base.metadata,
-    Column('organization_id', Integer, ForeignKey('organizations.id')),
-    Column('activity_id', Integer, ForeignKey('activities.id'))
+    Column('organization_id', Integer, ForeignKey('organizations.id'), primary_key=True),
+    Column('activity_id', Integer, ForeignKey('activities.id'), primary_key=True),
+    Index('ix_organization_activity_activity_id', 'activity_id', 'organization_id')
+)
+
+# Таблица замыкания иерархии видов деятельности: пара (предок, потомок)
+# для всех уровней вложенности, включая саму запись с глубиной 0
+activity_closure = Table(
+    'activity_closure',
+    Base.metadata,
+    Column('ancestor_id', Integer, ForeignKey('activities.id'), primary_key=True),
+    Column('descendant_id', Integer, ForeignKey('activities.id'), primary_key=True, index=True),
+    Column('depth', Integer, nullable=False)
 )
 
 class Phone(Base):
@@ -25,7 +39,9 @@ class Phone(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     number = Column(String, index=True)
-    organization_id = Column(Integer, ForeignKey("organizations.id"))
+    # Номер в виде E.164 без «+» для точного поиска, см. crud.normalize_phone_number
+    normalized_number = Column(String, unique=True, index=True)
+    organization_id = Column(Integer, ForeignKey("organizations.id"), index=True)
 
     organization = relationship('Organization', back_populates='phones')
 
@@ -34,8 +50,10 @@ class Activity(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
-    parent_id = Column(Integer, ForeignKey('activities.id'), nullable=True)
+    parent_id = Column(Integer, ForeignKey('activities.id'), nullable=True, index=True)
     level = Column(Integer, default=1)  # Уровень вложенности
+    # Номер последнего изменения записи для ленты изменений, см. crud.next_change_seqs
+    change_seq = Column(Integer, index=True)
 
     # Отношения
     parent = relationship("Activity", remote_side=[id], backref="children")
@@ -48,6 +66,8 @@ class Building(Base):
     address = Column(String, index=True)
     latitude = Column(Float)
     longitude = Column(Float)
+    # Номер последнего изменения записи для ленты изменений, см. crud.next_change_seqs
+    change_seq = Column(Integer, index=True)
     
     organizations = relationship('Organization', back_populates='building')
 
@@ -56,8 +76,171 @@ class Organization(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
-    building_id = Column(Integer, ForeignKey('buildings.id'))
+    building_id = Column(Integer, ForeignKey('buildings.id'), index=True)
+    # Номер последнего изменения записи для ленты изменений, см. crud.next_change_seqs
+    change_seq = Column(Integer, index=True)
     
     building = relationship('Building', back_populates='organizations')
     phones = relationship('Phone', back_populates='organization')
-    activities = relationship('Activity', secondary=organization_activity, back_populates='organizations') 
\ No newline at end of file
+    activities = relationship('Activity', secondary=organization_activity, back_populates='organizations')
+
+class OrganizationDocument(Base):
+    """
+    Готовый JSON-документ организации в формате schemas.Organization
+    (денормализованная модель чтения), обновляется вместе с организацией
+    """
+    __tablename__ = 'organization_documents'
+
+    organization_id = Column(Integer, ForeignKey('organizations.id'), primary_key=True)
+    document = Column(Text, nullable=False)
+
+class OrganizationCluster(Base):
+    """
+    Агрегат организаций в ячейке сетки карты (тайлы Web Mercator уровня level):
+    число организаций и суммы координат для центроида. Обновляется
+    при добавлении организаций, см. app/clusters.py
+    """
+    __tablename__ = 'organization_clusters'
+
+    level = Column(Integer, primary_key=True)
+    cell_x = Column(Integer, primary_key=True)
+    cell_y = Column(Integer, primary_key=True)
+    organization_count = Column(Integer, nullable=False, default=0)
+    latitude_sum = Column(Float, nullable=False, default=0)
+    longitude_sum = Column(Float, nullable=False, default=0)
+
+class OrganizationClusterActivity(Base):
+    # Число организаций ячейки с данным видом деятельности
+    __tablename__ = 'organization_cluster_activities'
+
+    level = Column(Integer, primary_key=True)
+    cell_x = Column(Integer, primary_key=True)
+    cell_y = Column(Integer, primary_key=True)
+    activity_id = Column(Integer, ForeignKey('activities.id'), primary_key=True)
+    organization_count = Column(Integer, nullable=False, default=0)
+
+class ChangeSequence(Base):
+    """
+    Счетчик номеров изменений (единственная строка id = 1). Каждая созданная
+    или измененная организация, здание и вид деятельности получает следующий
+    номер в своем столбце change_seq
+    """
+    __tablename__ = 'change_sequence'
+
+    id = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+CHANGE_SEQUENCE_INIT_DDL = "INSERT INTO change_sequence (id, value) VALUES (1, 0)"
+
+event.listen(ChangeSequence.__table__, 'after_create', DDL(CHANGE_SEQUENCE_INIT_DDL))
+
+# Заполняем таблицу замыкания для видов деятельности, созданных до ее появления
+ACTIVITY_CLOSURE_BACKFILL_DDL = """
+    WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS (
+        SELECT id, id, 0 FROM activities
+        UNION ALL
+        SELECT tree.ancestor_id, activities.id, tree.depth + 1
+        FROM tree JOIN activities ON activities.parent_id = tree.descendant_id
+    )
+    INSERT INTO activity_closure (ancestor_id, descendant_id, depth)
+    SELECT ancestor_id, descendant_id, depth FROM tree
+    WHERE descendant_id NOT IN (SELECT descendant_id FROM activity_closure)
+"""
+
+event.listen(Base.metadata, 'after_create', DDL(ACTIVITY_CLOSURE_BACKFILL_DDL))
+
+# Пространственный индекс по координатам зданий (SQLite R*Tree).
+# Виртуальная таблица живет в отдельном MetaData, чтобы create_all не пытался
+# создать ее как обычную таблицу; синхронизация с buildings - триггерами.
+building_rtree = Table(
+    'buildings_rtree',
+    MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('min_lat', Float),
+    Column('max_lat', Float),
+    Column('min_lon', Float),
+    Column('max_lon', Float)
+)
+
+SQLITE_SPATIAL_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS buildings_rtree
+    USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS buildings_rtree_insert AFTER INSERT ON buildings
+    WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL
+    BEGIN
+        INSERT INTO buildings_rtree (id, min_lat, max_lat, min_lon, max_lon)
+        VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS buildings_rtree_update AFTER UPDATE OF latitude, longitude ON buildings
+    BEGIN
+        DELETE FROM buildings_rtree WHERE id = old.id;
+        INSERT INTO buildings_rtree (id, min_lat, max_lat, min_lon, max_lon)
+        SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+        WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS buildings_rtree_delete AFTER DELETE ON buildings
+    BEGIN
+        DELETE FROM buildings_rtree WHERE id = old.id;
+    END
+    """,
+    # Досоздаем записи индекса для зданий, добавленных до его появления
+    """
+    INSERT INTO buildings_rtree (id, min_lat, max_lat, min_lon, max_lon)
+    SELECT id, latitude, latitude, longitude, longitude FROM buildings
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+      AND id NOT IN (SELECT id FROM buildings_rtree)
+    """
+]
+
+for statement in SQLITE_SPATIAL_INDEX_DDL:
+    event.listen(Base.metadata, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+# Полнотекстовый индекс по названиям организаций (SQLite FTS5 с триграммами,
+# поддерживает поиск по подстроке). rowid индекса совпадает с id организации
+organization_fts = Table(
+    'organizations_fts',
+    MetaData(),
+    Column('rowid', Integer, primary_key=True),
+    Column('name', String),
+    Column('rank', Float)
+)
+
+SQLITE_FULL_TEXT_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS organizations_fts
+    USING fts5(name, tokenize='trigram')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS organizations_fts_insert AFTER INSERT ON organizations
+    BEGIN
+        INSERT INTO organizations_fts (rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS organizations_fts_update AFTER UPDATE OF name ON organizations
+    BEGIN
+        UPDATE organizations_fts SET name = new.name WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS organizations_fts_delete AFTER DELETE ON organizations
+    BEGIN
+        DELETE FROM organizations_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    INSERT INTO organizations_fts (rowid, name)
+    SELECT id, name FROM organizations
+    WHERE id NOT IN (SELECT rowid FROM organizations_fts)
+    """
+]
+
+for statement in SQLITE_FULL_TEXT_INDEX_DDL:
+    event.listen(Base.metadata, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
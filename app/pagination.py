@@ -0,0 +1,65 @@
+import base64
+import json
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, Query, Response
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(*values: Any) -> str:
+    """
+    Упаковывает ключ сортировки последнего элемента страницы
+    в непрозрачную для клиента строку
+    """
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: Optional[str]) -> Optional[List[Any]]:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Ключи сортировки у всех выборок числовые
+    if not isinstance(values, list) or not values or not all(
+        isinstance(value, (int, float)) and not isinstance(value, bool)
+        for value in values
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def decode_id_cursor(cursor: Optional[str]) -> Optional[int]:
+    # Курсор для выборок, упорядоченных по первичному ключу
+    values = decode_cursor(cursor)
+    if values is None:
+        return None
+    if len(values) != 1 or not isinstance(values[0], int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values[0]
+
+def next_cursor_headers(page_size: int, limit: int, *last_key: Any) -> Dict[str, str]:
+    # Полная страница означает, что за ней могут быть еще элементы
+    if page_size and page_size == limit:
+        return {NEXT_CURSOR_HEADER: encode_cursor(*last_key)}
+    return {}
+
+def set_next_cursor(response: Response, page_size: int, limit: int, *last_key: Any):
+    response.headers.update(next_cursor_headers(page_size, limit, *last_key))
+
+def page_size_query():
+    return Query(
+        DEFAULT_PAGE_SIZE,
+        ge=1,
+        le=MAX_PAGE_SIZE,
+        description="Размер страницы"
+    )
+
+def cursor_query():
+    return Query(
+        None,
+        description=f"Курсор следующей страницы из заголовка {NEXT_CURSOR_HEADER}"
+    )
@@ -1,5 +1,5 @@
-from typing import List, Optional
-from pydantic import BaseModel, Field
+from typing import List, Literal, Optional, Union
+from pydantic import BaseModel, Field, model_validator
 from datetime import datetime
 
 class PhoneBase(BaseModel):
@@ -30,6 +30,17 @@ class Activity(ActivityBase):
     class Config:
         from_attributes = True
 
+class ActivitySummary(ActivityBase):
+    id: int
+
+    class Config:
+        from_attributes = True
+
+class OrganizationActivity(ActivitySummary):
+    # Дочерние виды деятельности только на один уровень вглубь,
+    # чтобы сериализация организации не обходила все поддерево
+    children: List[ActivitySummary] = []
+
 class BuildingBase(BaseModel):
     address: str
     latitude: float = Field(..., ge=-90, le=90)
@@ -56,11 +67,60 @@ class Organization(OrganizationBase):
     id: int
     building: Building
     phones: List[Phone]
-    activities: List[Activity]
+    activities: List[OrganizationActivity]
 
     class Config:
         from_attributes = True
 
+# Схемы массовой загрузки
+class BulkIngestError(BaseModel):
+    line: int
+    error: str
+
+class BulkIngestResult(BaseModel):
+    processed: int = 0
+    inserted: int = 0
+    failed: int = 0
+    errors: List[BulkIngestError] = []
+
+# Схемы пакетного получения организаций
+MAX_BATCH_LOOKUP_SIZE = 500
+
+class OrganizationBatchRequest(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=MAX_BATCH_LOOKUP_SIZE)
+
+class OrganizationBatch(BaseModel):
+    # Элементы идут в порядке запрошенных ID, на месте ненайденных - null
+    items: List[Optional[Organization]]
+    missing: List[int]
+
+MAX_PHONE_LOOKUP_SIZE = 5000
+
+class PhoneLookupRequest(BaseModel):
+    numbers: List[str] = Field(..., min_length=1, max_length=MAX_PHONE_LOOKUP_SIZE)
+
+class PhoneMatch(BaseModel):
+    # organization_id - null, если номер не зарегистрирован или в нем нет цифр
+    number: str
+    normalized_number: Optional[str] = None
+    organization_id: Optional[int] = None
+
+# Схемы ленты изменений
+MAX_CHANGE_FEED_SIZE = 1000
+
+class Change(BaseModel):
+    # Запись в текущем состоянии; seq - номер ее последнего изменения
+    seq: int
+    type: Literal["organization", "building", "activity"]
+    id: int
+    data: Union[Organization, Building, ActivitySummary]
+
+class ChangeFeed(BaseModel):
+    changes: List[Change]
+    # Передается в since следующего запроса
+    next_since: int
+    has_more: bool
+
 # Схемы для поиска
 class GeoPoint(BaseModel):
     latitude: float
@@ -75,6 +135,83 @@ class GeoSearchParams(BaseModel):
     radius_km: Optional[float] = None
     rectangle: Optional[GeoRectangle] = None
 
+# Предел радиуса поиска ближайших: дальше поиск не расширяется,
+# чтобы не просматривать весь каталог
+MAX_NEAREST_RADIUS_KM = 200
+
+class NearestSearchParams(BaseModel):
+    center: GeoPoint
+    limit: int = Field(20, ge=1, le=100)
+    activity_id: Optional[int] = None
+    include_children: bool = True
+    # По умолчанию - MAX_NEAREST_RADIUS_KM
+    max_radius_km: Optional[float] = Field(None, gt=0, le=MAX_NEAREST_RADIUS_KM)
+
+class CombinedSearchParams(BaseModel):
+    # Любое сочетание фильтров; организация должна удовлетворять всем
+    building_id: Optional[int] = None
+    activity_id: Optional[int] = None
+    include_children: bool = True
+    max_depth: Optional[int] = Field(None, ge=0)
+    # Подстрока названия вида деятельности, как в /search/activity (с учетом include_children)
+    activity_name: Optional[str] = Field(None, min_length=1)
+    name: Optional[str] = Field(None, min_length=1)
+    # Режим поиска по названию, как в /search/name
+    name_mode: Literal["fts", "substring"] = "fts"
+    center: Optional[GeoPoint] = None
+    radius_km: Optional[float] = Field(None, gt=0)
+    rectangle: Optional[GeoRectangle] = None
+
+    @model_validator(mode="after")
+    def check_filters(self):
+        if self.radius_km is not None and self.center is None:
+            raise ValueError("radius_km requires center")
+        filters = (self.building_id, self.activity_id, self.activity_name, self.name, self.radius_km, self.rectangle)
+        if all(value is None for value in filters):
+            raise ValueError("At least one filter is required")
+        return self
+
+MAX_BUILDING_FACETS = 500
+
+class ActivityFacet(ActivitySummary):
+    # Организации с этим видом деятельности или любым из его потомков
+    organization_count: int
+
+class BuildingFacet(BaseModel):
+    id: int
+    address: str
+    organization_count: int
+
+class SearchFacets(BaseModel):
+    total: int
+    activities: List[ActivityFacet]
+    buildings: List[BuildingFacet]
+
+class ClusterSearchParams(BaseModel):
+    min_lat: float = Field(..., ge=-90, le=90)
+    min_lon: float = Field(..., ge=-180, le=180)
+    max_lat: float = Field(..., ge=-90, le=90)
+    max_lon: float = Field(..., ge=-180, le=180)
+    zoom: int = Field(..., ge=0, le=22)
+
+class ClusterActivity(BaseModel):
+    id: int
+    name: str
+    organization_count: int
+
+class OrganizationCluster(BaseModel):
+    # Ячейка сетки уровня level с номером (x, y) в нумерации тайлов карт
+    level: int
+    x: int
+    y: int
+    organization_count: int
+    center: GeoPoint
+    bounds: GeoRectangle
+    top_activities: List[ClusterActivity]
+
+class OrganizationWithDistance(Organization):
+    distance_km: float
+
 class ActivitySearchParams(BaseModel):
     activity_name: str
     include_children: bool = True
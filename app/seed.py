@@ -1,16 +1,27 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from .models import Base, Activity, Building, Organization, Phone
-from .database import engine, SessionLocal
+"""
+Заполнение пустой базы примером данных.
 
-def seed_database():
-    # Создаем таблицы
-    Base.metadata.create_all(bind=engine)
-    
+Запуск: python -m app.seed (схему предварительно создает alembic upgrade head).
+Повторный запуск ничего не меняет: данные добавляются, только если
+в базе еще нет ни одного вида деятельности.
+"""
+from sqlalchemy import select
+from .models import Activity, Building, Organization, Phone
+from .database import SessionLocal
+from .cache import bump_data_version
+from .crud import link_activity_closure, next_change_seqs, normalize_phone_number, sync_new_organizations
+
+def seed_database() -> bool:
+    """
+    Заполняет базу примером данных. Возвращает False, если база уже заполнена
+    """
     # Создаем сессию
     db = SessionLocal()
     
     try:
+        if db.scalar(select(Activity.id).limit(1)) is not None:
+            return False
+
         # Создаем виды деятельности с иерархией
         food = Activity(name="Еда", level=1)
         db.add(food)
@@ -27,6 +38,10 @@ def seed_database():
         cheese = Activity(name="Сыр", parent_id=dairy.id, level=3)
         db.add_all([beef, pork, milk, cheese])
         db.flush()
+
+        activities = [food, meat, dairy, beef, pork, milk, cheese]
+        for activity in activities:
+            link_activity_closure(db, activity)
         
         # Создаем здания
         buildings = [
@@ -64,12 +79,15 @@ def seed_database():
         
         # Добавляем телефоны
         phones = [
-            Phone(number="2-222-222", organization_id=organizations[0].id),
-            Phone(number="3-333-333", organization_id=organizations[0].id),
-            Phone(number="8-923-666-13-13", organization_id=organizations[0].id),
-            Phone(number="+7 (999) 111-22-33", organization_id=organizations[1].id),
-            Phone(number="+7 (999) 444-55-66", organization_id=organizations[1].id),
-            Phone(number="+7 (999) 777-88-99", organization_id=organizations[2].id)
+            Phone(number=number, normalized_number=normalize_phone_number(number), organization_id=organization.id)
+            for number, organization in [
+                ("2-222-222", organizations[0]),
+                ("3-333-333", organizations[0]),
+                ("8-923-666-13-13", organizations[0]),
+                ("+7 (999) 111-22-33", organizations[1]),
+                ("+7 (999) 444-55-66", organizations[1]),
+                ("+7 (999) 777-88-99", organizations[2])
+            ]
         ]
         db.add_all(phones)
         db.flush()
@@ -78,8 +96,17 @@ def seed_database():
         organizations[0].activities = [meat, beef, pork]
         organizations[1].activities = [meat, beef, pork]
         organizations[2].activities = [dairy, milk, cheese]
+
+        # Номера изменений для ленты изменений
+        records = activities + buildings + organizations
+        for record, seq in zip(records, next_change_seqs(db, len(records))):
+            record.change_seq = seq
+        db.flush()
+        sync_new_organizations(db, [organization.id for organization in organizations])
         
         db.commit()
+        bump_data_version()
+        return True
     except Exception as e:
         db.rollback()
         raise e
@@ -87,4 +114,4 @@ def seed_database():
         db.close()
 
 if __name__ == "__main__":
-    seed_database() 
\ No newline at end of file
+    print("База заполнена примером данных" if seed_database() else "База уже содержит данные, заполнение пропущено") 
\ No newline at end of file
@@ -0,0 +1,503 @@
+"""
+Снимок каталога в памяти процесса.
+
+В режиме SNAPSHOT_ENABLED справочник целиком загружается в компактные
+структуры: здания и виды деятельности - записи со __slots__, организации -
+столбцы numpy (ID, здание, координаты) и готовые JSON-документы, связи
+вид деятельности -> организации и здание -> организации - отсортированные
+массивы целых ID. Поиск по ID, зданию, виду деятельности и геопоиск
+выполняются по снимку без обращения к базе; методы снимка повторяют
+одноименные функции crud.py и возвращают те же результаты.
+
+Снимок неизменяем и помечен версией данных (cache.get_data_version), на
+которой начата его сборка. Запись в базу меняет версию: устаревший снимок
+больше не отдается, новый собирается в фоновом потоке и подменяется одним
+присваиванием. Пока он собирается, запросы обслуживает база. Когда версия -
+номер изменения каталога, новый снимок собирается из текущего и только тех
+записей, чей change_seq больше версии текущего (apply_changes).
+"""
+import logging
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import crud, models, schemas
+from .cache import get_data_version, is_shared_data_version
+
+logger = logging.getLogger("app.snapshot")
+
+EMPTY_IDS = np.empty(0, dtype=np.int64)
+
+class BuildingRecord:
+    __slots__ = ("id", "address", "latitude", "longitude")
+
+    def __init__(self, id: int, address: str, latitude: float, longitude: float):
+        self.id = id
+        self.address = address
+        self.latitude = latitude
+        self.longitude = longitude
+
+class ActivityRecord:
+    # children - записи дочерних видов по возрастанию ID, как у schemas.Activity
+    __slots__ = ("id", "name", "parent_id", "level", "children")
+
+    def __init__(self, id: int, name: str, parent_id: Optional[int], level: int):
+        self.id = id
+        self.name = name
+        self.parent_id = parent_id
+        self.level = level
+        self.children: List["ActivityRecord"] = []
+
+def _page(ids: np.ndarray, after_id: Optional[int], limit: int) -> List[int]:
+    # Keyset-страница отсортированного массива ID
+    start = 0 if after_id is None else int(np.searchsorted(ids, after_id, side="right"))
+    return ids[start:start + limit].tolist()
+
+def _group_ids(keys: np.ndarray, values: np.ndarray) -> Dict[int, np.ndarray]:
+    # Списки смежности: ключ -> отсортированный массив значений
+    if not len(keys):
+        return {}
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    unique_keys, starts = np.unique(keys, return_index=True)
+    return dict(zip(unique_keys.tolist(), np.split(values, starts[1:])))
+
+class CatalogueSnapshot:
+    """
+    Неизменяемый снимок каталога. Столбцы организаций выровнены по
+    отсортированному массиву organization_ids; у организаций без здания
+    или координат в столбцах координат NaN, и геопоиск их не находит
+    """
+
+    def __init__(
+        self,
+        version: int,
+        organization_ids: np.ndarray,
+        organization_buildings: np.ndarray,
+        documents: List[str],
+        buildings: Iterable[BuildingRecord],
+        activities: Iterable[ActivityRecord],
+        link_organizations: np.ndarray,
+        link_activities: np.ndarray
+    ):
+        self.version = version
+        self.organization_ids = organization_ids
+        self.organization_buildings = organization_buildings
+        self.documents = documents
+
+        self.buildings = {building.id: building for building in buildings}
+        self.building_ids = np.array(sorted(self.buildings), dtype=np.int64)
+        coordinates = {
+            building.id: (
+                np.nan if building.latitude is None else building.latitude,
+                np.nan if building.longitude is None else building.longitude
+            )
+            for building in self.buildings.values()
+        }
+        missing = (np.nan, np.nan)
+        self.latitudes = np.fromiter(
+            (coordinates.get(building_id, missing)[0] for building_id in organization_buildings.tolist()),
+            dtype=np.float64, count=len(organization_buildings)
+        )
+        self.longitudes = np.fromiter(
+            (coordinates.get(building_id, missing)[1] for building_id in organization_buildings.tolist()),
+            dtype=np.float64, count=len(organization_buildings)
+        )
+        # ID здания -1 - организация без здания
+        self.building_organizations = _group_ids(organization_buildings, organization_ids)
+
+        self.activities = {activity.id: activity for activity in activities}
+        self.activity_ids = np.array(sorted(self.activities), dtype=np.int64)
+        for activity_id in self.activity_ids.tolist():
+            activity = self.activities[activity_id]
+            parent = self.activities.get(activity.parent_id)
+            if parent is not None:
+                parent.children.append(activity)
+
+        # Пары организация - вид деятельности хранятся для применения изменений
+        self.link_organizations = link_organizations
+        self.link_activities = link_activities
+        self.activity_organizations = _group_ids(link_activities, link_organizations)
+
+        self.build_seconds = 0.0
+        self.memory_bytes = self._memory_footprint()
+
+    def _memory_footprint(self) -> int:
+        # Приблизительный объем: массивы, документы, записи и словари-индексы
+        arrays = [
+            self.organization_ids, self.organization_buildings, self.building_ids, self.activity_ids,
+            self.latitudes, self.longitudes, self.link_organizations, self.link_activities
+        ]
+        arrays += list(self.building_organizations.values()) + list(self.activity_organizations.values())
+        size = sum(array.nbytes for array in arrays)
+        size += sys.getsizeof(self.documents) + sum(sys.getsizeof(document) for document in self.documents)
+        for records in (self.buildings, self.activities):
+            size += sys.getsizeof(records) + sum(sys.getsizeof(record) for record in records.values())
+        size += sum(sys.getsizeof(building.address) for building in self.buildings.values())
+        size += sum(
+            sys.getsizeof(activity.name) + sys.getsizeof(activity.children)
+            for activity in self.activities.values()
+        )
+        size += sys.getsizeof(self.building_organizations) + sys.getsizeof(self.activity_organizations)
+        return size
+
+    # Организации по ID
+    def _positions(self, organization_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Позиции найденных организаций в столбцах и маска найденных
+        if not len(self.organization_ids):
+            return EMPTY_IDS, np.zeros(len(organization_ids), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.organization_ids, organization_ids), len(self.organization_ids) - 1)
+        found = self.organization_ids[positions] == organization_ids
+        return positions[found], found
+
+    def get_organization_ids(self, after_id: Optional[int] = None, limit: int = 100) -> List[int]:
+        return _page(self.organization_ids, after_id, limit)
+
+    def get_organization_documents_by_id(self, organization_ids: List[int]) -> Dict[int, str]:
+        requested = np.array(organization_ids, dtype=np.int64)
+        positions, found = self._positions(requested)
+        return {
+            organization_id: self.documents[position]
+            for organization_id, position in zip(requested[found].tolist(), positions.tolist())
+        }
+
+    def get_organization_documents(self, organization_ids: List[int]) -> List[str]:
+        found = self.get_organization_documents_by_id(organization_ids)
+        return [found[org_id] for org_id in organization_ids if org_id in found]
+
+    # Здания и виды деятельности
+    def get_buildings(self, after_id: Optional[int] = None, limit: int = 100) -> List[BuildingRecord]:
+        return [self.buildings[building_id] for building_id in _page(self.building_ids, after_id, limit)]
+
+    def get_activities(self, after_id: Optional[int] = None, limit: int = 100) -> List[ActivityRecord]:
+        return [self.activities[activity_id] for activity_id in _page(self.activity_ids, after_id, limit)]
+
+    def get_activity_subtree_ids(self, activity_id: int, max_depth: Optional[int] = None) -> List[int]:
+        # Обход поддерева в ширину по спискам дочерних видов
+        if activity_id not in self.activities:
+            return []
+        level, subtree, depth = [self.activities[activity_id]], [], 0
+        while level:
+            subtree.extend(activity.id for activity in level)
+            if max_depth is not None and depth >= max_depth:
+                break
+            level = [child for activity in level for child in activity.children]
+            depth += 1
+        return subtree
+
+    # Поиск организаций
+    def get_organization_ids_by_building(
+        self,
+        building_id: int,
+        after_id: Optional[int] = None,
+        limit: int = 100
+    ) -> List[int]:
+        return _page(self.building_organizations.get(building_id, EMPTY_IDS), after_id, limit)
+
+    def _organization_ids_with_activities(self, activity_ids: List[int]) -> np.ndarray:
+        lists = [self.activity_organizations[activity_id] for activity_id in activity_ids if activity_id in self.activity_organizations]
+        if not lists:
+            return EMPTY_IDS
+        return lists[0] if len(lists) == 1 else np.unique(np.concatenate(lists))
+
+    def get_organization_ids_by_activity(
+        self,
+        activity_id: int,
+        include_children: bool = True,
+        max_depth: Optional[int] = None,
+        after_id: Optional[int] = None,
+        limit: int = 100
+    ) -> List[int]:
+        if not include_children:
+            max_depth = 0
+        return _page(
+            self._organization_ids_with_activities(self.get_activity_subtree_ids(activity_id, max_depth)),
+            after_id, limit
+        )
+
+    def _positions_in_box(self, min_lat: float, max_lat: float, min_lon: float, max_lon: float, positions=None) -> np.ndarray:
+        latitudes = self.latitudes if positions is None else self.latitudes[positions]
+        longitudes = self.longitudes if positions is None else self.longitudes[positions]
+        inside = np.flatnonzero(
+            (latitudes >= min_lat) & (latitudes <= max_lat) & (longitudes >= min_lon) & (longitudes <= max_lon)
+        )
+        return inside if positions is None else positions[inside]
+
+    def _distances(self, center: schemas.GeoPoint, radius_km: float, positions=None):
+        # Кандидаты из описанного прямоугольника и расстояния до них, как в crud._organization_distances
+        positions = self._positions_in_box(*crud.get_bounding_box(center, radius_km), positions)
+        distances = crud.calculate_distances(
+            center.latitude, center.longitude, self.latitudes[positions], self.longitudes[positions]
+        )
+        return self.organization_ids[positions], distances
+
+    def get_organization_ids_by_geo(
+        self,
+        params: schemas.GeoSearchParams,
+        after: Optional[list] = None,
+        limit: int = 100
+    ):
+        if params.radius_km:
+            ids, distances = self._distances(params.center, params.radius_km)
+            within = distances <= params.radius_km
+            if after:
+                after_distance, after_id = after
+                within &= (distances > after_distance) | ((distances == after_distance) & (ids > after_id))
+            ids, distances = ids[within], distances[within]
+            page = np.lexsort((ids, distances))[:limit]
+            return [
+                (org_id, (distance, org_id))
+                for org_id, distance in zip(ids[page].tolist(), distances[page].tolist())
+            ]
+        elif params.rectangle:
+            rectangle = params.rectangle
+            ids = self.organization_ids[self._positions_in_box(
+                rectangle.south_east.latitude, rectangle.north_west.latitude,
+                rectangle.north_west.longitude, rectangle.south_east.longitude
+            )]
+            return [(org_id, (org_id,)) for org_id in _page(ids, after[0] if after else None, limit)]
+        return []
+
+    def get_nearest_organization_ids(
+        self,
+        center: schemas.GeoPoint,
+        limit: int = 20,
+        activity_id: Optional[int] = None,
+        include_children: bool = True,
+        max_radius_km: Optional[float] = None
+    ) -> List[Tuple[int, float]]:
+        # Радиус расширяется так же, как в crud.get_nearest_organization_ids:
+        # расстояния считаются только для кандидатов из прямоугольника
+        if max_radius_km is None:
+            max_radius_km = schemas.MAX_NEAREST_RADIUS_KM
+        positions = None
+        if activity_id is not None:
+            candidates = self._organization_ids_with_activities(
+                self.get_activity_subtree_ids(activity_id, None if include_children else 0)
+            )
+            positions, _ = self._positions(candidates)
+            if len(positions) <= crud.KNN_DIRECT_CANDIDATES:
+                distances = crud.calculate_distances(
+                    center.latitude, center.longitude, self.latitudes[positions], self.longitudes[positions]
+                )
+                return crud.nearest_within(self.organization_ids[positions], distances, max_radius_km, limit)
+        radius_km = min(crud.KNN_INITIAL_RADIUS_KM, max_radius_km)
+        while True:
+            ids, distances = self._distances(center, radius_km, positions)
+            if np.count_nonzero(distances <= radius_km) >= limit or radius_km >= max_radius_km:
+                break
+            radius_km = min(radius_km * crud.KNN_RADIUS_GROWTH, max_radius_km)
+        return crud.nearest_within(ids, distances, radius_km, limit)
+
+def build_snapshot(db: Session, version: int) -> CatalogueSnapshot:
+    """
+    Читает каталог несколькими полными выборками без ORM-объектов.
+    Документы, которых нет в таблице organization_documents, собираются
+    через crud, как при обычном чтении
+    """
+    started = time.perf_counter()
+    organizations = db.execute(
+        select(models.Organization.id, models.Organization.building_id).order_by(models.Organization.id)
+    ).all()
+    organization_ids = np.fromiter((row[0] for row in organizations), dtype=np.int64, count=len(organizations))
+    organization_buildings = np.fromiter(
+        (-1 if row[1] is None else row[1] for row in organizations), dtype=np.int64, count=len(organizations)
+    )
+
+    documents_table = models.OrganizationDocument.__table__
+    found = dict(db.execute(select(documents_table.c.organization_id, documents_table.c.document)).all())
+    missing = [organization_id for organization_id in organization_ids.tolist() if organization_id not in found]
+    if missing:
+        found.update(crud.get_organization_documents_by_id(db, missing))
+    documents = [found[organization_id] for organization_id in organization_ids.tolist()]
+    del found
+
+    building = models.Building
+    activity = models.Activity
+    snapshot = CatalogueSnapshot(
+        version,
+        organization_ids,
+        organization_buildings,
+        documents,
+        (BuildingRecord(*row) for row in db.execute(
+            select(building.id, building.address, building.latitude, building.longitude)
+        )),
+        (ActivityRecord(*row) for row in db.execute(
+            select(activity.id, activity.name, activity.parent_id, activity.level)
+        )),
+        *_read_links(db)
+    )
+    snapshot.build_seconds = time.perf_counter() - started
+    return snapshot
+
+def _read_links(db: Session, organization_ids=None) -> Tuple[np.ndarray, np.ndarray]:
+    # Столбцы пар организация - вид деятельности (всех или организаций из подзапроса)
+    association = models.organization_activity
+    query = select(association.c.organization_id, association.c.activity_id)
+    if organization_ids is not None:
+        query = query.where(association.c.organization_id.in_(organization_ids))
+    links = db.execute(query).all()
+    if not links:
+        return EMPTY_IDS, EMPTY_IDS
+    return tuple(np.array(column, dtype=np.int64) for column in zip(*links))
+
+def apply_changes(db: Session, snapshot: CatalogueSnapshot, version: int) -> CatalogueSnapshot:
+    """
+    Новый снимок из текущего и записей, измененных после его версии
+    (change_seq больше snapshot.version). Из базы читаются только эти здания,
+    виды деятельности и организации с документами и связями; индексы
+    пересобираются в памяти. Записи не удаляются, измененная запись
+    целиком заменяет прежнюю, поэтому повторное применение безопасно
+    """
+    started = time.perf_counter()
+    building, activity, organization = models.Building, models.Activity, models.Organization
+
+    buildings = dict(snapshot.buildings)
+    for row in db.execute(
+        select(building.id, building.address, building.latitude, building.longitude)
+        .where(building.change_seq > snapshot.version)
+    ):
+        buildings[row[0]] = BuildingRecord(*row)
+
+    # Записи видов создаются заново: конструктор снимка заполняет их списки children
+    activities = {
+        record.id: (record.id, record.name, record.parent_id, record.level)
+        for record in snapshot.activities.values()
+    }
+    for row in db.execute(
+        select(activity.id, activity.name, activity.parent_id, activity.level)
+        .where(activity.change_seq > snapshot.version)
+    ):
+        activities[row[0]] = tuple(row)
+
+    changed_query = select(organization.id).where(organization.change_seq > snapshot.version)
+    changed = db.execute(
+        select(organization.id, organization.building_id)
+        .where(organization.change_seq > snapshot.version).order_by(organization.id)
+    ).all()
+    changed_ids = np.fromiter((row[0] for row in changed), dtype=np.int64, count=len(changed))
+    documents_table = models.OrganizationDocument.__table__
+    found = dict(db.execute(
+        select(documents_table.c.organization_id, documents_table.c.document)
+        .where(documents_table.c.organization_id.in_(changed_query))
+    ).all())
+    missing = [organization_id for organization_id in changed_ids.tolist() if organization_id not in found]
+    if missing:
+        found.update(crud.get_organization_documents_by_id(db, missing))
+    new_links = _read_links(db, changed_query)
+
+    kept = ~np.isin(snapshot.organization_ids, changed_ids)
+    organization_ids = np.concatenate([snapshot.organization_ids[kept], changed_ids])
+    organization_buildings = np.concatenate([
+        snapshot.organization_buildings[kept],
+        np.fromiter((-1 if row[1] is None else row[1] for row in changed), dtype=np.int64, count=len(changed))
+    ])
+    documents = [document for document, keep in zip(snapshot.documents, kept.tolist()) if keep]
+    documents += [found[organization_id] for organization_id in changed_ids.tolist()]
+    order = np.argsort(organization_ids, kind="stable")
+    kept_links = ~np.isin(snapshot.link_organizations, changed_ids)
+
+    updated = CatalogueSnapshot(
+        version,
+        organization_ids[order],
+        organization_buildings[order],
+        [documents[position] for position in order.tolist()],
+        buildings.values(),
+        (ActivityRecord(*row) for row in activities.values()),
+        np.concatenate([snapshot.link_organizations[kept_links], new_links[0]]),
+        np.concatenate([snapshot.link_activities[kept_links], new_links[1]])
+    )
+    updated.build_seconds = time.perf_counter() - started
+    return updated
+
+class SnapshotManager:
+    """
+    Хранит текущий снимок и пересобирает его после записей. Снимок
+    отдается, только если его версия совпадает с текущей версией данных
+    """
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        self.session_factory = session_factory
+        self.snapshot: Optional[CatalogueSnapshot] = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        # Сколько раз снимок загружался целиком и сколько раз догружал изменения
+        self.full_loads = 0
+        self.incremental_updates = 0
+
+    def get(self) -> Optional[CatalogueSnapshot]:
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == get_data_version():
+            return snapshot
+        self.request_refresh()
+        return None
+
+    def refresh(self) -> CatalogueSnapshot:
+        # Версия берется до чтения: запись во время сборки сделает снимок устаревшим
+        version = get_data_version()
+        current = self.snapshot
+        # Догрузка изменений возможна, только когда версия - общий номер изменения каталога
+        incremental = current is not None and is_shared_data_version() and current.version <= version
+        db = self.session_factory()
+        try:
+            snapshot = apply_changes(db, current, version) if incremental else build_snapshot(db, version)
+        finally:
+            db.close()
+        self.snapshot = snapshot
+        if incremental:
+            self.incremental_updates += 1
+        else:
+            self.full_loads += 1
+        logger.info(
+            "Catalogue snapshot v%d (%s): %d organizations, %d buildings, %d activities, %.1f MiB, built in %.3f s",
+            version, "changes applied" if incremental else "full load",
+            len(snapshot.organization_ids), len(snapshot.buildings), len(snapshot.activities),
+            snapshot.memory_bytes / 2 ** 20, snapshot.build_seconds
+        )
+        return snapshot
+
+    def request_refresh(self):
+        # Не больше одной фоновой сборки одновременно
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, name="catalogue-snapshot", daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            # Записи во время сборки делают снимок устаревшим - собираем заново
+            while self.refresh().version != get_data_version():
+                pass
+        except Exception:
+            logger.exception("Catalogue snapshot refresh failed")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def render_metrics(self) -> str:
+        snapshot = self.snapshot
+        gauges = [
+            ("catalogue_snapshot_memory_bytes", "Approximate memory used by the catalogue snapshot",
+             snapshot.memory_bytes if snapshot else 0),
+            ("catalogue_snapshot_build_seconds", "Time spent building the current catalogue snapshot",
+             round(snapshot.build_seconds, 6) if snapshot else 0),
+            ("catalogue_snapshot_organizations", "Organizations in the catalogue snapshot",
+             len(snapshot.organization_ids) if snapshot else 0),
+            ("catalogue_snapshot_stale", "Whether the snapshot is behind the database",
+             int(snapshot is None or snapshot.version != get_data_version())),
+        ]
+        counters = [
+            ("catalogue_snapshot_full_loads_total", "Catalogue snapshot loads from all database rows", self.full_loads),
+            ("catalogue_snapshot_updates_total", "Catalogue snapshot updates from changed rows only", self.incremental_updates),
+        ]
+        return "".join(
+            f"# HELP {name} {description}\n# TYPE {name} {kind}\n{name} {value}\n"
+            for kind, metrics in (("gauge", gauges), ("counter", counters))
+            for name, description, value in metrics
+        )
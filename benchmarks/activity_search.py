@@ -0,0 +1,77 @@
+"""
+Бенчмарк поиска организаций по названию вида деятельности.
+
+Для растущего числа подходящих видов деятельности строит базу в памяти
+и измеряет число SQL-запросов и время crud.search_organization_ids_by_activity.
+Число запросов должно оставаться постоянным.
+
+Запуск: python -m benchmarks.activity_search
+"""
+import argparse
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import crud, models, schemas
+
+def build_catalogue(db, matches: int, children: int, organizations_per_activity: int):
+    building = models.Building(address="г. Москва, ул. Тестовая, 1", latitude=55.75, longitude=37.61)
+    db.add(building)
+    db.flush()
+
+    for i in range(matches):
+        parent = crud.create_activity(db, schemas.ActivityCreate(name=f"Мясная продукция {i}"))
+        for j in range(children):
+            child = crud.create_activity(
+                db, schemas.ActivityCreate(name=f"Товар {i}.{j}", parent_id=parent.id, level=2)
+            )
+            for k in range(organizations_per_activity):
+                crud.create_organization(db, schemas.OrganizationCreate(
+                    name=f"Организация {i}.{j}.{k}",
+                    building_id=building.id,
+                    phones=[],
+                    # Часть организаций пересекается между поддеревьями
+                    activities=[child.id, parent.id] if k % 2 else [child.id]
+                ))
+
+def measure(matches: int, children: int, organizations_per_activity: int, repeat: int):
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    build_catalogue(db, matches, children, organizations_per_activity)
+
+    queries = 0
+
+    def count_query(*args):
+        nonlocal queries
+        queries += 1
+
+    event.listen(engine, "before_cursor_execute", count_query)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        db.expunge_all()
+        found = crud.search_organization_ids_by_activity(db, "продукция", limit=500)
+    elapsed = (time.perf_counter() - started) / repeat
+    event.remove(engine, "before_cursor_execute", count_query)
+    db.close()
+    return len(found), queries // repeat, elapsed * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--matches", type=int, nargs="+", default=[1, 5, 20, 80])
+    parser.add_argument("--children", type=int, default=3)
+    parser.add_argument("--organizations", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'matches':>8} {'found':>8} {'queries':>8} {'ms':>10}")
+    for matches in args.matches:
+        found, queries, ms = measure(matches, args.children, args.organizations, args.repeat)
+        print(f"{matches:>8} {found:>8} {queries:>8} {ms:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Детерминированный генератор большого каталога организаций.
+
+Строит дерево видов деятельности заданной глубины и ветвистости, здания,
+сгруппированные вокруг реальных городов, и организации с телефонами
+и видами деятельности. Одинаковые параметры и seed дают одинаковые данные.
+
+Запуск: python -m benchmarks.catalogue --organizations 100000 --database-url sqlite:///./bench.db
+"""
+import argparse
+import math
+import random
+import time
+from typing import Dict, List, Tuple
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models
+from app.database import create_db_engine
+
+# Город, широта, долгота, вес (доля зданий) и разброс в градусах
+CITIES = [
+    ("Москва", 55.7558, 37.6173, 30, 0.12),
+    ("Санкт-Петербург", 59.9343, 30.3351, 15, 0.09),
+    ("Новосибирск", 55.0084, 82.9357, 7, 0.07),
+    ("Екатеринбург", 56.8389, 60.6057, 7, 0.06),
+    ("Казань", 55.7963, 49.1088, 6, 0.05),
+    ("Нижний Новгород", 56.2965, 43.9361, 6, 0.05),
+    ("Челябинск", 55.1644, 61.4368, 5, 0.05),
+    ("Самара", 53.1959, 50.1002, 5, 0.05),
+    ("Ростов-на-Дону", 47.2357, 39.7015, 5, 0.05),
+    ("Красноярск", 56.0153, 92.8932, 4, 0.05),
+    ("Владивосток", 43.1198, 131.8869, 3, 0.04),
+    ("Калининград", 54.7104, 20.4522, 3, 0.04),
+]
+STREETS = ["Ленина", "Мира", "Советская", "Гагарина", "Пушкина", "Садовая", "Лесная", "Заводская", "Блюхера", "Молодежная"]
+ACTIVITY_ROOTS = ["Еда", "Автомобили", "Строительство", "Одежда", "Здоровье", "Образование", "Услуги", "Электроника"]
+ACTIVITY_WORDS = ["продукция", "товары", "сервис", "запчасти", "материалы", "оборудование", "аксессуары", "ремонт"]
+NAME_PREFIXES = ["ООО", "АО", "ИП", "ПАО", "ЗАО"]
+NAME_WORDS = ["Рога и Копыта", "Молочный", "Мясной", "Северный", "Восток", "Альфа", "Меридиан", "Гранит", "Радуга", "Старт", "Союз", "Эталон"]
+# Коды городов для стационарных номеров (остальные номера - мобильные 9xx)
+LANDLINE_CODES = ["495", "499", "812", "383", "343", "843", "831", "351"]
+# Записи одного номера: с кодом страны, с восьмеркой и без префикса
+PHONE_FORMATS = ["+7 ({code}) {number}", "8 ({code}) {number}", "({code}) {number}"]
+
+CHUNK_SIZE = 5000
+
+def generate_activities(rng: random.Random, first_id: int, depth: int, fanout: int):
+    """
+    Возвращает строки видов деятельности и таблицы замыкания.
+    Корни берутся из ACTIVITY_ROOTS, у каждого узла fanout детей до глубины depth
+    """
+    activities = []
+    closure = []
+    next_id = first_id
+
+    def add(name: str, parent_id, level: int, ancestors: List[int]):
+        nonlocal next_id
+        activity_id = next_id
+        next_id += 1
+        activities.append({"id": activity_id, "name": name, "parent_id": parent_id, "level": level})
+        path = ancestors + [activity_id]
+        closure.extend(
+            {"ancestor_id": ancestor_id, "descendant_id": activity_id, "depth": len(path) - 1 - i}
+            for i, ancestor_id in enumerate(path)
+        )
+        if level < depth:
+            for child in range(fanout):
+                add(f"{name.split(' / ')[-1]} / {rng.choice(ACTIVITY_WORDS)} {level}.{child}", activity_id, level + 1, path)
+
+    for root in ACTIVITY_ROOTS[:max(1, fanout)]:
+        add(root, None, 1, [])
+    return activities, closure
+
+def generate_buildings(rng: random.Random, first_id: int, count: int):
+    weights = [city[3] for city in CITIES]
+    buildings = []
+    for building_id in range(first_id, first_id + count):
+        city, lat, lon, _, spread = rng.choices(CITIES, weights)[0]
+        # Нормальное распределение вокруг центра: плотный центр и редкие окраины
+        latitude = lat + rng.gauss(0, spread)
+        longitude = lon + rng.gauss(0, spread / math.cos(math.radians(lat)))
+        buildings.append({
+            "id": building_id,
+            "address": f"г. {city}, ул. {rng.choice(STREETS)} {rng.randint(1, 200)}",
+            "latitude": round(max(-90.0, min(90.0, latitude)), 6),
+            "longitude": round(max(-180.0, min(180.0, longitude)), 6)
+        })
+    return buildings
+
+def format_phone(rng: random.Random, national: str) -> str:
+    # Десятизначный национальный номер в одной из записей, которые нормализуются одинаково
+    code, number = national[:3], national[3:]
+    return rng.choice(PHONE_FORMATS).format(code=code, number=f"{number[:3]}-{number[3:5]}-{number[5:]}")
+
+def generate_phone(rng: random.Random, taken: set) -> Tuple[str, str]:
+    # Номера уникальны после нормализации: повторы генерируются заново
+    while True:
+        code = f"9{rng.randint(0, 99):02d}" if rng.random() < 0.5 else rng.choice(LANDLINE_CODES)
+        number = format_phone(rng, f"{code}{rng.randint(0, 9999999):07d}")
+        normalized = crud.normalize_phone_number(number)
+        if normalized not in taken:
+            taken.add(normalized)
+            return number, normalized
+
+def generate_catalogue(
+    database_url: str,
+    organizations: int,
+    organizations_per_building: int = 5,
+    activity_depth: int = 3,
+    activity_fanout: int = 5,
+    seed: int = 42,
+    derived: bool = True
+) -> Dict[str, float]:
+    """
+    Заполняет базу сгенерированным каталогом (добавляя к уже имеющимся данным)
+    и возвращает число созданных записей и время генерации
+    """
+    rng = random.Random(seed)
+    engine = create_db_engine(database_url)
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    started = time.perf_counter()
+
+    def next_id(column) -> int:
+        return (db.scalar(select(func.max(column))) or 0) + 1
+
+    def number_changes(rows: List[dict]) -> List[dict]:
+        # Номера изменений, как у записей, созданных через API
+        for row, seq in zip(rows, crud.next_change_seqs(db, len(rows))):
+            row["change_seq"] = seq
+        return rows
+
+    try:
+        activities, closure = generate_activities(
+            rng, next_id(models.Activity.id), activity_depth, activity_fanout
+        )
+        db.execute(insert(models.Activity), number_changes(activities))
+        db.execute(insert(models.activity_closure), closure)
+        # Организациям назначаем виды деятельности всех уровней, кроме корней
+        assignable = [activity["id"] for activity in activities if activity["parent_id"] is not None]
+        assignable = assignable or [activity["id"] for activity in activities]
+
+        building_count = max(1, organizations // organizations_per_building)
+        buildings = generate_buildings(rng, next_id(models.Building.id), building_count)
+        for start in range(0, len(buildings), CHUNK_SIZE):
+            db.execute(insert(models.Building), number_changes(buildings[start:start + CHUNK_SIZE]))
+        db.commit()
+
+        organization_id = next_id(models.Organization.id)
+        taken_numbers = set(db.scalars(
+            select(models.Phone.normalized_number).where(models.Phone.normalized_number.is_not(None))
+        ))
+        building_ids = [building["id"] for building in buildings]
+        for start in range(0, organizations, CHUNK_SIZE):
+            rows, phones, links = [], [], []
+            for _ in range(min(CHUNK_SIZE, organizations - start)):
+                rows.append({
+                    "id": organization_id,
+                    "name": f"{rng.choice(NAME_PREFIXES)} \"{rng.choice(NAME_WORDS)} {rng.randint(1, 9999)}\"",
+                    "building_id": rng.choice(building_ids)
+                })
+                for _ in range(rng.randint(1, 3)):
+                    number, normalized = generate_phone(rng, taken_numbers)
+                    phones.append({"number": number, "normalized_number": normalized, "organization_id": organization_id})
+                links.extend(
+                    {"organization_id": organization_id, "activity_id": activity_id}
+                    for activity_id in rng.sample(assignable, min(len(assignable), rng.randint(1, 3)))
+                )
+                organization_id += 1
+            db.execute(insert(models.Organization), number_changes(rows))
+            db.execute(insert(models.Phone), phones)
+            db.execute(insert(models.organization_activity), links)
+            if derived:
+                crud.sync_new_organizations(db, [row["id"] for row in rows])
+            db.commit()
+            db.expunge_all()
+    finally:
+        db.close()
+        engine.dispose()
+
+    return {
+        "activities": len(activities),
+        "buildings": len(buildings),
+        "organizations": organizations,
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", default="sqlite:///./bench.db")
+    parser.add_argument("--organizations", type=int, default=10_000)
+    parser.add_argument("--organizations-per-building", type=int, default=5)
+    parser.add_argument("--activity-depth", type=int, default=3)
+    parser.add_argument("--activity-fanout", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-derived", action="store_true", help="Не заполнять производные таблицы (документы, кластеры карты)")
+    args = parser.parse_args()
+
+    stats = generate_catalogue(
+        args.database_url,
+        args.organizations,
+        organizations_per_building=args.organizations_per_building,
+        activity_depth=args.activity_depth,
+        activity_fanout=args.activity_fanout,
+        seed=args.seed,
+        derived=not args.no_derived
+    )
+    print(", ".join(f"{key}: {value}" for key, value in stats.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Бенчмарк всех эндпоинтов /api/* внутри процесса через TestClient.
+
+Для каждого эндпоинта выполняет серию запросов с детерминированно
+выбранными параметрами и сообщает перцентили задержки p50/p95/p99,
+пропускную способность и число SQL-запросов на запрос. Результат
+пишется в JSON, чтобы сравнивать версии обычным diff.
+
+Запуск:
+    python -m benchmarks.catalogue --organizations 100000 --database-url sqlite:///./bench.db
+    python -m benchmarks.endpoints --database-url sqlite:///./bench.db --output bench.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from urllib.parse import quote
+from typing import Callable, Dict, List, Tuple
+
+# Эндпоинт: имя, метод и функция, возвращающая (путь, JSON-тело) для запроса
+Endpoint = Tuple[str, str, Callable[[random.Random], Tuple[str, dict]]]
+
+def build_endpoints(samples: Dict[str, list]) -> List[Endpoint]:
+    organization_ids = samples["organization_ids"]
+    building_ids = samples["building_ids"]
+    activity_ids = samples["activity_ids"]
+    points = samples["points"]
+    name_terms = samples["name_terms"]
+    activity_terms = samples["activity_terms"]
+    phone_numbers = samples["phone_numbers"]
+    change_seqs = samples["change_seqs"]
+
+    from app.crud import normalize_phone_number
+    from benchmarks.catalogue import format_phone
+
+    def phone(rng):
+        # Номер ищется в случайной записи, а не в той, в которой он сохранен
+        normalized = normalize_phone_number(rng.choice(phone_numbers))
+        return format_phone(rng, normalized[1:]) if len(normalized) == 11 else normalized
+
+    def point(rng):
+        latitude, longitude = rng.choice(points)
+        return {"latitude": latitude, "longitude": longitude}
+
+    def rectangle(rng):
+        center = point(rng)
+        return {
+            "center": center,
+            "rectangle": {
+                "north_west": {"latitude": center["latitude"] + 0.02, "longitude": center["longitude"] - 0.03},
+                "south_east": {"latitude": center["latitude"] - 0.02, "longitude": center["longitude"] + 0.03}
+            }
+        }
+
+    return [
+        ("list_organizations", "GET", lambda rng: ("/api/organizations/?limit=100", None)),
+        ("get_organization", "GET", lambda rng: (f"/api/organizations/{rng.choice(organization_ids)}", None)),
+        ("batch_lookup", "POST", lambda rng: ("/api/organizations/batch", {"ids": rng.sample(organization_ids, min(50, len(organization_ids)))})),
+        ("list_buildings", "GET", lambda rng: ("/api/buildings/?limit=100", None)),
+        ("list_activities", "GET", lambda rng: ("/api/activities/?limit=100", None)),
+        ("activity_tree", "GET", lambda rng: ("/api/activities/tree", None)),
+        ("by_building", "GET", lambda rng: (f"/api/organizations/building/{rng.choice(building_ids)}", None)),
+        ("by_activity", "GET", lambda rng: (f"/api/organizations/activity/{rng.choice(activity_ids)}?limit=100", None)),
+        ("geo_radius", "POST", lambda rng: ("/api/organizations/geo?limit=100", {"center": point(rng), "radius_km": 2})),
+        ("geo_rectangle", "POST", lambda rng: ("/api/organizations/geo?limit=100", rectangle(rng))),
+        ("geo_nearest", "POST", lambda rng: ("/api/organizations/geo/nearest", {"center": point(rng), "limit": 20})),
+        ("search_combined", "POST", lambda rng: ("/api/organizations/search?limit=100", {
+            "activity_id": rng.choice(activity_ids), "center": point(rng), "radius_km": 5, "name": rng.choice(name_terms)
+        })),
+        ("search_facets", "POST", lambda rng: ("/api/organizations/search/facets", {
+            "activity_id": rng.choice(activity_ids), "center": point(rng), "radius_km": 5
+        })),
+        ("map_clusters", "GET", lambda rng: (
+            "/api/organizations/clusters?min_lat={0}&max_lat={1}&min_lon={2}&max_lon={3}&zoom=11".format(
+                *(lambda center: (center["latitude"] - 0.1, center["latitude"] + 0.1,
+                                  center["longitude"] - 0.25, center["longitude"] + 0.25))(point(rng))
+            ), None
+        )),
+        ("search_name_fts", "GET", lambda rng: (f"/api/organizations/search/name?name={rng.choice(name_terms)}&limit=100", None)),
+        ("search_name_substring", "GET", lambda rng: (f"/api/organizations/search/name?name={rng.choice(name_terms)}&mode=substring&limit=100", None)),
+        ("search_activity", "GET", lambda rng: (f"/api/organizations/search/activity?activity_name={rng.choice(activity_terms)}&limit=100", None)),
+        ("export", "GET", lambda rng: ("/api/organizations/export", None)),
+        ("change_feed", "GET", lambda rng: (f"/api/changes?since={rng.choice(change_seqs)}&limit=500", None)),
+        ("search_phone", "GET", lambda rng: (f"/api/organizations/search/phone?number={quote(phone(rng))}", None)),
+        # Половина номеров пакета заведомо не зарегистрирована
+        ("match_phones", "POST", lambda rng: ("/api/organizations/search/phone", {"numbers": [
+            phone(rng) if index % 2 else f"+7 (800) {rng.randint(0, 9999999):07d}"
+            for index in range(1000)
+        ]})),
+    ]
+
+def collect_samples(db, rng: random.Random, size: int = 200) -> Dict[str, list]:
+    from sqlalchemy import select
+    from app import models
+
+    def sample(model, *columns) -> list:
+        # Строки читаются в порядке ключа и выбираются генератором с заданным seed,
+        # чтобы при одинаковом seed запросы совпадали от запуска к запуску
+        rows = [row[0] if len(row) == 1 else tuple(row) for row in db.execute(
+            select(*columns).order_by(model.id)
+        ).all()]
+        return rng.sample(rows, min(size, len(rows)))
+
+    organization_names = sample(models.Organization, models.Organization.name)
+    activity_names = sample(models.Activity, models.Activity.name)
+    return {
+        "organization_ids": sample(models.Organization, models.Organization.id),
+        "building_ids": sample(models.Building, models.Building.id),
+        "activity_ids": sample(models.Activity, models.Activity.id),
+        "points": sample(models.Building, models.Building.latitude, models.Building.longitude),
+        "name_terms": sorted({word for name in organization_names for word in name.replace('"', " ").split() if len(word) >= 3}),
+        "activity_terms": sorted({word for name in activity_names for word in name.split() if len(word) >= 4}),
+        "phone_numbers": sample(models.Phone, models.Phone.number),
+        "change_seqs": sample(models.Organization, models.Organization.change_seq),
+    }
+
+def percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(share * (len(ordered) - 1))))
+    return ordered[index]
+
+def run(database_url: str, requests: int, warmup: int, seed: int, only: List[str], snapshot: bool = False) -> dict:
+    # Настройки приложения читаются при импорте, поэтому окружение готовим заранее
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")
+    os.environ["SNAPSHOT_ENABLED"] = "true" if snapshot else "false"
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    from app.database import SessionLocal, engine, read_engine
+    from app.main import app
+
+    queries = 0
+
+    def count_query(*args):
+        nonlocal queries
+        queries += 1
+
+    engines = {engine, read_engine}
+    for counted in engines:
+        event.listen(counted, "before_cursor_execute", count_query)
+
+    rng = random.Random(seed)
+    db = SessionLocal()
+    try:
+        samples = collect_samples(db, rng)
+    finally:
+        db.close()
+
+    # Обработчики startup (загрузка снимка каталога) TestClient запускает только в контексте
+    with TestClient(app) as client:
+        results = {}
+        for name, method, make_request in build_endpoints(samples):
+            if only and name not in only:
+                continue
+            endpoint_rng = random.Random(f"{seed}:{name}")
+            for _ in range(warmup):
+                path, body = make_request(endpoint_rng)
+                client.request(method, path, json=body)
+
+            latencies, query_counts, statuses = [], [], {}
+            started = time.perf_counter()
+            for _ in range(requests):
+                path, body = make_request(endpoint_rng)
+                queries = 0
+                request_started = time.perf_counter()
+                response = client.request(method, path, json=body)
+                latencies.append((time.perf_counter() - request_started) * 1000)
+                query_counts.append(queries)
+                statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+            elapsed = time.perf_counter() - started
+
+            results[name] = {
+                "method": method,
+                "requests": requests,
+                "statuses": statuses,
+                "latency_ms": {
+                    "p50": round(percentile(latencies, 0.50), 3),
+                    "p95": round(percentile(latencies, 0.95), 3),
+                    "p99": round(percentile(latencies, 0.99), 3),
+                    "mean": round(statistics.fmean(latencies), 3),
+                    "max": round(max(latencies), 3)
+                },
+                "throughput_rps": round(requests / elapsed, 1),
+                "queries_per_request": {
+                    "mean": round(statistics.fmean(query_counts), 2),
+                    "max": max(query_counts)
+                }
+            }
+
+    for counted in engines:
+        event.remove(counted, "before_cursor_execute", count_query)
+
+    return {
+        "meta": {
+            "database_url": database_url,
+            "requests": requests,
+            "warmup": warmup,
+            "seed": seed,
+            "snapshot": snapshot,
+            "python": sys.version.split()[0]
+        },
+        "endpoints": results
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", default="sqlite:///./bench.db")
+    parser.add_argument("--requests", type=int, default=200, help="Запросов на эндпоинт")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", nargs="*", default=[], help="Имена эндпоинтов для запуска")
+    parser.add_argument("--output", help="Файл для JSON-результата")
+    parser.add_argument("--snapshot", action="store_true", help="Обслуживать чтения из снимка каталога в памяти")
+    args = parser.parse_args()
+
+    report = run(args.database_url, args.requests, args.warmup, args.seed, args.only, args.snapshot)
+
+    print(f"{'endpoint':<24} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8} {'queries':>8}")
+    for name, result in report["endpoints"].items():
+        latency = result["latency_ms"]
+        print(
+            f"{name:<24} {latency['p50']:>8.2f} {latency['p95']:>8.2f} {latency['p99']:>8.2f} "
+            f"{result['throughput_rps']:>8.1f} {result['queries_per_request']['mean']:>8.2f}"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, ensure_ascii=False, indent=2, sort_keys=True)
+            output.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Общие фикстуры проверок.
+
+Настройки приложения читаются при импорте, поэтому окружение готовится
+здесь, до импорта app: база - временный файл SQLite, кэш ответов
+и снимок каталога выключены, чтобы каждый запрос доходил до базы.
+Каталог генерируется один раз на весь запуск.
+"""
+import os
+import tempfile
+
+import pytest
+
+CATALOGUE_ORGANIZATIONS = 2000
+
+DATABASE_URL = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'tests.db')}"
+os.environ["DATABASE_URL"] = DATABASE_URL
+os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+os.environ["SNAPSHOT_ENABLED"] = "false"
+
+@pytest.fixture(scope="session")
+def catalogue() -> str:
+    # URL базы со сгенерированным каталогом
+    from benchmarks.catalogue import generate_catalogue
+
+    generate_catalogue(DATABASE_URL, CATALOGUE_ORGANIZATIONS)
+    return DATABASE_URL
+
+@pytest.fixture
+def db(catalogue):
+    from app.database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture(scope="module")
+def client(catalogue):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as client:
+        yield client
@@ -0,0 +1,46 @@
+"""
+Бенчмарк эндпоинтов: одинаковые запросы при одинаковом seed и охват маршрутов /api.
+"""
+import random
+from urllib.parse import urlsplit
+
+from fastapi.routing import APIRoute
+from starlette.routing import Match
+
+from benchmarks.endpoints import build_endpoints, collect_samples
+
+# Записи меняют каталог, и прогоны бенчмарка перестали бы быть сравнимыми
+WRITE_ROUTES = {
+    ("POST", "/api/organizations/"),
+    ("POST", "/api/organizations/bulk"),
+    ("POST", "/api/buildings/"),
+    ("POST", "/api/activities/"),
+}
+
+def _requests(samples: dict, seed: int) -> list:
+    requests = []
+    for name, method, make_request in build_endpoints(samples):
+        rng = random.Random(f"{seed}:{name}")
+        requests += [(name, method, *make_request(rng)) for _ in range(3)]
+    return requests
+
+def test_samples_and_requests_are_deterministic(db):
+    first = collect_samples(db, random.Random(42))
+    second = collect_samples(db, random.Random(42))
+    assert first == second
+    assert _requests(first, 42) == _requests(second, 42)
+    assert collect_samples(db, random.Random(43)) != first
+
+def test_benchmark_covers_every_read_route(db):
+    from app.main import app
+
+    routes = [route for route in app.routes if isinstance(route, APIRoute) and route.path.startswith("/api")]
+    covered = set()
+    for name, method, path, _ in _requests(collect_samples(db, random.Random(42)), 42):
+        scope = {"type": "http", "method": method, "path": urlsplit(path).path}
+        matched = [route for route in routes if route.matches(scope)[0] == Match.FULL]
+        assert matched, f"{name}: {method} {path} does not match any route"
+        covered.add((method, matched[0].path))
+
+    expected = {(method, route.path) for route in routes for method in route.methods} - WRITE_ROUTES
+    assert expected - covered == set()
@@ -0,0 +1,88 @@
+"""
+Лента изменений /api/changes: записи после since в порядке номеров,
+постраничный обход и пересчет документов организаций при новом дочернем виде.
+"""
+from typing import List, Tuple
+
+import pytest
+from sqlalchemy import select
+
+from app import models
+
+def _last_seq() -> int:
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return db.scalar(select(models.ChangeSequence.value).where(models.ChangeSequence.id == 1))
+    finally:
+        db.close()
+
+def _feed(client, since: int, limit: int = 500) -> dict:
+    response = client.get("/api/changes", params={"since": since, "limit": limit})
+    assert response.status_code == 200
+    return response.json()
+
+def _entries(feed: dict) -> List[Tuple[str, int]]:
+    return [(change["type"], change["id"]) for change in feed["changes"]]
+
+@pytest.fixture(scope="module")
+def building_id(client) -> int:
+    return client.get("/api/buildings/?limit=1").json()[0]["id"]
+
+def _create_organization(client, building_id: int, activities: list) -> dict:
+    response = client.post("/api/organizations/", json={
+        "name": "Проверка ленты", "building_id": building_id, "phones": [], "activities": activities
+    })
+    assert response.status_code == 200
+    return response.json()
+
+def _create_activity(client, name: str, parent_id=None, level: int = 1) -> dict:
+    response = client.post("/api/activities/", json={"name": name, "parent_id": parent_id, "level": level})
+    assert response.status_code == 200
+    return response.json()
+
+def test_feed_returns_new_records_in_seq_order(client):
+    since = _last_seq()
+    building = client.post("/api/buildings/", json={"address": "Проверка, 1", "latitude": 55.7, "longitude": 37.6}).json()
+    organization = _create_organization(client, building["id"], [])
+
+    feed = _feed(client, since)
+    assert _entries(feed) == [("building", building["id"]), ("organization", organization["id"])]
+    seqs = [change["seq"] for change in feed["changes"]]
+    assert seqs == sorted(seqs) and seqs[0] > since
+    assert feed["changes"][1]["data"]["building"]["id"] == building["id"]
+    assert feed["next_since"] == seqs[-1] and feed["has_more"] is False
+    # Дочитанная лента пуста, next_since не меняется
+    assert _feed(client, feed["next_since"]) == {"changes": [], "next_since": feed["next_since"], "has_more": False}
+
+def test_feed_pages_follow_next_since(client, building_id):
+    since = _last_seq()
+    created = [_create_organization(client, building_id, [])["id"] for _ in range(5)]
+
+    seen, pages = [], 0
+    while True:
+        feed = _feed(client, since, limit=2)
+        seen += [change["id"] for change in feed["changes"]]
+        since, pages = feed["next_since"], pages + 1
+        if not feed["has_more"]:
+            break
+    assert seen == created
+    # Пять записей по две: две полные страницы, третья - неполная
+    assert pages == 3
+
+def test_child_activity_restamps_parent_organizations(client, building_id):
+    grandparent = _create_activity(client, "Проверка ленты: корень")
+    parent = _create_activity(client, "Проверка ленты: вид", grandparent["id"], 2)
+    parent_organization = _create_organization(client, building_id, [parent["id"]])
+    grandparent_organization = _create_organization(client, building_id, [grandparent["id"]])
+    since = _last_seq()
+
+    child = _create_activity(client, "Проверка ленты: подвид", parent["id"], 3)
+
+    feed = _feed(client, since)
+    # Документ организации перечисляет дочерние виды только ее собственных видов
+    assert _entries(feed) == [("activity", child["id"]), ("organization", parent_organization["id"])]
+    assert grandparent_organization["id"] not in [change["id"] for change in feed["changes"]]
+    activity = feed["changes"][1]["data"]["activities"][0]
+    assert [item["id"] for item in activity["children"]] == [child["id"]]
@@ -0,0 +1,157 @@
+"""
+Согласованность кэшей между процессами.
+
+Два процесса uvicorn (как два воркера) работают над одним файлом SQLite
+с включенными кэшем ответов и снимком каталога. Чтения прогреваются
+во втором процессе, запись идет через первый; второй должен сразу
+отдавать новые данные.
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from email.message import Message
+from typing import Dict, Optional, Tuple
+
+import pytest
+
+from tests.conftest import CATALOGUE_ORGANIZATIONS
+
+STARTUP_TIMEOUT_SECONDS = 30
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def request(
+    base_url: str, method: str, path: str, body: Optional[dict] = None, headers: Optional[dict] = None
+) -> Tuple[int, Message, object]:
+    data = json.dumps(body).encode() if body is not None else None
+    http_request = urllib.request.Request(
+        base_url + path, data=data, method=method, headers={"Content-Type": "application/json", **(headers or {})}
+    )
+    try:
+        with urllib.request.urlopen(http_request) as response:
+            return response.status, response.headers, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, None
+
+def metrics(base_url: str) -> Dict[str, str]:
+    with urllib.request.urlopen(base_url + "/metrics") as response:
+        lines = response.read().decode().splitlines()
+    return dict(line.split(" ", 1) for line in lines if line and not line.startswith("#"))
+
+def start_worker(database_url: str) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    environment = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        RESPONSE_CACHE_ENABLED="true",
+        SNAPSHOT_ENABLED="true",
+        WATCH_EXTERNAL_WRITES="true"
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=environment
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        try:
+            if request(base_url, "GET", "/api/buildings/?limit=1")[0] == 200:
+                return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Worker on port {port} did not start")
+
+@pytest.fixture(scope="module")
+def workers(tmp_path_factory):
+    # Отдельная база: проверки пишут в нее из других процессов
+    from benchmarks.catalogue import generate_catalogue
+
+    database_url = f"sqlite:///{tmp_path_factory.mktemp('coherence') / 'coherence.db'}"
+    generate_catalogue(database_url, CATALOGUE_ORGANIZATIONS)
+    processes = []
+    try:
+        writer, writer_url = start_worker(database_url)
+        processes.append(writer)
+        reader, reader_url = start_worker(database_url)
+        processes.append(reader)
+        yield writer_url, reader_url
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+def building_page(base_url: str) -> str:
+    building_id = request(base_url, "GET", "/api/buildings/?limit=1")[2][0]["id"]
+    return f"/api/organizations/building/{building_id}?limit=500"
+
+def create_organization(base_url: str, path: str) -> dict:
+    building_id = int(path.split("/")[-1].split("?")[0])
+    status, _, created = request(base_url, "POST", "/api/organizations/", {
+        "name": "Проверка согласованности", "building_id": building_id, "phones": [], "activities": []
+    })
+    assert status == 200
+    return created
+
+def test_workers_share_etag(workers):
+    writer_url, reader_url = workers
+    path = building_page(reader_url)
+    # Два чтения подряд: второе приходит из кэша ответов второго процесса
+    request(reader_url, "GET", path)
+    _, headers, _ = request(reader_url, "GET", path)
+    assert headers.get("x-cache") == "HIT"
+    # ETag строится из общего номера изменения, поэтому его принимает любой воркер
+    etag = request(writer_url, "GET", path)[1].get("etag")
+    assert etag is not None and etag == headers.get("etag")
+    status, _, _ = request(reader_url, "GET", path, headers={"If-None-Match": etag})
+    assert status == 304
+
+def test_reader_sees_new_organization(workers):
+    writer_url, reader_url = workers
+    path = building_page(reader_url)
+    request(reader_url, "GET", path)
+    _, _, before = request(reader_url, "GET", path)
+    created = create_organization(writer_url, path)
+
+    _, headers, after = request(reader_url, "GET", path)
+    assert headers.get("x-cache") != "HIT"
+    assert [organization["id"] for organization in after] == [organization["id"] for organization in before] + [created["id"]]
+    status, _, document = request(reader_url, "GET", f"/api/organizations/{created['id']}")
+    assert status == 200 and document["name"] == created["name"]
+
+def test_reader_sees_new_activity(workers):
+    writer_url, reader_url = workers
+    request(reader_url, "GET", "/api/activities/tree")
+    status, _, activity = request(writer_url, "POST", "/api/activities/", {"name": "Проверка", "level": 1})
+    assert status == 200
+    _, _, activities = request(reader_url, "GET", "/api/activities/?limit=500")
+    assert activity["id"] in [item["id"] for item in activities]
+    _, _, forest = request(reader_url, "GET", "/api/activities/tree")
+    assert activity["id"] in [root["id"] for root in forest]
+
+def test_reader_snapshot_applies_changes_incrementally(workers):
+    writer_url, reader_url = workers
+    created = create_organization(writer_url, building_page(writer_url))
+    # Чтение замечает устаревший снимок и запускает его сборку в фоне;
+    # до ее окончания второй процесс отвечает из базы
+    status, _, _ = request(reader_url, "GET", f"/api/organizations/{created['id']}")
+    assert status == 200
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    reader_metrics = metrics(reader_url)
+    while reader_metrics.get("catalogue_snapshot_stale") != "0" and time.monotonic() < deadline:
+        time.sleep(0.2)
+        reader_metrics = metrics(reader_url)
+    assert reader_metrics.get("catalogue_snapshot_stale") == "0"
+    # Изменения дочитываются к имеющемуся снимку без полной перезагрузки
+    assert reader_metrics.get("catalogue_snapshot_full_loads_total") == "1"
+    assert int(reader_metrics.get("catalogue_snapshot_updates_total", "0")) >= 1
+    _, _, document = request(reader_url, "GET", f"/api/organizations/{created['id']}")
+    assert document is not None and document["id"] == created["id"]
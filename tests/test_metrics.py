@@ -0,0 +1,63 @@
+"""
+Метрики запросов: заголовок Server-Timing и серии /metrics по шаблону маршрута.
+"""
+import re
+
+from app.metrics import MetricsMiddleware, MetricsRegistry
+
+SERVER_TIMING = re.compile(
+    r'db;dur=[0-9.]+;desc="(\d+) queries", db-slowest;dur=[0-9.]+, serialize;dur=[0-9.]+, total;dur=[0-9.]+'
+)
+
+def _series(text: str, name: str) -> dict:
+    # Значения серий метрики по строке меток
+    values = {}
+    for line in text.splitlines():
+        if line.startswith(name + "{"):
+            labels, value = line[len(name):].rsplit(" ", 1)
+            values[labels] = float(value)
+    return values
+
+def test_response_has_server_timing(client, db):
+    from app import models
+
+    organization_id = db.query(models.Organization.id).first()[0]
+    response = client.get(f"/api/organizations/{organization_id}")
+    assert response.status_code == 200
+    match = SERVER_TIMING.fullmatch(response.headers["server-timing"])
+    assert match is not None, response.headers["server-timing"]
+    # Кэш выключен, поэтому ответ читается из базы
+    assert int(match.group(1)) >= 1
+
+def test_metrics_are_labelled_by_route_template(client, db):
+    from app import models
+
+    organization_ids = [row[0] for row in db.query(models.Organization.id).limit(3)]
+    before = _series(client.get("/metrics").text, "http_requests_total")
+    for organization_id in organization_ids:
+        client.get(f"/api/organizations/{organization_id}")
+    after = _series(client.get("/metrics").text, "http_requests_total")
+
+    series = '{method="GET",route="/api/organizations/{organization_id}",status="200"}'
+    assert after[series] - before.get(series, 0) == len(organization_ids)
+    # ID не попадают в метки: число серий не растет с числом организаций
+    assert not any(f'route="/api/organizations/{organization_id}"' in labels for labels in after for organization_id in organization_ids)
+
+def test_response_before_routing_is_labelled_with_route(client):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    async def not_modified(scope, receive, send):
+        # Ответ без маршрутизации, как у кэша ответов или If-None-Match
+        await send({"type": "http.response.start", "status": 304, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    registry = MetricsRegistry()
+    # Без контекста TestClient не шлет события lifespan, которых приложение-заглушка не знает
+    cached_client = TestClient(MetricsMiddleware(not_modified, registry=registry, routes=app.router.routes))
+    response = cached_client.get("/api/organizations/1")
+    cached_client.get("/no/such/path")
+    assert "server-timing" in response.headers
+    series = _series(registry.render(), "http_requests_total")
+    assert series['{method="GET",route="/api/organizations/{organization_id}",status="304"}'] == 1
+    assert series['{method="GET",route="<unmatched>",status="304"}'] == 1
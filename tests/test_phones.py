@@ -0,0 +1,60 @@
+"""
+Нормализация телефонов и уникальный индекс нормализованных номеров.
+
+Номера в проверках - с кодом 800, которого нет в сгенерированном каталоге.
+"""
+import pytest
+
+from app import crud
+
+@pytest.mark.parametrize("number", [
+    "+7 (999) 111-22-33", "8 (999) 111-22-33", "8-999-111-22-33", "(999) 111-22-33", "9991112233", "79991112233"
+])
+def test_mobile_number_formats_normalize_alike(number):
+    assert crud.normalize_phone_number(number) == "79991112233"
+
+@pytest.mark.parametrize("number", ["(495) 123-45-67", "8 (495) 123-45-67", "+7 495 123 45 67"])
+def test_landline_number_gets_country_code(number):
+    assert crud.normalize_phone_number(number) == "74951234567"
+
+@pytest.mark.parametrize("number", ["222-22-22", "2-22-22", "доб. 123", ""])
+def test_short_number_is_not_normalized(number):
+    assert crud.normalize_phone_number(number) is None
+
+def _create(client, building_id: int, phones: list):
+    return client.post("/api/organizations/", json={
+        "name": "Проверка телефонов", "building_id": building_id, "phones": phones, "activities": []
+    })
+
+@pytest.fixture(scope="module")
+def building_id(client) -> int:
+    return client.get("/api/buildings/?limit=1").json()[0]["id"]
+
+def test_same_number_in_another_format_is_rejected(client, building_id):
+    assert _create(client, building_id, ["+7 (800) 100-00-01"]).status_code == 200
+    response = _create(client, building_id, ["8-800-100-00-01"])
+    assert response.status_code == 409
+    assert "78001000001" in response.json()["detail"]
+
+def test_short_number_can_belong_to_several_organizations(client, building_id):
+    first = _create(client, building_id, ["222-22-22"])
+    second = _create(client, building_id, ["222-22-22"])
+    assert first.status_code == 200 and second.status_code == 200
+    # Короткий номер не ищется: по нему нельзя выбрать одну организацию
+    assert client.get("/api/organizations/search/phone", params={"number": "222-22-22"}).status_code == 404
+
+def test_lookup_finds_number_written_differently(client, building_id):
+    created = _create(client, building_id, ["8 (800) 100-00-02"]).json()
+    response = client.get("/api/organizations/search/phone", params={"number": "+7 800 100 00 02"})
+    assert response.status_code == 200 and response.json()["id"] == created["id"]
+
+def test_batch_match_keeps_request_order(client, building_id):
+    created = _create(client, building_id, ["(800) 100-00-03"]).json()
+    numbers = ["8 800 100-00-04", "+7 (800) 100-00-03", "222-22-22"]
+    response = client.post("/api/organizations/search/phone", json={"numbers": numbers})
+    assert response.status_code == 200
+    assert response.json() == [
+        {"number": numbers[0], "normalized_number": "78001000004", "organization_id": None},
+        {"number": numbers[1], "normalized_number": "78001000003", "organization_id": created["id"]},
+        {"number": numbers[2], "normalized_number": None, "organization_id": None},
+    ]
@@ -0,0 +1,127 @@
+"""
+Число SQL-запросов списковых и поисковых эндпоинтов.
+
+Каждый эндпоинт, возвращающий страницу или пакет, вызывается с размером
+1 и 100. Число запросов не должно зависеть от размера страницы: разница
+означает ленивую загрузку по строке (N+1).
+"""
+import math
+from typing import Callable, Dict, Tuple
+
+import pytest
+from sqlalchemy import event, func, select
+
+from app import crud, models, schemas
+
+PAGE_SIZES = (1, 100)
+
+# Поиск ближайших удваивает радиус, пока не наберет limit организаций, и делает
+# по запросу на шаг, поэтому число запросов законно растет с limit. Шагов не больше,
+# чем удвоений от стартового радиуса до предельного, и еще один - сам предельный радиус
+NEAREST_RADIUS_STEPS = math.ceil(
+    math.log(schemas.MAX_NEAREST_RADIUS_KM / crud.KNN_INITIAL_RADIUS_KM, crud.KNN_RADIUS_GROWTH)
+) + 1
+# Кроме шагов - выборка организаций вида деятельности и запрос документов
+NEAREST_QUERY_CEILING = NEAREST_RADIUS_STEPS + 2
+
+def _center(s) -> dict:
+    return {"latitude": s["latitude"], "longitude": s["longitude"]}
+
+def _rectangle(s) -> dict:
+    return {
+        "north_west": {"latitude": s["latitude"] + 0.2, "longitude": s["longitude"] - 0.3},
+        "south_east": {"latitude": s["latitude"] - 0.2, "longitude": s["longitude"] + 0.3}
+    }
+
+# Эндпоинт: имя -> (метод, функция образцов и размера страницы, возвращающая (путь, JSON-тело))
+SIZED_ENDPOINTS: Dict[str, Tuple[str, Callable]] = {
+    "list_organizations": ("GET", lambda s, size: (f"/api/organizations/?limit={size}", None)),
+    "batch_lookup": ("POST", lambda s, size: ("/api/organizations/batch", {"ids": s["organization_ids"][:size]})),
+    "list_buildings": ("GET", lambda s, size: (f"/api/buildings/?limit={size}", None)),
+    "list_activities": ("GET", lambda s, size: (f"/api/activities/?limit={size}", None)),
+    "by_building": ("GET", lambda s, size: (f"/api/organizations/building/{s['building_id']}?limit={size}", None)),
+    "by_activity": ("GET", lambda s, size: (f"/api/organizations/activity/{s['activity_id']}?limit={size}", None)),
+    "geo_radius": ("POST", lambda s, size: (f"/api/organizations/geo?limit={size}", {"center": _center(s), "radius_km": 20})),
+    "geo_rectangle": ("POST", lambda s, size: (f"/api/organizations/geo?limit={size}", {"center": _center(s), "rectangle": _rectangle(s)})),
+    "geo_nearest": ("POST", lambda s, size: ("/api/organizations/geo/nearest", {"center": _center(s), "limit": size})),
+    "search_combined": ("POST", lambda s, size: (f"/api/organizations/search?limit={size}", {
+        "activity_id": s["activity_id"], "rectangle": _rectangle(s)
+    })),
+    "search_name_fts": ("GET", lambda s, size: (f"/api/organizations/search/name?name=Альфа&limit={size}", None)),
+    "search_name_substring": ("GET", lambda s, size: (f"/api/organizations/search/name?name=Альфа&mode=substring&limit={size}", None)),
+    "search_activity": ("GET", lambda s, size: (f"/api/organizations/search/activity?activity_name=товары&limit={size}", None)),
+    "match_phones": ("POST", lambda s, size: ("/api/organizations/search/phone", {"numbers": s["phone_numbers"][:size]})),
+    "change_feed": ("GET", lambda s, size: (f"/api/changes?since=0&limit={size}", None)),
+}
+
+@pytest.fixture(scope="module")
+def samples(catalogue) -> Dict[str, object]:
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        # Самое заполненное здание и корневой вид деятельности
+        building_id = db.scalar(
+            select(models.Organization.building_id).group_by(models.Organization.building_id)
+            .order_by(func.count().desc(), models.Organization.building_id).limit(1)
+        )
+        building = db.get(models.Building, building_id)
+        return {
+            "organization_ids": list(db.scalars(select(models.Organization.id).order_by(models.Organization.id).limit(max(PAGE_SIZES)))),
+            "phone_numbers": list(db.scalars(select(models.Phone.number).order_by(models.Phone.id).limit(max(PAGE_SIZES)))),
+            "building_id": building_id,
+            "activity_id": db.scalar(select(models.Activity.id).where(models.Activity.parent_id.is_(None)).order_by(models.Activity.id)),
+            "latitude": building.latitude,
+            "longitude": building.longitude,
+        }
+    finally:
+        db.close()
+
+@pytest.fixture
+def count_queries(catalogue):
+    # Счетчик SQL-запросов ко всем движкам приложения
+    from app.database import engine, read_engine
+
+    counter = {"queries": 0}
+
+    def count(*args):
+        counter["queries"] += 1
+
+    engines = {engine, read_engine}
+    for counted in engines:
+        event.listen(counted, "before_cursor_execute", count)
+    yield counter
+    for counted in engines:
+        event.remove(counted, "before_cursor_execute", count)
+
+def _query_counts(client, counter, samples, name) -> list:
+    method, make_request = SIZED_ENDPOINTS[name]
+    # Первый вызов прогревает кэши процесса (дерево видов деятельности)
+    path, body = make_request(samples, PAGE_SIZES[0])
+    client.request(method, path, json=body)
+    counts = []
+    for size in PAGE_SIZES:
+        path, body = make_request(samples, size)
+        counter["queries"] = 0
+        response = client.request(method, path, json=body)
+        assert response.status_code == 200, f"{method} {path}: {response.text}"
+        counts.append(counter["queries"])
+    return counts
+
+@pytest.mark.parametrize("name", [name for name in SIZED_ENDPOINTS if name != "geo_nearest"])
+def test_query_count_does_not_depend_on_page_size(client, count_queries, samples, name):
+    counts = _query_counts(client, count_queries, samples, name)
+    assert len(set(counts)) == 1, f"queries for page sizes {PAGE_SIZES}: {counts}"
+
+def test_nearest_query_count_is_bounded(client, count_queries, samples):
+    counts = _query_counts(client, count_queries, samples, "geo_nearest")
+    assert max(counts) <= NEAREST_QUERY_CEILING, f"queries for limits {PAGE_SIZES}: {counts}"
+
+def test_nearest_query_count_is_bounded_far_from_organizations(client, count_queries):
+    # Худший случай: вокруг точки нет организаций, и радиус растет до предельного
+    count_queries["queries"] = 0
+    response = client.post("/api/organizations/geo/nearest", json={
+        "center": {"latitude": -60, "longitude": -120}, "limit": max(PAGE_SIZES)
+    })
+    assert response.status_code == 200 and response.json() == []
+    assert count_queries["queries"] <= NEAREST_QUERY_CEILING
@@ -0,0 +1,147 @@
+"""
+Планы запросов горячих путей crud.py.
+
+Каждая функция вызывается на сгенерированном каталоге, выполненные ею
+SQL-запросы перехватываются и прогоняются через EXPLAIN QUERY PLAN.
+Полный просмотр (SCAN) таблицы каталога вне списка ожидаемых - регрессия.
+"""
+import re
+from typing import Callable, Dict, List
+
+import pytest
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import sessionmaker
+
+from app import clusters, crud, models, schemas
+from app.database import create_db_engine
+
+CATALOGUE_TABLES = {
+    "organizations", "buildings", "activities", "phones", "organization_phones",
+    "organization_activity", "activity_closure", "organization_documents",
+    "organization_clusters", "organization_cluster_activities",
+}
+
+# Полные просмотры, заложенные в сам запрос: поиск подстроки через ILIKE
+# не может использовать B-tree индекс, а дерево видов деятельности читается целиком
+EXPECTED_SCANS = {
+    "search_organization_ids_by_name": {"organizations"},
+    "search_organization_ids_by_activity": {"activities"},
+    "build_activity_forest": {"activities"},
+    # Поддеревья видов и названия для счетчиков берутся из дерева, которое собирается при первом вызове
+    "get_activities": {"activities"},
+    "get_search_facets": {"activities"},
+}
+
+SCAN_PATTERN = re.compile(r"\bSCAN (\w+)")
+
+def _center(samples) -> schemas.GeoPoint:
+    return schemas.GeoPoint(latitude=samples["latitude"], longitude=samples["longitude"])
+
+def _rectangle(samples) -> schemas.GeoRectangle:
+    center = _center(samples)
+    return schemas.GeoRectangle(
+        north_west=schemas.GeoPoint(latitude=center.latitude + 0.05, longitude=center.longitude - 0.05),
+        south_east=schemas.GeoPoint(latitude=center.latitude - 0.05, longitude=center.longitude + 0.05)
+    )
+
+# Горячий путь: имя -> вызов с сессией и образцами данных. Страницы берутся
+# со смещенным курсором: первая страница keyset-выборки законно читает
+# таблицу с начала до LIMIT
+HOT_PATHS: Dict[str, Callable] = {
+    "get_activities": lambda db, s: crud.get_activities(db, after_id=s["activity_id"]),
+    "get_buildings": lambda db, s: crud.get_buildings(db, after_id=s["building_id"]),
+    "get_organization": lambda db, s: crud.get_organization(db, s["organization_id"]),
+    "get_organization_ids": lambda db, s: crud.get_organization_ids(db, after_id=s["organization_id"]),
+    "get_organizations_by_ids": lambda db, s: crud.get_organizations_by_ids(db, [s["organization_id"], s["organization_id"] + 1]),
+    "get_organization_documents": lambda db, s: crud.get_organization_documents(db, [s["organization_id"], s["organization_id"] + 1]),
+    "get_organization_ids_by_building": lambda db, s: crud.get_organization_ids_by_building(db, s["building_id"]),
+    "get_organization_ids_by_activity": lambda db, s: crud.get_organization_ids_by_activity(db, s["activity_id"]),
+    "build_activity_forest": lambda db, s: crud.build_activity_forest(db),
+    "get_child_activity_ids": lambda db, s: crud.get_child_activity_ids(db, s["activity_id"]),
+    "get_organization_ids_by_radius": lambda db, s: crud.get_organization_ids_by_radius(db, _center(s), 2),
+    "get_organization_ids_by_rectangle": lambda db, s: crud.get_organization_ids_by_rectangle(db, _rectangle(s)),
+    "get_nearest_organization_ids": lambda db, s: crud.get_nearest_organization_ids(db, _center(s), activity_id=s["activity_id"]),
+    "search_organization_ids_full_text": lambda db, s: crud.search_organization_ids_full_text(db, "Альфа"),
+    "search_organization_ids_by_name": lambda db, s: crud.search_organization_ids_by_name(db, "Альфа"),
+    "search_organization_ids_by_activity": lambda db, s: crud.search_organization_ids_by_activity(db, "товары"),
+    "search_organization_ids_combined": lambda db, s: crud.search_organization_ids_combined(db, schemas.CombinedSearchParams(
+        activity_id=s["activity_id"], name="Альфа", center=_center(s), radius_km=5
+    )),
+    "get_search_facets": lambda db, s: crud.get_search_facets(db, schemas.CombinedSearchParams(
+        activity_id=s["activity_id"], center=_center(s), radius_km=5
+    )),
+    "get_organization_id_by_phone": lambda db, s: crud.get_organization_id_by_phone(db, s["phone_number"]),
+    "get_organization_ids_by_phones": lambda db, s: crud.get_organization_ids_by_phones(db, [s["phone_number"], "+7 (800) 000-00-00"]),
+    "get_clusters": lambda db, s: clusters.get_clusters(db, schemas.ClusterSearchParams(
+        min_lat=s["latitude"] - 0.1, max_lat=s["latitude"] + 0.1,
+        min_lon=s["longitude"] - 0.25, max_lon=s["longitude"] + 0.25, zoom=11
+    )),
+    "get_changes": lambda db, s: crud.get_changes(db, after_seq=s["change_seq"]),
+    "get_change_documents": lambda db, s: crud.get_change_documents(db, crud.get_changes(db, after_seq=s["change_seq"], limit=50)),
+    "mark_changed": lambda db, s: crud.mark_changed(db, models.Organization, [s["organization_id"]]),
+    "sync_new_organizations": lambda db, s: crud.sync_new_organizations(db, [s["organization_id"]]),
+    "refresh_organization_documents": lambda db, s: crud.refresh_organization_documents(db, [s["organization_id"]]),
+}
+
+@pytest.fixture(scope="module")
+def engine(catalogue):
+    engine = create_db_engine(catalogue)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture(scope="module")
+def samples(engine) -> Dict[str, object]:
+    db = sessionmaker(bind=engine)()
+    try:
+        organization = db.get(models.Organization, db.scalar(select(func.max(models.Organization.id))) // 2)
+        return {
+            "organization_id": organization.id,
+            "building_id": organization.building_id,
+            "activity_id": db.scalar(select(models.Activity.id).where(models.Activity.parent_id.is_(None))),
+            "latitude": organization.building.latitude,
+            "longitude": organization.building.longitude,
+            "phone_number": organization.phones[0].number,
+            "change_seq": organization.change_seq,
+        }
+    finally:
+        db.close()
+
+def explain(connection, statement: str, parameters) -> List[str]:
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return [row[3] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+@pytest.mark.parametrize("name", HOT_PATHS)
+def test_hot_path_uses_indexes(engine, samples, name):
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")):
+            captured.append((statement, parameters))
+
+    db = sessionmaker(bind=engine)()
+    try:
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            HOT_PATHS[name](db, samples)
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+
+        connection = db.connection()
+        scans, plans = set(), []
+        for statement, parameters in captured:
+            plan = explain(connection, statement, parameters)
+            plans.append(" ".join(statement.split()) + "\n  " + "\n  ".join(plan))
+            scans.update(
+                table for line in plan for table in SCAN_PATTERN.findall(line)
+                if table in CATALOGUE_TABLES
+            )
+    finally:
+        db.rollback()
+        db.close()
+
+    unexpected = scans - EXPECTED_SCANS.get(name, set())
+    assert not unexpected, f"full scan of {sorted(unexpected)}:\n" + "\n".join(plans)